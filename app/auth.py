@@ -124,17 +124,17 @@ def get_current_username_admin(
     return user
 
 
+def has_project_access(user: User, projectName: str):
+    if user.is_admin:
+        return True
+    return any(project.name == projectName for project in user.projects)
+
+
 def get_current_username_project(
     projectName: str,
     user: User = Depends(get_current_username)
 ):
-    found = False
-    if not user.is_admin:
-        for project in user.projects:
-            if project.name == projectName:
-                found = True
-    else:
-        found = True
+    found = has_project_access(user, projectName)
 
     if not found:
         raise HTTPException(
@@ -1,77 +1,208 @@
+import copy
+import gc
 import json
 import logging
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from llama_index.embeddings.langchain import LangchainEmbedding
-import ollama
+import numpy as np
 from app.memory import Recollection
 from app.vectordb import tools as vector_tools
 from app import tools
+from app.budget import StageTimes
+from app.cache import TTLCache
+from app.cascade import CascadeStats
+from app.config import RESTAI_CHAT_SUMMARY_LLM, RESTAI_GUARD_CACHE_TTL, RESTAI_LLM_CACHE_BUDGET, RESTAI_LLM_CACHE_CHECK, RESTAI_OLLAMA_KEEP_ALIVE_MAX, RESTAI_RERANK_CACHE_TTL, RESTAI_ROUTER_CACHE_TTL, RESTAI_SQL_CACHE_TTL, RESTAI_SQL_POOL_OVERFLOW, RESTAI_SQL_POOL_SIZE, RESTAI_SQL_RESULT_TTL, RESTAI_SQL_SCHEMA_TTL, RESTAI_THREADS
 from app.llm import LLM
+from app.llms.admission import Admission, AdmittedLLM
+from app.llms.registry import ModelRegistry
+from app.llms.residency import ResidencyManager
 from app.models.models import LLMModel, ProjectModel
 from app.project import Project
+from app.schema import SchemaIndex
 from modules.embeddings import EMBEDDINGS
 from app.database import dbc
+from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
+from llama_index.core.utilities.sql_wrapper import SQLDatabase
 from transformers import pipeline
 from llama_index.core.tools import FunctionTool
 
 
 class Brain:
     def __init__(self):
-        self.llmCache = {}
+        self.llmCache = OrderedDict()
+        self.llmLock = threading.RLock()
+        self.llmLoads = {}
+        self.admissions = {}
         self.embeddingCache = {}
         self.defaultCensorship = "I'm sorry, I don't know the answer to that."
         self.defaultSystem = ""
         self.memories = Recollection()
         self.tools = tools.load_tools()
+        self.executor = ThreadPoolExecutor(max_workers=RESTAI_THREADS)
+        self.modelRegistry = ModelRegistry(self.executor)
+        self.residency = ResidencyManager(self.modelRegistry, self.executor)
+        self.cascadeStats = CascadeStats()
+        self.stageTimes = StageTimes()
+        self.rerankCache = TTLCache(ttl=RESTAI_RERANK_CACHE_TTL, maxsize=50000)
+        self.guardCache = TTLCache(ttl=RESTAI_GUARD_CACHE_TTL)
+        self.routerCache = {}
+        self.routeCache = TTLCache(ttl=RESTAI_ROUTER_CACHE_TTL)
+        self.sqlEngines = {}
+        self.sqlDatabases = {}
+        self.sqlLock = threading.Lock()
+        self.schemaIndexes = {}
+        self.sqlCache = TTLCache(ttl=RESTAI_SQL_CACHE_TTL)
+        self.sqlResultCache = TTLCache(ttl=RESTAI_SQL_RESULT_TTL, maxsize=1000)
 
     def memoryModelsInfo(self):
         models = []
-        for llmr, mr in self.llmCache.items():
-            if mr.privacy == "private":
-                models.append(llmr)
+        with self.llmLock:
+            for llmr, mr in self.llmCache.items():
+                if mr.size > 0:
+                    models.append({"name": llmr, "privacy": mr.props.privacy, "size": mr.size})
         return models
 
-    def getLLM(self, llmName, db: Session, **kwargs):      
-        llm = None
-      
-        if llmName in self.llmCache:
-            llm = self.llmCache[llmName]
-        else:
+    def getLLM(self, llmName, db: Session, check: bool = True, admit: bool = False, **kwargs):      
+        with self.llmLock:
+            llm = self.llmCache.get(llmName)
+            if llm is not None:
+                self.llmCache.move_to_end(llmName)
+
+        if llm is None or time.monotonic() - llm.checked > RESTAI_LLM_CACHE_CHECK:
             llm = self.loadLLM(llmName, db)
+
+        if llm is None:
+            return None
         
-        if hasattr(llm, "props") and llm.props.class_name == "Ollama":
-            model_name = json.loads(llm.props.options).get("model")
-            try:
-                ollama.show(model_name)
-            except Exception as e:
-              if e.status_code == 404:
-                  print("Model not found, pulling " + model_name + " from Ollama")
-                  ollama.pull(model_name)
-              else:
-                  raise e
+        if check and hasattr(llm, "props") and llm.props.class_name in ["Ollama", "OllamaMultiModal2"]:
+            options = json.loads(llm.props.options)
+            self.modelRegistry.ensure(options.get("hosts") or [options.get("base_url")], options.get("model"))
                 
         if hasattr(llm.llm, 'system_prompt'):
             llm.llm.system_prompt = None
+
+        if admit:
+            # calls outside the request's own LLM take their own admission slot
+            admission = self.admission(llmName, db)
+            llm = copy.copy(llm)
+            llm.llm = AdmittedLLM(llm.llm, admission)
         
         return llm
     
+    def touchLLM(self, llmName, db: Session):
+        # called once per request, keep_alive is a per model setting so it is only written when it changes
+        if RESTAI_OLLAMA_KEEP_ALIVE_MAX <= 0:
+            return
+
+        llm = self.getLLM(llmName, db, check=False)
+        if llm is None or not hasattr(llm, "props") or llm.props.class_name not in ["Ollama", "OllamaMultiModal2"]:
+            return
+
+        options = json.loads(llm.props.options)
+        keep_alive = options.get("keep_alive")
+        if isinstance(keep_alive, (int, float)) and keep_alive < 0:
+            return
+
+        keep_alive = self.residency.touch(llmName, options.get("model"), options.get("hosts") or [options.get("base_url")])
+        if llm.llm.keep_alive != keep_alive:
+            llm.llm.keep_alive = keep_alive
+
+    def summaryLLM(self, db: Session):
+        if not RESTAI_CHAT_SUMMARY_LLM:
+            return None
+        model = self.getLLM(RESTAI_CHAT_SUMMARY_LLM, db, check=False, admit=True)
+        return model.llm if model is not None else None
+
     def loadLLM(self, llmName, db: Session):
+        # one load per name at a time, concurrent first requests wait for it instead of building their own copy
+        with self.llmLock:
+            loading = self.llmLoads.setdefault(llmName, threading.Lock())
+
+        with loading:
+            return self._loadLLM(llmName, db)
+
+    def _loadLLM(self, llmName, db: Session):
         llm_db = dbc.get_llm_by_name(db, llmName)
 
         if llm_db is not None:
             llmm = LLMModel.model_validate(llm_db)
+            version = TTLCache.key(llmm.class_name, llmm.options, llmm.privacy, llmm.type)
+
+            with self.llmLock:
+                cached = self.llmCache.get(llmName)
+                if cached is not None and cached.version == version:
+                    cached.checked = time.monotonic()
+                    cached.props = llmm
+                    return cached
 
-            llm = tools.getLLMClass(llmm.class_name)(**json.loads(llmm.options))
+            if cached is not None:
+                self.unloadLLM(llmName)
 
-            if llmName in self.llmCache:
-                del self.llmCache[llmName]
-            self.llmCache[llmName] = LLM(llmName, llmm, llm)
-            return self.llmCache[llmName]
+            options = json.loads(llmm.options)
+            if llmm.class_name == "LLMGroup":
+                options["executor"] = self.executor
+            llm = tools.getLLMClass(llmm.class_name)(**options)
+
+            with self.llmLock:
+                self.llmCache[llmName] = LLM(llmName, llmm, llm, version)
+                self.evictLLMs(llmName)
+                return self.llmCache[llmName]
         else:
+            self.unloadLLM(llmName)
+            return None
+
+    def admission(self, llmName, db: Session):
+        llm = self.getLLM(llmName, db, check=False)
+        if llm is None:
             return None
 
+        with self.llmLock:
+            admission = self.admissions.get(llmName)
+            if admission is None:
+                admission = self.admissions[llmName] = Admission(llmName)
+
+        props = llm.props
+        if (admission.max_concurrency, admission.queue_depth, admission.queue_timeout) != (props.max_concurrency or None, props.queue_depth or 0, props.queue_timeout or 30.0):
+            admission.configure(props.max_concurrency, props.queue_depth, props.queue_timeout)
+
+        return admission
+
+    def admissionMetrics(self):
+        with self.llmLock:
+            admissions = list(self.admissions.values())
+        return [admission.metrics() for admission in admissions]
+
+    def unloadLLM(self, llmName):
+        with self.llmLock:
+            size = getattr(self.llmCache.pop(llmName, None), "size", 0)
+        self.residency.forget(llmName)
+        if size > 0:
+            gc.collect()
+
+    def evictLLMs(self, keep):
+        if RESTAI_LLM_CACHE_BUDGET <= 0:
+            return
+
+        budget = RESTAI_LLM_CACHE_BUDGET * 1024 ** 3
+        resident = [name for name, llm in self.llmCache.items() if llm.size > 0 and name != keep]
+        used = sum(self.llmCache[name].size for name in resident) + self.llmCache[keep].size
+
+        evicted = False
+        while resident and used > budget:
+            name = resident.pop(0)
+            used -= self.llmCache.pop(name).size
+            logging.info("Evicted " + name + " from the LLM cache")
+            evicted = True
+
+        if evicted:
+            gc.collect()
+
     def getEmbedding(self, embeddingModel):
         if embeddingModel in self.embeddingCache:
             return self.embeddingCache[embeddingModel]
@@ -84,6 +215,64 @@ class Brain:
             else:
                 raise Exception("Invalid Embedding type.")
               
+    def getRouterEmbeddings(self, project):
+        entrances = project.model.entrances or []
+        fingerprint = TTLCache.key(project.model.embeddings, *[entrance.name + "\x00" + entrance.description for entrance in entrances])
+
+        cached = self.routerCache.get(project.model.name)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        embedding = self.getEmbedding(project.model.embeddings)
+        vectors = np.array(embedding.get_text_embedding_batch([entrance.description for entrance in entrances]))
+        if len(vectors) > 0:
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        self.routerCache[project.model.name] = (fingerprint, vectors)
+        return vectors
+
+    def getSchemaIndex(self, project):
+        with self.sqlLock:
+            index = self.schemaIndexes.get(project.model.name)
+            if index is None:
+                index = SchemaIndex(project, self)
+                self.schemaIndexes[project.model.name] = index
+            index.project = project
+            return index
+
+    def getSQLDatabase(self, connection):
+        with self.sqlLock:
+            cached = self.sqlDatabases.get(connection)
+            if cached is not None and time.monotonic() - cached[1] < RESTAI_SQL_SCHEMA_TTL:
+                return cached[0]
+
+            engine = self.sqlEngines.get(connection)
+            if engine is None:
+                engine = create_engine(connection,
+                                       pool_size=RESTAI_SQL_POOL_SIZE,
+                                       max_overflow=RESTAI_SQL_POOL_OVERFLOW,
+                                       pool_recycle=900,
+                                       pool_pre_ping=True)
+                self.sqlEngines[connection] = engine
+
+        sql_database = SQLDatabase(engine)
+
+        with self.sqlLock:
+            self.sqlDatabases[connection] = (sql_database, time.monotonic())
+
+        return sql_database
+
+    def resetSQLDatabase(self, connection, db: Session):
+        # the engine is shared by every project on this connection, only dispose it once none is left
+        inUse = any(project.connection == connection for project in dbc.get_projects(db))
+
+        with self.sqlLock:
+            self.sqlDatabases.pop(connection, None)
+            engine = None if inUse else self.sqlEngines.pop(connection, None)
+
+        if engine is not None:
+            engine.dispose()
+
     def findProject(self, name, db):
         p = dbc.get_project_by_name(db, name)
         if p is None:
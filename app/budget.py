@@ -0,0 +1,44 @@
+import threading
+import time
+
+
+# Seconds assumed until a stage has been timed, per node for the stages that
+# scale with the nodes they get. High on purpose, a cold project sheds optional
+# stages instead of overrunning its first budgets.
+DEFAULTS = {
+    "retrieval": 0.05,
+    "ColbertRerank": 0.1,
+    "ParallelLLMRerank": 1.0,
+    "generation": 5.0,
+}
+
+
+class StageTimes:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+
+    def observe(self, project: str, stage: str, seconds: float, nodes: int = 1):
+        seconds = seconds / max(nodes, 1)
+        with self.lock:
+            current = self.times.get((project, stage))
+            self.times[(project, stage)] = seconds if current is None else 0.8 * current + 0.2 * seconds
+
+    def estimate(self, project: str, stage: str, nodes: int = 1) -> float:
+        return self.times.get((project, stage), DEFAULTS.get(stage, 0.0)) * max(nodes, 1)
+
+
+class Budget:
+
+    def __init__(self, seconds, started: float):
+        self.deadline = started + seconds if seconds else None
+        self.skipped = []
+
+    def remaining(self) -> float:
+        if self.deadline is None:
+            return float("inf")
+        return self.deadline - time.monotonic()
+
+    def skip(self, stage: str):
+        self.skipped.append(stage)
@@ -1,5 +1,9 @@
+import hashlib
 import math
 import shutil
+import threading
+import time
+from collections import OrderedDict
 import chromadb
 import uuid
 
@@ -45,4 +49,46 @@ class Cache:
             embeddingsPath = FindEmbeddingsPath(self.project.model.name + "_cache")
             shutil.rmtree(embeddingsPath, ignore_errors=True)
         except BaseException:
-            pass
\ No newline at end of file
+            pass
+
+class TTLCache:
+
+    def __init__(self, ttl=300, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256("\x00".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,99 @@
+import re
+import threading
+import time
+
+from llama_index.core.base.llms.types import ChatMessage
+
+from app.config import RESTAI_CASCADE_MIN_LENGTH
+
+UNSURE = [
+    "i don't know",
+    "i do not know",
+    "i'm not sure",
+    "i am not sure",
+    "i cannot answer",
+    "i can't answer",
+    "i'm unable to",
+    "i am unable to",
+]
+
+RATING_PROMPT = (
+    "Question:\n{question}\n\nAnswer:\n{answer}\n\n"
+    "Rate from 0 to 10 how confident you are that the answer is correct and complete. "
+    "Reply with the number only."
+)
+
+
+class Cascade:
+
+    def __init__(self, project, brain, db):
+        self.project = project
+        self.brain = brain
+        self.model = brain.getLLM(project.model.cascade_llm, db, admit=True)
+        self.threshold = project.model.cascade_threshold if project.model.cascade_threshold is not None else 0.7
+
+    async def aanswer(self, question, messages):
+        start = time.monotonic()
+        resp = await self.model.llm.achat(messages)
+        reason = self.check(resp.message.content or "") or await self.arate(question, resp.message.content)
+        self.brain.cascadeStats.record(self.project.model.name, reason, time.monotonic() - start)
+        return None if reason else resp
+
+    def check(self, answer):
+        text = answer.strip()
+        if len(text) < RESTAI_CASCADE_MIN_LENGTH:
+            return "length"
+
+        lower = text.lower()
+        if any(phrase in lower for phrase in UNSURE):
+            return "unsure"
+
+        return None
+
+    def ratingMessages(self, question, answer):
+        return [ChatMessage(role="user", content=RATING_PROMPT.format(question=question, answer=answer.strip()))]
+
+    def verdict(self, rating):
+        match = re.search(r"\d+(\.\d+)?", rating or "")
+        if match is None or min(10.0, float(match.group())) / 10 < self.threshold:
+            return "rating"
+        return None
+
+    async def arate(self, question, answer):
+        if self.threshold <= 0:
+            return None
+        return self.verdict((await self.model.llm.achat(self.ratingMessages(question, answer))).message.content)
+
+
+class CascadeStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.projects = {}
+
+    def record(self, project: str, reason, latency: float):
+        with self.lock:
+            stats = self.projects.get(project)
+            if stats is None:
+                stats = self.projects[project] = {"cheap": 0, "escalated": 0, "reasons": {}, "latency": 0.0}
+            if reason is None:
+                stats["cheap"] += 1
+            else:
+                stats["escalated"] += 1
+                stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+            stats["latency"] += latency
+
+    def metrics(self):
+        with self.lock:
+            output = []
+            for project, stats in self.projects.items():
+                total = stats["cheap"] + stats["escalated"]
+                output.append({
+                    "project": project,
+                    "cheap": stats["cheap"],
+                    "escalated": stats["escalated"],
+                    "reasons": dict(stats["reasons"]),
+                    "cheap_rate": stats["cheap"] / total if total else 0,
+                    "cheap_latency_avg": stats["latency"] / total if total else 0,
+                })
+            return output
@@ -1,13 +1,127 @@
 import datetime
+import logging
+import threading
 import uuid
+from typing import Any, List, Optional
 
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.storage.chat_store.redis import RedisChatStore
 
-from app.config import REDIS_HOST, REDIS_PORT
+from app.config import REDIS_HOST, REDIS_PORT, RESTAI_CHAT_SUMMARY_KEEP, RESTAI_CHAT_TOKEN_LIMIT
+
+SUMMARY_PROMPT = (
+    "Summary of the conversation so far:\n{summary}\n\n"
+    "New lines of the conversation:\n{lines}\n\n"
+    "Write a concise summary of the whole conversation, keeping names, facts and open questions."
+)
+
+
+class SummaryMemoryBuffer(ChatMemoryBuffer):
+
+    llm: Any = Field(default=None, exclude=True)
+    keep: int = Field(default=4)
+    executor: Any = Field(default=None, exclude=True)
+
+    _summary: str = PrivateAttr(default="")
+    _summarized: int = PrivateAttr(default=0)
+    _counts: dict = PrivateAttr(default_factory=dict)
+    _pending: Any = PrivateAttr(default=None)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SummaryMemoryBuffer"
+
+    def tokens(self, message: ChatMessage) -> int:
+        key = (message.role, message.content)
+        count = self._counts.get(key)
+        if count is None:
+            count = self._counts[key] = len(self.tokenizer_fn(str(message.content)))
+        return count
+
+    def get(self, input: Optional[str] = None, initial_token_count: int = 0, **kwargs: Any) -> List[ChatMessage]:
+        with self._lock:
+            summary, summarized = self._summary, self._summarized
+
+        history = self.get_all()[summarized:]
+        prefix = [ChatMessage(role=MessageRole.SYSTEM, content="Summary of the earlier conversation:\n" + summary)] if summary else []
+        budget = self.token_limit - initial_token_count - sum(self.tokens(message) for message in prefix)
+
+        start = len(history)
+        used = 0
+        while start > 0 and used + self.tokens(history[start - 1]) <= budget:
+            start -= 1
+            used += self.tokens(history[start])
+
+        # the history can't start with an answer
+        while start < len(history) and history[start].role in [MessageRole.ASSISTANT, MessageRole.TOOL]:
+            start += 1
+
+        return prefix + history[start:]
+
+    def put(self, message: ChatMessage) -> None:
+        super().put(message)
+        if message.role == MessageRole.ASSISTANT:
+            self.summarize()
+
+    def set(self, messages: List[ChatMessage]) -> None:
+        super().set(messages)
+        with self._lock:
+            if self._summarized > len(messages):
+                self._summary, self._summarized = "", 0
+        self.summarize()
+
+    def reset(self) -> None:
+        super().reset()
+        with self._lock:
+            self._summary, self._summarized = "", 0
+            self._counts.clear()
+
+    def summarize(self):
+        if self.llm is None:
+            return
+
+        if self.executor is None:
+            self.condense()
+            return
+
+        with self._lock:
+            if self._pending is not None and not self._pending.done():
+                return
+            self._pending = self.executor.submit(self.condense)
+
+    def condense(self):
+        history = self.get_all()
+        with self._lock:
+            summary, summarized = self._summary, self._summarized
+
+        # keep the last messages verbatim, starting at a question
+        end = len(history) - max(self.keep, 1)
+        while end > summarized and history[end].role != MessageRole.USER:
+            end -= 1
+        if end <= summarized:
+            return
+
+        older = history[summarized:end]
+        lines = "\n".join(message.role.value + ": " + str(message.content) for message in older)
+        try:
+            summary = self.llm.complete(SUMMARY_PROMPT.format(summary=summary or "(none)", lines=lines)).text.strip()
+        except Exception as e:
+            logging.warning("Could not summarize chat " + self.chat_store_key + ": " + str(e))
+            return
+
+        with self._lock:
+            if self._summarized != summarized:
+                return
+            for message in older:
+                self._counts.pop((message.role, message.content), None)
+            self._summary, self._summarized = summary, end
+
 
 class Chat:
-    def __init__(self, model):
+    def __init__(self, model, llm=None, executor=None):
         self.model = model
 
         if model.id is None:
@@ -15,10 +129,15 @@ class Chat:
         else:
             self.id = model.id
 
+        options = {"token_limit": RESTAI_CHAT_TOKEN_LIMIT}
         if REDIS_HOST is not None:
-            self.memory = ChatMemoryBuffer.from_defaults(token_limit=3900, chat_store=RedisChatStore(redis_url=f"redis://{REDIS_HOST}:{REDIS_PORT}"), chat_store_key=self.id)
+            options["chat_store"] = RedisChatStore(redis_url=f"redis://{REDIS_HOST}:{REDIS_PORT}")
+            options["chat_store_key"] = self.id
+
+        if llm is not None:
+            self.memory = SummaryMemoryBuffer(llm=llm, keep=RESTAI_CHAT_SUMMARY_KEEP, executor=executor, **options)
         else:
-            self.memory = ChatMemoryBuffer.from_defaults(token_limit=3900)
+            self.memory = ChatMemoryBuffer.from_defaults(**options)
 
         self.created = datetime.datetime.now()
 
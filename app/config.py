@@ -61,3 +61,51 @@ RESTAI_GPU = os.environ.get("RESTAI_GPU")
 RESTAI_DEFAULT_DEVICE = os.environ.get("RESTAI_DEFAULT_DEVICE")
 
 EMBEDDINGS_PATH = os.environ.get("EMBEDDINGS_PATH")
+
+RESTAI_THREADS = int(os.environ.get("RESTAI_THREADS", 32))
+RESTAI_REQUEST_THREADS = int(os.environ.get("RESTAI_REQUEST_THREADS", 40))
+
+RESTAI_LLM_CACHE_CHECK = int(os.environ.get("RESTAI_LLM_CACHE_CHECK", 30))
+RESTAI_LLM_CACHE_BUDGET = float(os.environ.get("RESTAI_LLM_CACHE_BUDGET", 0))
+
+RESTAI_OLLAMA_HEALTH_INTERVAL = float(os.environ.get("RESTAI_OLLAMA_HEALTH_INTERVAL", 10))
+RESTAI_OLLAMA_REFRESH_INTERVAL = float(os.environ.get("RESTAI_OLLAMA_REFRESH_INTERVAL", 60))
+RESTAI_OLLAMA_RETRY_AFTER = int(os.environ.get("RESTAI_OLLAMA_RETRY_AFTER", 30))
+RESTAI_OLLAMA_KEEP_ALIVE_MIN = int(os.environ.get("RESTAI_OLLAMA_KEEP_ALIVE_MIN", 60))
+RESTAI_OLLAMA_KEEP_ALIVE_MAX = int(os.environ.get("RESTAI_OLLAMA_KEEP_ALIVE_MAX", 1800))
+RESTAI_OLLAMA_MEMORY_BUDGET = float(os.environ.get("RESTAI_OLLAMA_MEMORY_BUDGET", 0))
+
+RESTAI_RERANK_PARALLELISM = int(os.environ.get("RESTAI_RERANK_PARALLELISM", 4))
+RESTAI_RERANK_CACHE_TTL = int(os.environ.get("RESTAI_RERANK_CACHE_TTL", 3600))
+
+RESTAI_CONTEXT_RATIO = float(os.environ.get("RESTAI_CONTEXT_RATIO", 0.5))
+RESTAI_CONTEXT_SCORE_GAP = float(os.environ.get("RESTAI_CONTEXT_SCORE_GAP", 0))
+RESTAI_CONTEXT_DUPLICATES = float(os.environ.get("RESTAI_CONTEXT_DUPLICATES", 0.8))
+RESTAI_CONTEXT_EXCLUDED_METADATA = [key.strip() for key in os.environ.get("RESTAI_CONTEXT_EXCLUDED_METADATA", "keywords,source").split(",") if key.strip()]
+
+RESTAI_STREAM_FLUSH_MS = int(os.environ.get("RESTAI_STREAM_FLUSH_MS", 50))
+RESTAI_STREAM_FLUSH_BYTES = int(os.environ.get("RESTAI_STREAM_FLUSH_BYTES", 1024))
+RESTAI_STREAM_HEARTBEAT = float(os.environ.get("RESTAI_STREAM_HEARTBEAT", 15))
+
+RESTAI_CASCADE_MIN_LENGTH = int(os.environ.get("RESTAI_CASCADE_MIN_LENGTH", 20))
+
+RESTAI_CHAT_TOKEN_LIMIT = int(os.environ.get("RESTAI_CHAT_TOKEN_LIMIT", 3900))
+RESTAI_CHAT_SUMMARY_LLM = os.environ.get("RESTAI_CHAT_SUMMARY_LLM")
+RESTAI_CHAT_SUMMARY_KEEP = int(os.environ.get("RESTAI_CHAT_SUMMARY_KEEP", 4))
+
+RESTAI_GUARD_CACHE_TTL = int(os.environ.get("RESTAI_GUARD_CACHE_TTL", 0))
+RESTAI_GUARD_MARGIN = float(os.environ.get("RESTAI_GUARD_MARGIN", 0.2))
+
+RESTAI_ROUTER_MARGIN = float(os.environ.get("RESTAI_ROUTER_MARGIN", 0.05))
+RESTAI_ROUTER_CACHE_TTL = int(os.environ.get("RESTAI_ROUTER_CACHE_TTL", 0))
+
+RESTAI_FEDERATED_MERGE = os.environ.get("RESTAI_FEDERATED_MERGE", "score")
+
+RESTAI_SQL_POOL_SIZE = int(os.environ.get("RESTAI_SQL_POOL_SIZE", 5))
+RESTAI_SQL_POOL_OVERFLOW = int(os.environ.get("RESTAI_SQL_POOL_OVERFLOW", 10))
+RESTAI_SQL_SCHEMA_TTL = int(os.environ.get("RESTAI_SQL_SCHEMA_TTL", 600))
+RESTAI_SQL_CACHE_TTL = int(os.environ.get("RESTAI_SQL_CACHE_TTL", 0))
+RESTAI_SQL_RESULT_TTL = int(os.environ.get("RESTAI_SQL_RESULT_TTL", 0))
+RESTAI_SQL_MAX_ROWS = int(os.environ.get("RESTAI_SQL_MAX_ROWS", 1000))
+RESTAI_SQL_BATCH = int(os.environ.get("RESTAI_SQL_BATCH", 100))
+RESTAI_SQL_TIMEOUT = float(os.environ.get("RESTAI_SQL_TIMEOUT", 30))
@@ -54,9 +54,10 @@ class Database:
         db.refresh(db_user)
         return db_user
 
-    def create_llm(self, db, name, class_name, options, privacy, description, type):
+    def create_llm(self, db, name, class_name, options, privacy, description, type, max_concurrency=None, queue_depth=None, queue_timeout=None):
         db_llm = LLMDatabase(
-            name=name, class_name=class_name, options=options, privacy=privacy, description=description, type=type)
+            name=name, class_name=class_name, options=options, privacy=privacy, description=description, type=type,
+            max_concurrency=max_concurrency, queue_depth=queue_depth, queue_timeout=queue_timeout)
         db.add(db_llm)
         db.commit()
         db.refresh(db_llm)
@@ -121,6 +122,15 @@ class Database:
         if llmUpdate.type is not None and llm.type != llmUpdate.type:
             llm.type = llmUpdate.type
 
+        if llmUpdate.max_concurrency is not None and llm.max_concurrency != llmUpdate.max_concurrency:
+            llm.max_concurrency = llmUpdate.max_concurrency
+
+        if llmUpdate.queue_depth is not None and llm.queue_depth != llmUpdate.queue_depth:
+            llm.queue_depth = llmUpdate.queue_depth
+
+        if llmUpdate.queue_timeout is not None and llm.queue_timeout != llmUpdate.queue_timeout:
+            llm.queue_timeout = llmUpdate.queue_timeout
+
         db.commit()
         return True
     
@@ -230,6 +240,10 @@ class Database:
         if projectModel.guard is not None and proj_db.guard != projectModel.guard:
             proj_db.guard = projectModel.guard
             changed = True
+
+        if projectModel.guard_mode is not None and proj_db.guard_mode != projectModel.guard_mode:
+            proj_db.guard_mode = projectModel.guard_mode
+            changed = True
             
         if projectModel.human_name is not None and proj_db.human_name != projectModel.human_name:
             proj_db.human_name = projectModel.human_name
@@ -243,6 +257,30 @@ class Database:
             proj_db.tools = projectModel.tools
             changed = True
         
+        if projectModel.embeddings is not None and proj_db.type in ["router", "ragsql"] and proj_db.embeddings != projectModel.embeddings:
+            proj_db.embeddings = projectModel.embeddings
+            changed = True
+
+        if projectModel.members is not None and proj_db.members != projectModel.members:
+            proj_db.members = projectModel.members
+            changed = True
+
+        if projectModel.cascade_llm is not None and proj_db.cascade_llm != projectModel.cascade_llm:
+            proj_db.cascade_llm = projectModel.cascade_llm or None
+            changed = True
+
+        if projectModel.cascade_threshold is not None and proj_db.cascade_threshold != projectModel.cascade_threshold:
+            proj_db.cascade_threshold = projectModel.cascade_threshold
+            changed = True
+
+        if projectModel.guard_label is not None and proj_db.guard_label != projectModel.guard_label:
+            proj_db.guard_label = projectModel.guard_label or None
+            changed = True
+
+        if projectModel.fanout is not None and proj_db.fanout != projectModel.fanout:
+            proj_db.fanout = projectModel.fanout
+            changed = True
+
         if projectModel.entrances is not None:
             proj_db.entrances = []
             for entrance in projectModel.entrances:
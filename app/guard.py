@@ -1,4 +1,10 @@
+import contextvars
+
 from llama_index.core.base.llms.types import ChatMessage
+from llama_index.core.retrievers import VectorIndexRetriever
+
+from app.cache import TTLCache
+from app.config import RESTAI_GUARD_CACHE_TTL, RESTAI_GUARD_MARGIN
 
 
 class Guard:
@@ -6,12 +12,65 @@ class Guard:
         self.brain = brain
         self.project = brain.findProject(projectName, db)
         self.db = db
+        self.classifier = self.project.model.type == "rag" and bool(self.project.model.guard_label)
+
+        self.model = None
+        if not self.classifier or RESTAI_GUARD_MARGIN > 0:
+            self.model = self.brain.getLLM(self.project.model.llm, self.db, admit=True)
+
+    def verify(self, prompt):
+        if RESTAI_GUARD_CACHE_TTL > 0:
+            key = TTLCache.key(self.project.model.name, prompt)
+            verdict = self.brain.guardCache.get(key)
+            if verdict is None:
+                verdict = self.evaluate(prompt)
+                self.brain.guardCache.set(key, verdict)
+            return verdict
+
+        return self.evaluate(prompt)
+
+    def verifyAsync(self, prompt):
+        return self.brain.executor.submit(contextvars.copy_context().run, self.verify, prompt)
+
+    def evaluate(self, prompt):
+        if self.classifier:
+            verdict = self.classify(prompt)
+            if verdict is not None or self.model is None:
+                return bool(verdict)
 
-    def verify(self, prompt):        
-        model = self.brain.getLLM(self.project.model.llm, self.db)
+        return self.ask(prompt)
 
+    def classify(self, prompt):
+        if self.project.vector is None:
+            return None
+
+        retriever = VectorIndexRetriever(
+            index=self.project.vector.index,
+            similarity_top_k=self.project.model.k or 4,
+        )
+
+        bad = 0.0
+        total = 0.0
+        for node in retriever.retrieve(prompt):
+            label = str(node.metadata.get(self.project.model.guard_label, "")).strip().upper()
+            if label not in ["BAD", "GOOD"]:
+                continue
+            weight = max(node.score or 0.0, 0.0)
+            total += weight
+            if label == "BAD":
+                bad += weight
+
+        if total == 0:
+            return None
+
+        score = bad / total
+        if abs(score - 0.5) < RESTAI_GUARD_MARGIN:
+            return None
+
+        return score > 0.5
+
+    def ask(self, prompt):
         sysTemplate = self.project.model.system
-        model.llm.system_prompt = sysTemplate
 
         messages = [
             ChatMessage(
@@ -20,15 +79,13 @@ class Guard:
             ChatMessage(role="user", content="Analyze the following text:\n\"" + prompt + "\""),
         ]
         
-        resp = model.llm.chat(messages)
+        resp = self.model.llm.chat(messages)
         answer = resp.message.content.strip()
         
-        try:
-            if answer == "BAD":
-                return True
-            elif answer == "GOOD":
-                return False
-            else:
-                return True
-        except Exception as e:
-            raise e
+        if answer == "BAD":
+            return True
+        elif answer == "GOOD":
+            return False
+        else:
+            return True
+
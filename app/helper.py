@@ -1,9 +1,13 @@
+from contextlib import aclosing
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import StreamingResponse
 from starlette.requests import Request
 from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException
 from app.project import Project
 from app.projects.agent import Agent
+from app.projects.federated import Federated
 from app.projects.inference import Inference
 from app.projects.rag import RAG
 from app.projects.ragsql import RAGSql
@@ -12,17 +16,26 @@ from app.projects.vision import Vision
 from app.models.models import QuestionModel, User
 from app.database import get_db
 from app.brain import Brain
+from app.llms.admission import AdmissionRejected, hold
+from app.llms.registry import ModelPulling
 from app.auth import get_current_username_project
-import requests
+import asyncio
+import anyio
+import httpx
 from fastapi import HTTPException, Request
 import traceback
 import re
+import time
 import logging
 import base64
+import json
 from app.config import (
     LOG_LEVEL,
+    RESTAI_STREAM_FLUSH_BYTES,
+    RESTAI_STREAM_FLUSH_MS,
+    RESTAI_STREAM_HEARTBEAT,
 )
-from app.tools import get_logger
+from app.tools import get_logger, tokens_from_string
 from app.projects.base import Project as ProjectBase
 
 
@@ -40,6 +53,25 @@ async def chat_main(
         user: User = Depends(get_current_username_project),
         db: Session = Depends(get_db)):
     
+    await check_llm(brain, project, db)
+    release = await admit_llm(brain, project, db)
+    try:
+        return release_after(await chat_project(request, brain, project, input, user, db), release)
+    except AdmissionRejected as e:
+        release()
+        raise rejected(e)
+    except BaseException:
+        release()
+        raise
+
+
+async def chat_project(
+        request: Request,
+        brain: Brain,
+        project: Project,
+        input: QuestionModel,
+        user: User,
+        db: Session):
     projlogic: ProjectBase
     if project.model.type == "rag":
         projlogic = RAG(brain)
@@ -49,12 +81,15 @@ async def chat_main(
         projlogic = Inference(brain)
     elif project.model.type == "agent":
         projlogic = Agent(brain)
+    elif project.model.type == "federated":
+        projlogic = Federated(brain)
 
     if input.stream:
-        return StreamingResponse(projlogic.chat(project, input, user, db), media_type='text/event-stream')
+        return stream_project(request, projlogic.achat(project, input, user, db), user, project)
     else:
-        output = projlogic.chat(project, input, user, db)
-        for line in output:
+        output = projlogic.achat(project, input, user, db)
+        async for line in output:
+            await output.aclose()
             logs_inference.info({"user": user.username, "project": project.model.name, "output": line})
             return line
         
@@ -66,7 +101,35 @@ async def question_main(
         user: User = Depends(get_current_username_project),
         db: Session = Depends(get_db)):
     
-    
+    if input.budget is None and request.headers.get("X-Latency-Budget"):
+        try:
+            budget = float(request.headers["X-Latency-Budget"])
+        except ValueError:
+            budget = None
+        if budget is None or not budget > 0:
+            raise HTTPException(
+                status_code=400, detail='{"error": "Invalid X-Latency-Budget header, it must be a number of seconds above 0"}')
+        input.budget = budget
+
+    await check_llm(brain, project, db)
+    release = await admit_llm(brain, project, db)
+    try:
+        return release_after(await question_project(request, brain, project, input, user, db), release)
+    except AdmissionRejected as e:
+        release()
+        raise rejected(e)
+    except BaseException:
+        release()
+        raise
+
+
+async def question_project(
+        request: Request,
+        brain: Brain,
+        project: Project,
+        input: QuestionModel,
+        user: User,
+        db: Session):
     if project.model.type == "rag":
         cached = await processCache(project, input, db)
         if cached:
@@ -80,13 +143,155 @@ async def question_main(
     elif project.model.type == "router":
         return await question_router(request, brain, project, input, user, db)
     elif project.model.type == "vision":
-        return await question_vision(project, brain, input, user, db)
+        return await question_vision(request, brain, project, input, user, db)
     elif project.model.type == "agent":
         return await question_agent(request, brain, project, input, user, db)
+    elif project.model.type == "federated":
+        return await question_federated(request, brain, project, input, user, db)
     else:
         raise HTTPException(
             status_code=400, detail='{"error": "Invalid project type"}')
 
+async def check_llm(brain: Brain, project: Project, db: Session):
+    if not project.model.llm:
+        return
+
+    try:
+        await run_in_threadpool(brain.getLLM, project.model.llm, db)
+        await run_in_threadpool(brain.touchLLM, project.model.llm, db)
+    except ModelPulling as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def admit_llm(brain: Brain, project: Project, db: Session):
+    # Routers only pick a destination, which is admitted on its own LLM.
+    if not project.model.llm or project.model.type == "router":
+        return lambda: None
+
+    admission = await run_in_threadpool(brain.admission, project.model.llm, db)
+    if admission is None:
+        return lambda: None
+
+    try:
+        release = await admission.aacquire()
+    except AdmissionRejected as e:
+        raise rejected(e)
+
+    hold(project.model.llm)
+    return release
+
+
+def rejected(e: AdmissionRejected):
+    return HTTPException(
+        status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def failed(e: Exception):
+    # an LLM called on the request's behalf can be at capacity too
+    if isinstance(e, AdmissionRejected):
+        return rejected(e)
+    return HTTPException(
+        status_code=500, detail=str(e))
+
+
+def stream_project(request: Request, output, user: User, project: Project):
+    return StreamingResponse(coalesced(disconnectable(request, output, user, project)), media_type='text/event-stream')
+
+
+async def coalesced(output):
+    interval = RESTAI_STREAM_FLUSH_MS / 1000
+    buffer = []
+    size = 0
+    deadline = None
+    pending = None
+    # a heartbeat may only go between complete frames
+    framed = True
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(output.__anext__())
+
+            if buffer:
+                timeout = max(0, deadline - time.monotonic())
+            else:
+                timeout = RESTAI_STREAM_HEARTBEAT if RESTAI_STREAM_HEARTBEAT > 0 and framed else None
+
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, size = [], 0
+                else:
+                    yield ": keep-alive\n\n"
+                continue
+
+            task, pending = pending, None
+            try:
+                line = task.result()
+            except StopAsyncIteration:
+                break
+
+            if not buffer:
+                deadline = time.monotonic() + interval
+            buffer.append(line)
+            size += len(line)
+
+            if interval <= 0 or size >= RESTAI_STREAM_FLUSH_BYTES or not line.startswith("data: ") or not line.endswith("\n\n"):
+                framed = line.endswith("\n\n")
+                yield "".join(buffer)
+                buffer, size = [], 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        with anyio.CancelScope(shield=True):
+            if pending is not None:
+                pending.cancel()
+                await asyncio.wait({pending})
+            await output.aclose()
+
+
+async def disconnectable(request: Request, output, user: User, project: Project):
+    sent = []
+    disconnected = False
+    try:
+        async for line in output:
+            if await request.is_disconnected():
+                disconnected = True
+                break
+            if isinstance(line, str) and line.startswith("data: "):
+                sent.append(line[6:])
+            yield line
+    except asyncio.CancelledError:
+        disconnected = True
+        raise
+    finally:
+        with anyio.CancelScope(shield=True):
+            await output.aclose()
+        if disconnected:
+            logs_inference.info({"user": user.username, "project": project.model.name, "disconnected": True, "tokens": {"output": tokens_from_string("".join(sent))}})
+
+
+def release_after(response, release):
+    if isinstance(response, StreamingResponse):
+        # starlette skips the background task when the stream raises, so the stream releases too
+        response.body_iterator = releasing(response.body_iterator, release)
+        response.background = BackgroundTask(release)
+    else:
+        release()
+    return response
+
+
+async def releasing(output, release):
+    try:
+        async with aclosing(output):
+            async for line in output:
+                yield line
+    finally:
+        release()
+
+
 async def question_rag(
         request: Request,
         brain: Brain,
@@ -102,17 +307,44 @@ async def question_rag(
                 status_code=400, detail='{"error": "Only available for RAG projects."}')
 
         if input.stream:
-            return StreamingResponse(projlogic.question(project, input, user, db), media_type='text/event-stream')
+            return stream_project(request, projlogic.aquestion(project, input, user, db), user, project)
         else:
-            output = projlogic.question(project, input, user, db)
-            for line in output:
+            output = projlogic.aquestion(project, input, user, db)
+            async for line in output:
+                await output.aclose()
                 logs_inference.info({"user": user.username, "project": project.model.name, "output": line})
                 return line
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise failed(e)
+        
+async def question_federated(
+        request: Request,
+        brain: Brain,
+        project: Project,
+        input: QuestionModel,
+        user: User = Depends(get_current_username_project),
+        db: Session = Depends(get_db)):
+    try:
+        projLogic = Federated(brain)
+
+        if project.model.type != "federated":
+            raise HTTPException(
+                status_code=400, detail='{"error": "Only available for FEDERATED projects."}')
+
+        if input.stream:
+            return stream_project(request, projLogic.aquestion(project, input, user, db), user, project)
+        else:
+            output = projLogic.aquestion(project, input, user, db)
+            async for line in output:
+                await output.aclose()
+                logs_inference.info({"user": user.username, "project": project.model.name, "output": line})
+                return line
+    except Exception as e:
+        logging.error(e)
+        traceback.print_tb(e.__traceback__)
+        raise failed(e)
         
 async def processCache(project: Project, input: QuestionModel, db: Session): 
     output = {
@@ -126,7 +358,7 @@ async def processCache(project: Project, input: QuestionModel, db: Session):
     }
     
     if project.cache:
-        answer = project.cache.verify(input.question)
+        answer = await run_in_threadpool(project.cache.verify, input.question)
         if answer is not None:
             output.update({
                 "answer": answer,
@@ -152,8 +384,15 @@ async def question_router(
             raise HTTPException(
                 status_code=400, detail='{"error": "Only available for ROUTER projects."}')
 
-        projDestName = projLogic.question(project, input, user, db)
-        projDest = brain.findProject(projDestName, db)
+        projDestNames = await run_in_threadpool(projLogic.question, project, input, user, db)
+
+        if len(projDestNames) > 1:
+            output = await question_fanout(request, brain, projDestNames, input, user)
+            if input.stream:
+                return StreamingResponse(streamed(output), media_type='text/event-stream')
+            return output
+
+        projDest = await run_in_threadpool(brain.findProject, projDestNames[0], db) if projDestNames else None
         
         if projDest is None:
             raise HTTPException(
@@ -161,11 +400,73 @@ async def question_router(
         else:
             return await question_main(request, brain, projDest, input, user, db)
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
+        raise failed(e)
+
+
+async def question_destination(request: Request, brain: Brain, projectName: str, input: QuestionModel, user: User):
+    db = get_db()
+    try:
+        project = await run_in_threadpool(brain.findProject, projectName, db)
+        if project is None:
+            raise Exception("Destination project " + projectName + " not found.")
+        return await question_main(request, brain, project, input, user, db)
+    finally:
+        db.close()
+
+
+async def question_fanout(request: Request, brain: Brain, projectNames: list[str], input: QuestionModel, user: User):
+    results = await asyncio.gather(
+        *[question_destination(request, brain, name, input.model_copy(update={"stream": False}), user) for name in projectNames],
+        return_exceptions=True)
+
+    outputs = []
+    for name, result in zip(projectNames, results):
+        if isinstance(result, Exception):
+            logging.error(result)
+        elif isinstance(result, dict) and "answer" in result:
+            result["project"] = name
+            outputs.append(result)
+
+    if len(outputs) == 0:
         raise HTTPException(
-            status_code=500, detail=str(e))
+            status_code=404, detail='{"error": "No destination project answered."}')
+
+    def best_score(output):
+        scores = [source["score"] for source in output.get("sources", []) if isinstance(source, dict) and source.get("score") is not None]
+        return max(scores) if scores else None
+
+    scored = [output for output in outputs if best_score(output) is not None]
+    if scored:
+        best = max(scored, key=best_score)
+        answer = best["answer"]
+    else:
+        answer = "\n\n".join(output["answer"] for output in outputs)
+
+    return {
+        "question": input.question,
+        "answer": answer,
+        "type": "router",
+        "destinations": [output["project"] for output in outputs],
+        "sources": [source for output in outputs for source in output.get("sources", [])],
+        "cached": all(output.get("cached", False) for output in outputs),
+        "guard": any(output.get("guard", False) for output in outputs),
+        "tokens": {
+            "input": sum(output.get("tokens", {}).get("input", 0) for output in outputs),
+            "output": sum(output.get("tokens", {}).get("output", 0) for output in outputs)
+        }
+    }
+
+
+async def streamed(output):
+    # fanned out answers are merged before anything is sent, so they go out as a single frame
+    yield "data: " + output["answer"] + "\n\n"
+    yield "data: " + json.dumps(output) + "\n"
+    yield "event: close\n\n"
 
 
 async def question_inference(
@@ -183,18 +484,18 @@ async def question_inference(
                 status_code=400, detail='{"error": "Only available for INFERENCE projects."}')
 
         if input.stream:
-            return StreamingResponse(projLogic.question(project, input, user, db), media_type='text/event-stream')
+            return stream_project(request, projLogic.aquestion(project, input, user, db), user, project)
         else:
-            output = projLogic.question(project, input, user, db)
-            for line in output:
+            output = projLogic.aquestion(project, input, user, db)
+            async for line in output:
+                await output.aclose()
                 logs_inference.info({"user": user.username, "project": project.model.name, "output": line})
                 return line
 
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise failed(e)
 
 async def question_agent(
         request: Request,
@@ -206,17 +507,20 @@ async def question_agent(
     try:      
         projLogic = Agent(brain)
 
-        output = projLogic.question(project, input, user, db)
+        if input.stream:
+            return stream_project(request, projLogic.aquestion(project, input, user, db), user, project)
+
+        output = projLogic.aquestion(project, input, user, db)
         
-        for line in output:
+        async for line in output:
+            await output.aclose()
             logs_inference.info({"user": user.username, "project": project.model.name, "output": line})
             return line
           
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise failed(e)
 
 async def question_query_sql(
         request: Request,
@@ -232,7 +536,10 @@ async def question_query_sql(
             raise HTTPException(
                 status_code=400, detail='{"error": "Only available for RAGSQL projects."}')
 
-        output = projLogic.question(project, input, user, db)
+        if input.stream:
+            return stream_project(request, projLogic.aquestion(project, input, user, db), user, project)
+
+        output = await run_in_threadpool(projLogic.question, project, input, user, db)
 
         logs_inference.info({"user": user.username, "project": project.model.name, "output": output})
 
@@ -240,13 +547,13 @@ async def question_query_sql(
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
+        raise failed(e)
 
 
 async def question_vision(
-        project: Project,
+        request: Request,
         brain: Brain,
+        project: Project,
         input: QuestionModel,
         user: User = Depends(get_current_username_project),
         db: Session = Depends(get_db)):
@@ -263,13 +570,16 @@ async def question_vision(
             is_url = re.match(url_pattern, input.image) is not None
 
             if is_url:
-                response = requests.get(input.image)
+                async with httpx.AsyncClient() as client:
+                    response = await client.get(input.image, follow_redirects=True)
                 response.raise_for_status()
                 image_data = response.content
                 input.image = base64.b64encode(image_data).decode('utf-8')
 
-        output = projLogic.question(
-            project, input, user, db)
+        if input.stream:
+            return stream_project(request, projLogic.aquestion(project, input, user, db), user, project)
+
+        output = await run_in_threadpool(projLogic.question, project, input, user, db)
         
         if input.lite:
             del output["image"]
@@ -279,5 +589,4 @@ async def question_vision(
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
-        raise HTTPException(
-            status_code=500, detail=str(e))
\ No newline at end of file
+        raise failed(e)
\ No newline at end of file
@@ -1,12 +1,34 @@
+import os
+import time
+
+
 class LLM:
     def __init__(
             self,
             model_name,
             props,
-            llm=None):
+            llm=None,
+            version=None):
         self.model_name = model_name
         self.props = props
         self.llm = llm
+        self.version = version
+        self.checked = time.monotonic()
+        self.size = self.residentSize()
+
+    def residentSize(self):
+        if hasattr(self.llm, "memorySize"):
+            return self.llm.memorySize()
+
+        model = getattr(self.llm, "_model", None)
+        if model is not None and hasattr(model, "parameters"):
+            return sum(param.numel() * param.element_size() for param in model.parameters())
+
+        path = getattr(self.llm, "model_path", None)
+        if isinstance(path, str) and os.path.isfile(path):
+            return os.path.getsize(path)
+
+        return 0
 
     def __str__(self):
         return self.model_name
@@ -0,0 +1,284 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import aclosing
+from contextvars import ContextVar
+from typing import Any, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.custom import CustomLLM
+
+# LLMs whose slot the current request already holds, with a lock its own calls to them share
+admitted = ContextVar("admitted", default={})
+
+
+def hold(name: str):
+    admitted.set({**admitted.get(), name: threading.Lock()})
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, llm: str, retry_after: int):
+        super().__init__("LLM " + llm + " is at capacity, retry in " + str(retry_after) + " seconds.")
+        self.llm = llm
+        self.retry_after = retry_after
+
+
+class Waiter:
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else threading.Event()
+        self.granted = False
+
+    def notify(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+        else:
+            self.event.set()
+
+
+class Admission:
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.waiters = deque()
+        self.max_concurrency = None
+        self.queue_depth = 0
+        self.queue_timeout = 30.0
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.waits = deque(maxlen=500)
+        self.service = None
+
+    def configure(self, max_concurrency, queue_depth, queue_timeout):
+        with self.lock:
+            self.max_concurrency = max_concurrency or None
+            self.queue_depth = queue_depth or 0
+            self.queue_timeout = queue_timeout or 30.0
+            self.grant()
+
+    def grant(self):
+        # hands free slots to queued requests in order, called with the lock held
+        while self.waiters and (self.max_concurrency is None or self.running < self.max_concurrency):
+            waiter = self.waiters.popleft()
+            waiter.granted = True
+            self.running += 1
+            waiter.notify()
+
+    def retryAfter(self) -> int:
+        service = self.service or 1.0
+        return max(1, math.ceil(service * (self.waiting + 1) / (self.max_concurrency or 1)))
+
+    def tryAcquire(self):
+        # returns a release function, None when the caller has to wait(), raises when the queue is full
+        with self.lock:
+            if self.max_concurrency is None or (self.running < self.max_concurrency and self.waiting == 0):
+                self.running += 1
+                return self.admit(0)
+            if self.waiting >= self.queue_depth:
+                self.rejected += 1
+                raise AdmissionRejected(self.name, self.retryAfter())
+            self.waiting += 1
+            return None
+
+    def acquire(self):
+        release = self.tryAcquire()
+        if release is not None:
+            return release
+
+        start = time.monotonic()
+        waiter = Waiter()
+        with self.lock:
+            self.waiters.append(waiter)
+            self.grant()
+
+        waiter.event.wait(self.queue_timeout)
+        return self.settle(waiter, start)
+
+    async def aacquire(self):
+        release = self.tryAcquire()
+        if release is not None:
+            return release
+        return await self.wait()
+
+    async def wait(self):
+        start = time.monotonic()
+        waiter = Waiter(asyncio.get_running_loop())
+        with self.lock:
+            self.waiters.append(waiter)
+            self.grant()
+
+        try:
+            await asyncio.wait_for(waiter.event.wait(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            with self.lock:
+                self.waiting -= 1
+                if waiter.granted:
+                    self.running -= 1
+                    self.grant()
+                else:
+                    self.waiters.remove(waiter)
+            raise
+
+        return self.settle(waiter, start)
+
+    def settle(self, waiter: Waiter, start: float):
+        with self.lock:
+            self.waiting -= 1
+            if not waiter.granted:
+                self.waiters.remove(waiter)
+                self.timeouts += 1
+                raise AdmissionRejected(self.name, self.retryAfter())
+
+            return self.admit(time.monotonic() - start)
+
+    def admit(self, waited: float):
+        self.admitted += 1
+        self.waits.append(waited)
+        started = time.monotonic()
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.running -= 1
+                self.service = elapsed if self.service is None else 0.9 * self.service + 0.1 * elapsed
+                self.grant()
+
+        return release
+
+    def metrics(self):
+        with self.lock:
+            waits = sorted(self.waits)
+            return {
+                "llm": self.name,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": self.queue_depth,
+                "queue_timeout": self.queue_timeout,
+                "running": self.running,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "wait_avg": sum(waits) / len(waits) if waits else 0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0,
+                "wait_max": waits[-1] if waits else 0,
+            }
+
+
+class AdmittedLLM(CustomLLM):
+
+    _llm: Any = PrivateAttr()
+    _admission: Admission = PrivateAttr()
+
+    def __init__(self, llm, admission: Admission, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._llm = llm
+        self._admission = admission
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "AdmittedLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llm.metadata
+
+    def slot(self):
+        if self._admission.max_concurrency is None:
+            return lambda: None
+
+        shared = admitted.get().get(self._admission.name)
+        if shared is None:
+            return self._admission.acquire()
+
+        shared.acquire()
+        return shared.release
+
+    async def aslot(self):
+        if self._admission.max_concurrency is None:
+            return lambda: None
+
+        shared = admitted.get().get(self._admission.name)
+        if shared is None:
+            return await self._admission.aacquire()
+
+        # polled so a cancelled caller never ends up owning the lock
+        while not shared.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        return shared.release
+
+    def _call(self, start):
+        release = self.slot()
+        try:
+            return start()
+        finally:
+            release()
+
+    async def _acall(self, start):
+        release = await self.aslot()
+        try:
+            return await start()
+        finally:
+            release()
+
+    def _stream(self, start):
+        # the slot is taken on the first chunk and held until the stream ends or is closed
+        release = self.slot()
+        try:
+            yield from start()
+        finally:
+            release()
+
+    async def _astream(self, start):
+        release = await self.aslot()
+        try:
+            async with aclosing(await start()) as gen:
+                async for chunk in gen:
+                    yield chunk
+        finally:
+            release()
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self._call(lambda: self._llm.chat(messages, **kwargs))
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self._stream(lambda: self._llm.stream_chat(messages, **kwargs))
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return self._call(lambda: self._llm.complete(prompt, formatted=formatted, **kwargs))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        return self._stream(lambda: self._llm.stream_complete(prompt, formatted=formatted, **kwargs))
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self._acall(lambda: self._llm.achat(messages, **kwargs))
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return self._astream(lambda: self._llm.astream_chat(messages, **kwargs))
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await self._acall(lambda: self._llm.acomplete(prompt, formatted=formatted, **kwargs))
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        return self._astream(lambda: self._llm.astream_complete(prompt, formatted=formatted, **kwargs))
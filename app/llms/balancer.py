@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+
+import httpx
+
+from app.config import RESTAI_OLLAMA_HEALTH_INTERVAL
+
+
+_balancers = {}
+_balancersLock = threading.Lock()
+
+
+class OllamaHost:
+    def __init__(self, url: str):
+        self.url = url
+        self.inflight = 0
+        self.healthy = True
+        self.models = {}
+
+
+class OllamaBalancer:
+
+    def __init__(self, hosts: list[str], interval: float = RESTAI_OLLAMA_HEALTH_INTERVAL):
+        self.hosts = [OllamaHost(url) for url in hosts]
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.turn = 0
+        self.stopped = threading.Event()
+
+        if self.interval > 0:
+            threading.Thread(target=self.watch, daemon=True).start()
+
+    def acquire(self, model: str, exclude=()) -> OllamaHost:
+        with self.lock:
+            candidates = [host for host in self.hosts if host.url not in exclude]
+            if not candidates:
+                return None
+
+            healthy = [host for host in candidates if host.healthy] or candidates
+            resident = [host for host in healthy if self.isResident(host, model)] or healthy
+
+            self.turn += 1
+            order = {host.url: (i - self.turn) % len(self.hosts) for i, host in enumerate(self.hosts)}
+            host = min(resident, key=lambda host: (host.inflight, order[host.url]))
+            host.inflight += 1
+            return host
+
+    def release(self, host: OllamaHost, model: str = None, keep_alive=None, failed: bool = False):
+        with self.lock:
+            host.inflight -= 1
+            if failed:
+                host.healthy = False
+                host.models = {}
+                logging.warning("Ollama host " + host.url + " ejected")
+            elif model is not None:
+                host.models[model] = self.expiry(keep_alive)
+
+    def isResident(self, host: OllamaHost, model: str) -> bool:
+        expires = host.models.get(model)
+        return expires is not None and (expires is True or expires > time.monotonic())
+
+    def expiry(self, keep_alive):
+        # Ollama reads numeric keep_alive as seconds, negative keeps the model loaded.
+        if keep_alive is None:
+            keep_alive = 300
+        if isinstance(keep_alive, str):
+            return time.monotonic() + 300
+        if keep_alive < 0:
+            return True
+        return time.monotonic() + keep_alive
+
+    def status(self):
+        with self.lock:
+            return [
+                {
+                    "host": host.url,
+                    "healthy": host.healthy,
+                    "inflight": host.inflight,
+                    "models": [model for model in host.models if self.isResident(host, model)],
+                }
+                for host in self.hosts
+            ]
+
+    def check(self, host: OllamaHost, client: httpx.Client):
+        try:
+            response = client.get(host.url.rstrip("/") + "/api/ps")
+            if response.status_code == 404:
+                client.get(host.url.rstrip("/") + "/api/tags").raise_for_status()
+                models = None
+            else:
+                response.raise_for_status()
+                models = {model["name"]: True for model in response.json().get("models") or []}
+        except Exception:
+            with self.lock:
+                if host.healthy:
+                    logging.warning("Ollama host " + host.url + " failed health check")
+                host.healthy = False
+                host.models = {}
+            return
+
+        with self.lock:
+            if not host.healthy:
+                logging.info("Ollama host " + host.url + " is healthy again")
+            host.healthy = True
+            if models is not None:
+                host.models = models
+
+    def watch(self):
+        with httpx.Client(timeout=5) as client:
+            while not self.stopped.wait(self.interval):
+                for host in self.hosts:
+                    self.check(host, client)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def getBalancer(hosts: list[str]) -> OllamaBalancer:
+    key = tuple(hosts)
+    with _balancersLock:
+        if key not in _balancers:
+            _balancers[key] = OllamaBalancer(list(hosts))
+        return _balancers[key]
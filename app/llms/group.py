@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, List, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.custom import CustomLLM
+
+from app.config import RESTAI_THREADS
+
+
+class LLMGroup(CustomLLM):
+
+    members: List[Any] = Field(description="LLMs in priority order, as {\"class_name\": ..., \"options\": {...}} or LLM instances.")
+    hedge_delay: float = Field(default=2.0, description="Seconds to wait before hedging while a member has too few samples for a p95.")
+    hedge_percentile: float = Field(default=95, description="Percentile of a member's first-token latency after which to hedge.")
+    hedge_samples: int = Field(default=20, description="Samples needed before using the percentile instead of hedge_delay.")
+
+    _llms: list = PrivateAttr()
+    _latencies: list = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _executor: ThreadPoolExecutor = PrivateAttr()
+
+    def __init__(self, executor: ThreadPoolExecutor = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        if not self.members:
+            raise ValueError("LLMGroup needs at least one member.")
+
+        self._llms = [self.build(member) for member in self.members]
+        self._latencies = [deque(maxlen=200) for _ in self._llms]
+        self._lock = threading.Lock()
+        self._executor = executor or ThreadPoolExecutor(max_workers=RESTAI_THREADS)
+
+    @staticmethod
+    def build(member):
+        if isinstance(member, dict):
+            from app.tools import getLLMClass
+            return getLLMClass(member["class_name"])(**member.get("options", {}))
+        return member
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LLMGroup"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self._llms[0].metadata
+
+    def hedgeDelay(self, index: int) -> float:
+        with self._lock:
+            samples = sorted(self._latencies[index])
+        if len(samples) < self.hedge_samples:
+            return self.hedge_delay
+        return samples[min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))]
+
+    def record(self, index: int, latency: float):
+        with self._lock:
+            self._latencies[index].append(latency)
+
+    def stats(self):
+        return [
+            {"member": i, "model": llm.metadata.model_name, "samples": len(self._latencies[i]), "hedge_delay": self.hedgeDelay(i)}
+            for i, llm in enumerate(self._llms)
+        ]
+
+    def _race(self, start, cleanup=None):
+        futures = {}
+        errors = []
+        launched = 0
+
+        def timed(index):
+            started = time.monotonic()
+            result = start(self._llms[index])
+            self.record(index, time.monotonic() - started)
+            return result
+
+        def launch():
+            nonlocal launched
+            futures[self._executor.submit(timed, launched)] = launched
+            launched += 1
+
+        launch()
+        while futures:
+            timeout = self.hedgeDelay(launched - 1) if launched < len(self._llms) else None
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                logging.info("Hedging LLM request to member " + str(launched))
+                launch()
+                continue
+
+            winner = None
+            for future in done:
+                index = futures.pop(future)
+                if future.exception() is not None:
+                    logging.warning("LLM group member " + str(index) + " failed: " + str(future.exception()))
+                    errors.append(future.exception())
+                elif winner is None:
+                    winner = future.result()
+                elif cleanup is not None:
+                    cleanup(future.result())
+
+            if winner is not None:
+                for future in futures:
+                    future.cancel()
+                    if cleanup is not None:
+                        future.add_done_callback(lambda f: not f.cancelled() and f.exception() is None and cleanup(f.result()))
+                return winner
+
+            if not futures and launched < len(self._llms):
+                launch()
+
+        raise errors[-1]
+
+    async def _arace(self, start, cleanup=None):
+        tasks = {}
+        started = {}
+        errors = []
+        launched = 0
+
+        async def timed(index):
+            started = time.monotonic()
+            result = await start(self._llms[index])
+            self.record(index, time.monotonic() - started)
+            return result
+
+        def launch():
+            nonlocal launched
+            started[launched] = time.monotonic()
+            tasks[asyncio.ensure_future(timed(launched))] = launched
+            launched += 1
+
+        launch()
+        try:
+            while tasks:
+                timeout = self.hedgeDelay(launched - 1) if launched < len(self._llms) else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logging.info("Hedging LLM request to member " + str(launched))
+                    launch()
+                    continue
+
+                winner = None
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is not None:
+                        logging.warning("LLM group member " + str(index) + " failed: " + str(task.exception()))
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = task.result()
+                    elif cleanup is not None:
+                        await cleanup(task.result())
+
+                if winner is not None:
+                    return winner
+
+                if not tasks and launched < len(self._llms):
+                    launch()
+        finally:
+            for task, index in tasks.items():
+                if cleanup is not None and task.done() and not task.cancelled() and task.exception() is None:
+                    await cleanup(task.result())
+                if not task.done():
+                    # a censored sample, the member took at least this long
+                    self.record(index, time.monotonic() - started[index])
+                task.cancel()
+
+        raise errors[-1]
+
+    def _stream(self, first):
+        gen, chunk = first
+        if chunk is None:
+            return
+        yield chunk
+        yield from gen
+
+    async def _astream(self, first):
+        gen, chunk = first
+        if chunk is None:
+            return
+        yield chunk
+        async for chunk in gen:
+            yield chunk
+
+    @staticmethod
+    def _first(gen):
+        try:
+            return gen, next(gen)
+        except StopIteration:
+            return gen, None
+
+    @staticmethod
+    async def _afirst(gen):
+        try:
+            return gen, await gen.__anext__()
+        except StopAsyncIteration:
+            return gen, None
+        except BaseException:
+            await gen.aclose()
+            raise
+
+    @staticmethod
+    def _close(first):
+        first[0].close()
+
+    @staticmethod
+    async def _aclose(first):
+        await first[0].aclose()
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return self._race(lambda llm: llm.chat(messages, **kwargs))
+
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        return self._stream(self._race(lambda llm: self._first(llm.stream_chat(messages, **kwargs)), self._close))
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return self._race(lambda llm: llm.complete(prompt, formatted=formatted, **kwargs))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        return self._stream(self._race(lambda llm: self._first(llm.stream_complete(prompt, formatted=formatted, **kwargs)), self._close))
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await self._arace(lambda llm: llm.achat(messages, **kwargs))
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        async def start(llm):
+            return await self._afirst(await llm.astream_chat(messages, **kwargs))
+
+        return self._astream(await self._arace(start, self._aclose))
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await self._arace(lambda llm: llm.acomplete(prompt, formatted=formatted, **kwargs))
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        async def start(llm):
+            return await self._afirst(await llm.astream_complete(prompt, formatted=formatted, **kwargs))
+
+        return self._astream(await self._arace(start, self._aclose))
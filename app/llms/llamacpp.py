@@ -0,0 +1,212 @@
+import asyncio
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    ChatResponseGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+    MessageRole,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+MODELS_PATH = "./models"
+
+
+class LlamaCPP(CustomLLM):
+
+    model: str = Field(description="GGUF file name inside the models/ directory, or a path to one.")
+    temperature: float = Field(default=0.1, description="The temperature to use for sampling.")
+    max_tokens: int = Field(default=512, description="The maximum number of tokens to generate.")
+    context_window: int = Field(default=4096, description="The maximum number of context tokens for the model.")
+    contexts: int = Field(default=1, description="Number of contexts, and so of concurrent requests.")
+    n_threads: Optional[int] = Field(default=None, description="CPU threads per context, defaults to the CPU count divided by contexts.")
+    n_gpu_layers: int = Field(default=0, description="Layers to offload to the GPU.")
+    cache_size: int = Field(default=1 << 30, description="Bytes of prompt cache per context, 0 disables it.")
+    system: str = Field(default="", description="Default system message to send to the model.")
+    generate_kwargs: Dict[str, Any] = Field(default_factory=dict, description="Additional sampling parameters for llama.cpp.")
+
+    _pool: queue.Queue = PrivateAttr()
+    _created: int = PrivateAttr(default=0)
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs: Any) -> None:
+        try:
+            import llama_cpp  # noqa: F401
+        except ImportError:
+            raise ImportError(
+                "llama.cpp is not installed. Please install it using `pip install llama-cpp-python`."
+            )
+        super().__init__(**kwargs)
+
+        if not os.path.isfile(self.model_path):
+            raise ValueError("Model file " + self.model_path + " not found.")
+
+        self._pool = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LlamaCPP"
+
+    @property
+    def model_path(self) -> str:
+        if os.path.isabs(self.model) or os.path.isfile(self.model):
+            return self.model
+        return os.path.join(MODELS_PATH, self.model)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.max_tokens,
+            model_name=self.model,
+            is_chat_model=True,
+        )
+
+    def memorySize(self) -> int:
+        # weights are mmapped and shared, contexts only add their KV cache
+        return os.path.getsize(self.model_path)
+
+    def _load(self):
+        from llama_cpp import Llama, LlamaRAMCache
+
+        llama = Llama(
+            model_path=self.model_path,
+            n_ctx=self.context_window,
+            n_threads=self.n_threads or max(1, (os.cpu_count() or 1) // self.contexts),
+            n_gpu_layers=self.n_gpu_layers,
+            use_mmap=True,
+            verbose=False,
+        )
+        if self.cache_size > 0:
+            llama.set_cache(LlamaRAMCache(capacity_bytes=self.cache_size))
+        return llama
+
+    @contextmanager
+    def _context(self):
+        llama = None
+        try:
+            llama = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.contexts:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    llama = self._load()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                llama = self._pool.get()
+
+        try:
+            yield llama
+        finally:
+            self._pool.put(llama)
+
+    def _kwargs(self, **kwargs: Any) -> Dict[str, Any]:
+        return {
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            **self.generate_kwargs,
+            **kwargs,
+        }
+
+    def _messages(self, messages: Sequence[ChatMessage]):
+        messages = list(messages)
+        if self.system and len(messages) > 0 and messages[0].role != "system":
+            messages.insert(0, ChatMessage(role="system", content=self.system))
+        return [{"role": message.role.value, "content": message.content or ""} for message in messages]
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        with self._context() as llama:
+            raw = llama.create_chat_completion(messages=self._messages(messages), **self._kwargs(**kwargs))
+        message = raw["choices"][0]["message"]
+        return ChatResponse(
+            message=ChatMessage(role=MessageRole.ASSISTANT, content=message.get("content")),
+            raw=raw,
+        )
+
+    @llm_chat_callback()
+    def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
+        messages = self._messages(messages)
+        kwargs = self._kwargs(**kwargs)
+
+        def gen() -> ChatResponseGen:
+            with self._context() as llama:
+                text = ""
+                for chunk in llama.create_chat_completion(messages=messages, stream=True, **kwargs):
+                    delta = chunk["choices"][0]["delta"].get("content") or ""
+                    text += delta
+                    yield ChatResponse(
+                        message=ChatMessage(role=MessageRole.ASSISTANT, content=text),
+                        delta=delta,
+                        raw=chunk,
+                    )
+
+        return gen()
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        with self._context() as llama:
+            raw = llama.create_completion(prompt=prompt, **self._kwargs(**kwargs))
+        return CompletionResponse(text=raw["choices"][0]["text"], raw=raw)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        kwargs = self._kwargs(**kwargs)
+
+        def gen() -> CompletionResponseGen:
+            with self._context() as llama:
+                text = ""
+                for chunk in llama.create_completion(prompt=prompt, stream=True, **kwargs):
+                    delta = chunk["choices"][0]["text"]
+                    text += delta
+                    yield CompletionResponse(text=text, delta=delta, raw=chunk)
+
+        return gen()
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        return await asyncio.to_thread(self.chat, messages, **kwargs)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return await asyncio.to_thread(self.complete, prompt, formatted, **kwargs)
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        return self._athread(self.stream_chat(messages, **kwargs))
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        return self._athread(self.stream_complete(prompt, formatted, **kwargs))
+
+    async def _athread(self, gen):
+        # llama.cpp evaluates on the calling thread, so stream from a worker thread
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, gen, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            await asyncio.to_thread(gen.close)
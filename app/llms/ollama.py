@@ -1,57 +1,302 @@
-from llama_index.llms.ollama import Ollama
-
-from typing import Any, Sequence
+import asyncio
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Sequence
 
+import httpx
+import ollama
+from llama_index.llms.ollama import Ollama
 
 from llama_index.core.bridge.pydantic import Field
 from llama_index.core.base.llms.types import (
     ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
     ChatResponseGen,
     CompletionResponse,
+    CompletionResponseAsyncGen,
     CompletionResponseGen,
+    MessageRole,
 )
 from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
 
-class Ollama(Ollama):
+from app.llms.balancer import getBalancer
+
+
+_clients = {}
+_asyncClients = weakref.WeakKeyDictionary()
+_clientsLock = threading.Lock()
+
+
+def getClient(host: str = None, timeout: float = None) -> ollama.Client:
+    key = (host, timeout)
+    with _clientsLock:
+        if key not in _clients:
+            _clients[key] = ollama.Client(host=host, timeout=timeout)
+        return _clients[key]
+
+
+def getAsyncClient(host: str = None, timeout: float = None) -> ollama.AsyncClient:
+    loop = asyncio.get_running_loop()
+    key = (host, timeout)
+    with _clientsLock:
+        clients = _asyncClients.setdefault(loop, {})
+        if key not in clients:
+            clients[key] = ollama.AsyncClient(host=host, timeout=timeout)
+        return clients[key]
+
+
+FAILOVER_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+class OllamaHosts:
+
+    @property
+    def balancer(self):
+        return getBalancer(self.hosts) if self.hosts else None
+
+    def _request(self, call):
+        balancer = self.balancer
+        if balancer is None:
+            return call(getClient(self.base_url, self.request_timeout))
+
+        tried = []
+        while True:
+            host = balancer.acquire(self.model, tried)
+            if host is None:
+                raise error
+            try:
+                result = call(getClient(host.url, self.request_timeout))
+            except FAILOVER_ERRORS as e:
+                balancer.release(host, failed=True)
+                tried.append(host.url)
+                error = e
+                continue
+            except Exception:
+                balancer.release(host)
+                raise
+            balancer.release(host, self.model, getattr(self, "keep_alive", None))
+            return result
+
+    def _stream(self, call):
+        balancer = self.balancer
+        if balancer is None:
+            yield from call(getClient(self.base_url, self.request_timeout))
+            return
+
+        tried = []
+        while True:
+            host = balancer.acquire(self.model, tried)
+            if host is None:
+                raise error
+            started = failed = False
+            try:
+                for chunk in call(getClient(host.url, self.request_timeout)):
+                    started = True
+                    yield chunk
+            except FAILOVER_ERRORS as e:
+                failed = True
+                if started:
+                    raise
+                tried.append(host.url)
+                error = e
+                continue
+            finally:
+                balancer.release(host, self.model if started else None, getattr(self, "keep_alive", None), failed)
+            return
+
+    async def _arequest(self, call):
+        balancer = self.balancer
+        if balancer is None:
+            return await call(getAsyncClient(self.base_url, self.request_timeout))
+
+        tried = []
+        while True:
+            host = balancer.acquire(self.model, tried)
+            if host is None:
+                raise error
+            try:
+                result = await call(getAsyncClient(host.url, self.request_timeout))
+            except FAILOVER_ERRORS as e:
+                balancer.release(host, failed=True)
+                tried.append(host.url)
+                error = e
+                continue
+            except BaseException:
+                balancer.release(host)
+                raise
+            balancer.release(host, self.model, getattr(self, "keep_alive", None))
+            return result
+
+    async def _astream(self, call):
+        balancer = self.balancer
+        if balancer is None:
+            async for chunk in await call(getAsyncClient(self.base_url, self.request_timeout)):
+                yield chunk
+            return
+
+        tried = []
+        while True:
+            host = balancer.acquire(self.model, tried)
+            if host is None:
+                raise error
+            started = failed = False
+            try:
+                async for chunk in await call(getAsyncClient(host.url, self.request_timeout)):
+                    started = True
+                    yield chunk
+            except FAILOVER_ERRORS as e:
+                failed = True
+                if started:
+                    raise
+                tried.append(host.url)
+                error = e
+                continue
+            finally:
+                balancer.release(host, self.model if started else None, getattr(self, "keep_alive", None), failed)
+            return
+
+
+def get_additional_kwargs(response: Dict[str, Any], exclude: Sequence[str]) -> Dict[str, Any]:
+    return {k: v for k, v in response.items() if k not in exclude}
+
+
+class Ollama(OllamaHosts, Ollama):
+    hosts: Optional[List[str]] = Field(
+        default=None,
+        description="Ollama hosts to balance requests over, instead of base_url.",
+    )
     system: str = Field(
         default="", description="Default system message to send to the model."
     )
     keep_alive: int = Field(
         default=0,
-        description="Time, in minutes, to wait before unloading model.",
+        description="Time, in seconds, to wait before unloading model. Negative keeps it loaded.",
     )
 
     request_timeout = 120.0
 
-
-    @llm_chat_callback()
-    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+    def _messages(self, messages: Sequence[ChatMessage]):
+        messages = list(messages)
         if self.system and len(messages) > 0 and messages[0].role != "system":
             messages.insert(
                 0, ChatMessage(role="system", content=self.system)
             )
-        kwargs["keep_alive"] = self.keep_alive
-        return super().chat(messages, **kwargs)
-    
+        return [
+            {
+                "role": message.role.value,
+                "content": message.content or "",
+                **message.additional_kwargs,
+            }
+            for message in messages
+        ]
+
+    def _chatKwargs(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        return {
+            "model": self.model,
+            "messages": self._messages(messages),
+            "options": self._model_kwargs,
+            "format": "json" if self.json_mode else "",
+            "keep_alive": self.keep_alive,
+            **kwargs,
+        }
+
+    def _generateKwargs(self, prompt: str, **kwargs: Any):
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "system": self.system,
+            "options": self._model_kwargs,
+            "format": "json" if self.json_mode else "",
+            "keep_alive": self.keep_alive,
+            **kwargs,
+        }
+
+    def _chatResponse(self, raw, text=None) -> ChatResponse:
+        message = raw["message"]
+        return ChatResponse(
+            message=ChatMessage(
+                content=message.get("content") if text is None else text,
+                role=MessageRole(message.get("role")),
+                additional_kwargs=get_additional_kwargs(message, ("content", "role")),
+            ),
+            delta=None if text is None else message.get("content"),
+            raw=raw,
+            additional_kwargs=get_additional_kwargs(raw, ("message",)),
+        )
+
+    def _completionResponse(self, raw, text=None) -> CompletionResponse:
+        return CompletionResponse(
+            text=raw.get("response") if text is None else text,
+            delta=None if text is None else raw.get("response"),
+            raw=raw,
+            additional_kwargs=get_additional_kwargs(raw, ("response",)),
+        )
+
+    @llm_chat_callback()
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        kwargs = self._chatKwargs(messages, **kwargs)
+        raw = self._request(lambda client: client.chat(stream=False, **kwargs))
+        return self._chatResponse(raw)
+
     @llm_chat_callback()
     def stream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseGen:
-        if self.system and len(messages) > 0 and messages[0].role != "system":
-            messages.insert(
-                0, ChatMessage(role="system", content=self.system)
-            )
-        kwargs["keep_alive"] = self.keep_alive
-        yield from super().stream_chat(messages, **kwargs)
-    
+        kwargs = self._chatKwargs(messages, **kwargs)
+        text = ""
+        for chunk in self._stream(lambda client: client.chat(stream=True, **kwargs)):
+            if chunk.get("done"):
+                continue
+            text += chunk["message"].get("content") or ""
+            yield self._chatResponse(chunk, text)
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        kwargs = self._chatKwargs(messages, **kwargs)
+        raw = await self._arequest(lambda client: client.chat(stream=False, **kwargs))
+        return self._chatResponse(raw)
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        kwargs = self._chatKwargs(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            text = ""
+            async for chunk in self._astream(lambda client: client.chat(stream=True, **kwargs)):
+                if chunk.get("done"):
+                    continue
+                text += chunk["message"].get("content") or ""
+                yield self._chatResponse(chunk, text)
+
+        return gen()
+
     @llm_completion_callback()
     def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
-        if self.system:
-            kwargs["system"] = self.system
-        kwargs["keep_alive"] = self.keep_alive
-        return super().complete(prompt, formatted, **kwargs)
-    
+        kwargs = self._generateKwargs(prompt, **kwargs)
+        raw = self._request(lambda client: client.generate(stream=False, **kwargs))
+        return self._completionResponse(raw)
+
     @llm_completion_callback()
     def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
-        if self.system:
-            kwargs["system"] = self.system
-        kwargs["keep_alive"] = self.keep_alive
-        yield from super().stream_complete(prompt, formatted, **kwargs)
\ No newline at end of file
+        kwargs = self._generateKwargs(prompt, **kwargs)
+        text = ""
+        for chunk in self._stream(lambda client: client.generate(stream=True, **kwargs)):
+            text += chunk.get("response") or ""
+            yield self._completionResponse(chunk, text)
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        kwargs = self._generateKwargs(prompt, **kwargs)
+        raw = await self._arequest(lambda client: client.generate(stream=False, **kwargs))
+        return self._completionResponse(raw)
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseAsyncGen:
+        kwargs = self._generateKwargs(prompt, **kwargs)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ""
+            async for chunk in self._astream(lambda client: client.generate(stream=True, **kwargs)):
+                text += chunk.get("response") or ""
+                yield self._completionResponse(chunk, text)
+
+        return gen()
@@ -1,4 +1,4 @@
-from typing import Any, Dict, Sequence, Tuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 from llama_index.core.bridge.pydantic import Field
 from llama_index.core.constants import DEFAULT_CONTEXT_WINDOW, DEFAULT_NUM_OUTPUTS
@@ -19,6 +19,8 @@ from llama_index.core.multi_modal_llms.base import (
 from llama_index.core.multi_modal_llms.generic_utils import image_documents_to_base64
 from llama_index.core.schema import ImageDocument
 
+from app.llms.ollama import OllamaHosts
+
 
 def get_additional_kwargs(
     response: Dict[str, Any], exclude: Tuple[str, ...]
@@ -47,7 +49,15 @@ def _messages_to_dicts(messages: Sequence[ChatMessage]) -> Sequence[Dict[str, An
     return results
 
 
-class OllamaMultiModal(MultiModalLLM):
+class OllamaMultiModal(OllamaHosts, MultiModalLLM):
+    base_url: Optional[str] = Field(
+        default=None,
+        description="Base url the model is hosted under, defaults to OLLAMA_HOST.",
+    )
+    hosts: Optional[List[str]] = Field(
+        default=None,
+        description="Ollama hosts to balance requests over, instead of base_url.",
+    )
     model: str = Field(description="The MultiModal Ollama model to use.")
     temperature: float = Field(
         default=0.75,
@@ -60,6 +70,10 @@ class OllamaMultiModal(MultiModalLLM):
         description="The maximum number of context tokens for the model.",
         gt=0,
     )
+    request_timeout: Optional[float] = Field(
+        default=None,
+        description="The timeout for making http request to Ollama API server.",
+    )
     additional_kwargs: Dict[str, Any] = Field(
         default_factory=dict,
         description="Additional model parameters for the Ollama API.",
@@ -101,49 +115,61 @@ class OllamaMultiModal(MultiModalLLM):
             **self.additional_kwargs,
         }
 
-    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
-        """Chat."""
-        import ollama
+    def _chatKwargs(self, messages: Sequence[ChatMessage], **kwargs: Any) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": _messages_to_dicts(messages),
+            "options": self._model_kwargs,
+            **kwargs,
+        }
+
+    def _generateKwargs(self, prompt: str, image_documents: Sequence[ImageDocument], **kwargs: Any) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "images": image_documents_to_base64(image_documents),
+            "options": self._model_kwargs,
+            **kwargs,
+        }
 
-        ollama_messages = _messages_to_dicts(messages)
-        response = ollama.chat(model=self.model, messages=ollama_messages, stream=False, **kwargs)
+    def _chatResponse(self, response, text=None) -> ChatResponse:
+        message = response["message"]
         return ChatResponse(
             message=ChatMessage(
-                content=response["message"]["content"],
-                role=MessageRole(response["message"]["role"]),
-                additional_kwargs=get_additional_kwargs(response, ("message",)),
+                content=message["content"] if text is None else text,
+                role=MessageRole(message["role"]),
+                additional_kwargs=get_additional_kwargs(message, ("content", "role")),
             ),
-            raw=response["message"],
+            delta=None if text is None else message.get("content"),
+            raw=message,
             additional_kwargs=get_additional_kwargs(response, ("message",)),
         )
 
+    def _completionResponse(self, response, text=None) -> CompletionResponse:
+        return CompletionResponse(
+            text=response["response"] if text is None else text,
+            delta=None if text is None else response.get("response"),
+            raw=response,
+            additional_kwargs=get_additional_kwargs(response, ("response",)),
+        )
+
+    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        """Chat."""
+        kwargs = self._chatKwargs(messages, **kwargs)
+        response = self._request(lambda client: client.chat(stream=False, **kwargs))
+        return self._chatResponse(response)
+
     def stream_chat(
         self, messages: Sequence[ChatMessage], **kwargs: Any
     ) -> ChatResponseGen:
         """Stream chat."""
-        import ollama
-
-        ollama_messages = _messages_to_dicts(messages)
-        response = ollama.chat(model=self.model, messages=ollama_messages, stream=True, **kwargs)
+        kwargs = self._chatKwargs(messages, **kwargs)
         text = ""
-        for chunk in response:
-            if "done" in chunk and chunk["done"]:
-                break
-            message = chunk["message"]
-            delta = message.get("content")
-            text += delta
-            yield ChatResponse(
-                message=ChatMessage(
-                    content=text,
-                    role=MessageRole(message["role"]),
-                    additional_kwargs=get_additional_kwargs(
-                        message, ("content", "role")
-                    ),
-                ),
-                delta=delta,
-                raw=message,
-                additional_kwargs=get_additional_kwargs(chunk, ("message",)),
-            )
+        for chunk in self._stream(lambda client: client.chat(stream=True, **kwargs)):
+            if chunk.get("done"):
+                continue
+            text += chunk["message"].get("content") or ""
+            yield self._chatResponse(chunk, text)
 
     def complete(
         self,
@@ -153,21 +179,9 @@ class OllamaMultiModal(MultiModalLLM):
         **kwargs: Any,
     ) -> CompletionResponse:
         """Complete."""
-        import ollama
-
-        response = ollama.generate(
-            model=self.model,
-            prompt=prompt,
-            images=image_documents_to_base64(image_documents),
-            stream=False,
-            options=self._model_kwargs,
-            **kwargs,
-        )
-        return CompletionResponse(
-            text=response["response"],
-            raw=response,
-            additional_kwargs=get_additional_kwargs(response, ("response",)),
-        )
+        kwargs = self._generateKwargs(prompt, image_documents, **kwargs)
+        response = self._request(lambda client: client.generate(stream=False, **kwargs))
+        return self._completionResponse(response)
 
     def stream_complete(
         self,
@@ -177,48 +191,61 @@ class OllamaMultiModal(MultiModalLLM):
         **kwargs: Any,
     ) -> CompletionResponseGen:
         """Stream complete."""
-        import ollama
-
-        response = ollama.generate(
-            model=self.model,
-            prompt=prompt,
-            images=image_documents_to_base64(image_documents),
-            stream=True,
-            options=self._model_kwargs,
-            **kwargs,
-        )
+        kwargs = self._generateKwargs(prompt, image_documents, **kwargs)
         text = ""
-        for chunk in response:
-            if "done" in chunk and chunk["done"]:
-                break
-            delta = chunk.get("response")
-            text += delta
-            yield CompletionResponse(
-                text=str(chunk["response"]),
-                delta=delta,
-                raw=chunk,
-                additional_kwargs=get_additional_kwargs(chunk, ("response",)),
-            )
+        for chunk in self._stream(lambda client: client.generate(stream=True, **kwargs)):
+            if chunk.get("done"):
+                continue
+            text += chunk.get("response") or ""
+            yield self._completionResponse(chunk, text)
 
     async def acomplete(
         self, prompt: str, image_documents: Sequence[ImageDocument], **kwargs: Any
     ) -> CompletionResponse:
-        raise NotImplementedError("Ollama does not support async completion.")
+        """Async complete."""
+        kwargs = self._generateKwargs(prompt, image_documents, **kwargs)
+        response = await self._arequest(lambda client: client.generate(stream=False, **kwargs))
+        return self._completionResponse(response)
 
     async def achat(
         self, messages: Sequence[ChatMessage], **kwargs: Any
     ) -> ChatResponse:
-        raise NotImplementedError("Ollama does not support async chat.")
+        """Async chat."""
+        kwargs = self._chatKwargs(messages, **kwargs)
+        response = await self._arequest(lambda client: client.chat(stream=False, **kwargs))
+        return self._chatResponse(response)
 
     async def astream_complete(
         self, prompt: str, image_documents: Sequence[ImageDocument], **kwargs: Any
     ) -> CompletionResponseAsyncGen:
-        raise NotImplementedError("Ollama does not support async streaming completion.")
+        """Async stream complete."""
+        kwargs = self._generateKwargs(prompt, image_documents, **kwargs)
+
+        async def gen() -> CompletionResponseAsyncGen:
+            text = ""
+            async for chunk in self._astream(lambda client: client.generate(stream=True, **kwargs)):
+                if chunk.get("done"):
+                    continue
+                text += chunk.get("response") or ""
+                yield self._completionResponse(chunk, text)
+
+        return gen()
 
     async def astream_chat(
         self, messages: Sequence[ChatMessage], **kwargs: Any
     ) -> ChatResponseAsyncGen:
-        raise NotImplementedError("Ollama does not support async streaming chat.")
+        """Async stream chat."""
+        kwargs = self._chatKwargs(messages, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            text = ""
+            async for chunk in self._astream(lambda client: client.chat(stream=True, **kwargs)):
+                if chunk.get("done"):
+                    continue
+                text += chunk["message"].get("content") or ""
+                yield self._chatResponse(chunk, text)
+
+        return gen()
 
 
 
@@ -228,49 +255,22 @@ class OllamaMultiModal2(OllamaMultiModal):
     )
     keep_alive: int = Field(
         default=0,
-        description="Time, in minutes, to wait before unloading model.",
+        description="Time, in seconds, to wait before unloading model. Negative keeps it loaded.",
     )
 
     request_timeout = 120.0
 
-    def chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
-        if self.system and len(messages) > 0 and messages[0].role != "system":
-            messages.insert(
-                0, ChatMessage(role="system", content=self.system)
-            )
-        kwargs["keep_alive"] = self.keep_alive
-        return super().chat(messages, **kwargs)
-    
-    def stream_chat(
-        self, messages: Sequence[ChatMessage], **kwargs: Any
-    ) -> ChatResponseGen:
+    def _chatKwargs(self, messages: Sequence[ChatMessage], **kwargs: Any) -> Dict[str, Any]:
+        messages = list(messages)
         if self.system and len(messages) > 0 and messages[0].role != "system":
             messages.insert(
                 0, ChatMessage(role="system", content=self.system)
             )
         kwargs["keep_alive"] = self.keep_alive
-        yield super().stream_chat(messages, **kwargs)
-    
-    def complete(
-        self,
-        prompt: str,
-        image_documents: Sequence[ImageDocument],
-        formatted: bool = False,
-        **kwargs: Any,
-    ) -> CompletionResponse:
-        if self.system:
-            kwargs["system"] = self.system
-        kwargs["keep_alive"] = self.keep_alive
-        return super().complete(prompt, image_documents, formatted, **kwargs)
-    
-    def stream_complete(
-        self,
-        prompt: str,
-        image_documents: Sequence[ImageDocument],
-        formatted: bool = False,
-        **kwargs: Any,
-    ) -> CompletionResponseGen:
+        return super()._chatKwargs(messages, **kwargs)
+
+    def _generateKwargs(self, prompt: str, image_documents: Sequence[ImageDocument], **kwargs: Any) -> Dict[str, Any]:
         if self.system:
             kwargs["system"] = self.system
         kwargs["keep_alive"] = self.keep_alive
-        yield super().stream_complete(prompt, image_documents, formatted, **kwargs)
\ No newline at end of file
+        return super()._generateKwargs(prompt, image_documents, **kwargs)
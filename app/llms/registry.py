@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+from app.config import RESTAI_OLLAMA_REFRESH_INTERVAL, RESTAI_OLLAMA_RETRY_AFTER
+from app.llms.ollama import getClient
+
+
+class ModelPulling(Exception):
+    def __init__(self, model: str, retry_after: int):
+        super().__init__("Model " + model + " is being pulled, retry in " + str(retry_after) + " seconds.")
+        self.model = model
+        self.retry_after = retry_after
+
+
+def modelName(model: str) -> str:
+    return model if ":" in model else model + ":latest"
+
+
+class PullJob:
+    def __init__(self, host: str, model: str):
+        self.host = host
+        self.model = model
+        self.status = "pulling"
+        self.completed = 0
+        self.total = 0
+        self.error = None
+        self.started = time.monotonic()
+        self.finished = None
+
+    def retryAfter(self) -> int:
+        elapsed = time.monotonic() - self.started
+        if self.total and self.completed and elapsed > 0:
+            rate = self.completed / elapsed
+            return max(1, int((self.total - self.completed) / rate))
+        return RESTAI_OLLAMA_RETRY_AFTER
+
+    def info(self):
+        return {
+            "host": self.host,
+            "model": self.model,
+            "status": self.status,
+            "completed": self.completed,
+            "total": self.total,
+            "error": self.error,
+        }
+
+
+class ModelRegistry:
+
+    def __init__(self, executor, interval: float = RESTAI_OLLAMA_REFRESH_INTERVAL):
+        self.executor = executor
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.models = {}
+        self.pulls = {}
+        self.sizes = {}
+        self.stopped = threading.Event()
+        self.watcher = None
+
+    def refresh(self, host: str = None):
+        try:
+            listed = getClient(host).list().get("models", [])
+        except Exception as e:
+            logging.warning("Could not list models from Ollama " + str(host or "default host") + ": " + str(e))
+            with self.lock:
+                self.models.setdefault(host, None)
+            return
+
+        with self.lock:
+            self.models[host] = set(model["name"] for model in listed)
+            for model in listed:
+                self.sizes[model["name"]] = model.get("size", 0)
+
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                hosts = list(self.models.keys())
+            for host in hosts:
+                self.refresh(host)
+
+    def isAvailable(self, host: str, model: str) -> bool:
+        with self.lock:
+            seen = host in self.models
+            if not seen:
+                self.models[host] = None
+            watch = self.interval > 0 and self.watcher is None
+            if watch:
+                self.watcher = threading.Thread(target=self.watch, daemon=True)
+
+        if not seen:
+            # a slow host must not hold up the request, it is listed in the background
+            self.executor.submit(self.refresh, host)
+        if watch:
+            self.watcher.start()
+
+        # Hosts that could not be listed yet are given the benefit of the doubt.
+        models = self.models.get(host)
+        return models is None or modelName(model) in models
+
+    def size(self, model: str) -> int:
+        return self.sizes.get(modelName(model), 0)
+
+    def ensure(self, hosts: list, model: str):
+        # returns when at least one host has the model, pulling it where missing
+        available = [host for host in hosts if self.isAvailable(host, model)]
+
+        job = None
+        for host in hosts:
+            if host not in available:
+                job = self.pull(host, model) or job
+
+        if available:
+            return
+
+        if job is not None and job.status == "failed":
+            raise Exception("Model " + model + " could not be pulled: " + str(job.error))
+
+        raise ModelPulling(model, job.retryAfter() if job is not None else RESTAI_OLLAMA_RETRY_AFTER)
+
+    def pull(self, host: str, model: str) -> PullJob:
+        key = (host, modelName(model))
+        with self.lock:
+            job = self.pulls.get(key)
+            if job is not None and (job.status == "pulling" or (job.status == "failed" and time.monotonic() - job.finished < self.interval)):
+                return job
+
+            job = PullJob(host, model)
+            self.pulls[key] = job
+
+        logging.info("Model " + model + " not found, pulling it into Ollama " + str(host or "default host"))
+        self.executor.submit(self.run, job)
+        return job
+
+    def run(self, job: PullJob):
+        try:
+            for progress in getClient(job.host).pull(job.model, stream=True):
+                if progress.get("total"):
+                    job.total = progress["total"]
+                    job.completed = progress.get("completed", 0)
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logging.error("Pulling " + job.model + " failed: " + job.error)
+        finally:
+            job.finished = time.monotonic()
+
+        if job.status == "done":
+            self.refresh(job.host)
+            with self.lock:
+                self.pulls.pop((job.host, modelName(job.model)), None)
+
+    def status(self):
+        with self.lock:
+            return {
+                "hosts": [{"host": host, "models": sorted(models or [])} for host, models in self.models.items()],
+                "pulls": [job.info() for job in self.pulls.values()],
+            }
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from app.config import RESTAI_OLLAMA_KEEP_ALIVE_MAX, RESTAI_OLLAMA_KEEP_ALIVE_MIN, RESTAI_OLLAMA_MEMORY_BUDGET
+from app.llms.ollama import getClient
+
+# keep a model loaded for this many average gaps between its requests
+KEEP_ALIVE_GAPS = 3
+
+
+class Residency:
+    def __init__(self, model: str, hosts: tuple, size: int):
+        self.model = model
+        self.hosts = hosts
+        self.size = size
+        self.requests = deque(maxlen=20)
+        self.keep_alive = 0
+        self.expires = 0
+
+    def isWarm(self, now: float) -> bool:
+        return self.expires > now
+
+
+class ResidencyManager:
+
+    def __init__(self, registry, executor):
+        self.registry = registry
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.residents = {}
+
+    def keepAlive(self, residency: Residency) -> int:
+        requests = residency.requests
+        if len(requests) < 2:
+            return RESTAI_OLLAMA_KEEP_ALIVE_MIN
+
+        gap = (requests[-1] - requests[0]) / (len(requests) - 1)
+        return int(min(RESTAI_OLLAMA_KEEP_ALIVE_MAX, max(RESTAI_OLLAMA_KEEP_ALIVE_MIN, gap * KEEP_ALIVE_GAPS)))
+
+    def touch(self, llm, model: str, hosts: list) -> int:
+        now = time.monotonic()
+        hosts = tuple(hosts)
+        evicted = []
+
+        with self.lock:
+            residency = self.residents.get(llm)
+            if residency is None:
+                residency = self.residents[llm] = Residency(model, hosts, 0)
+            residency.model = model
+            residency.hosts = hosts
+            residency.size = self.registry.size(model) or residency.size
+            residency.requests.append(now)
+
+            if RESTAI_OLLAMA_MEMORY_BUDGET > 0 and not residency.isWarm(now):
+                budget = RESTAI_OLLAMA_MEMORY_BUDGET * 1024 ** 3
+                warm = sorted(
+                    [other for name, other in self.residents.items() if name != llm and other.hosts == hosts and other.isWarm(now)],
+                    key=lambda other: other.requests[-1])
+                used = sum(other.size for other in warm)
+                while warm and used + residency.size > budget:
+                    other = warm.pop(0)
+                    other.expires = 0
+                    used -= other.size
+                    evicted.append(other)
+
+            residency.keep_alive = self.keepAlive(residency)
+            residency.expires = now + residency.keep_alive
+            keep_alive = residency.keep_alive
+
+        for other in evicted:
+            self.executor.submit(self.unload, other.model, other.hosts)
+
+        return keep_alive
+
+    def unload(self, model: str, hosts: tuple):
+        for host in hosts:
+            try:
+                getClient(host).generate(model=model, keep_alive=0)
+                logging.info("Unloaded " + model + " from Ollama " + str(host or "default host"))
+            except Exception as e:
+                logging.warning("Could not unload " + model + " from Ollama " + str(host or "default host") + ": " + str(e))
+
+    def forget(self, llm):
+        with self.lock:
+            self.residents.pop(llm, None)
+
+    def status(self):
+        now = time.monotonic()
+        with self.lock:
+            return [
+                {
+                    "llm": name,
+                    "model": residency.model,
+                    "size": residency.size,
+                    "keep_alive": residency.keep_alive,
+                    "expires_in": int(residency.expires - now),
+                }
+                for name, residency in self.residents.items() if residency.isWarm(now)
+            ]
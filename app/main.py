@@ -1,6 +1,8 @@
 import copy
 import uuid
 import os
+from anyio import to_thread
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 from unidecode import unidecode
 from sqlalchemy.orm import Session
@@ -44,7 +46,7 @@ from app.models.models import ClassifierModel, ClassifierResponse, FindModel, In
 from app.loaders.url import SeleniumWebReader
 from app.database import dbc, get_db
 from app.brain import Brain
-from app.auth import create_access_token, get_current_username, get_current_username_admin, get_current_username_project, get_current_username_user
+from app.auth import create_access_token, get_current_username, get_current_username_admin, get_current_username_project, get_current_username_user, has_project_access
 from app.tools import get_logger
 from app.vectordb.tools import FindFileLoader, IndexDocuments, ExtractKeywordsForMetadata
 
@@ -88,6 +90,11 @@ brain = Brain()
 logs_inference = get_logger("inference")
 
 
+@app.on_event("startup")
+async def startup():
+    to_thread.current_default_thread_limiter().total_tokens = config.RESTAI_REQUEST_THREADS
+
+
 @app.get("/")
 async def get(request: Request):
     return "RESTAI, so many 'A's and 'I's, so little time..."
@@ -110,6 +117,7 @@ async def get_info(user: User = Depends(get_current_username), db: Session = Dep
             "description": llm.description,
             "type": llm.type
         })
+    output["resident"] = brain.memoryModelsInfo()
 
     for embedding in EMBEDDINGS:
         _, _, privacy, description, _ = EMBEDDINGS[embedding]
@@ -216,6 +224,23 @@ async def get_users(
     return {"users": users_final}
 
 
+@app.get("/ollama/models")
+async def get_ollama_models(user: User = Depends(get_current_username_admin)):
+    output = brain.modelRegistry.status()
+    output["warm"] = brain.residency.status()
+    return output
+
+
+@app.get("/metrics/llms")
+async def get_llm_metrics(user: User = Depends(get_current_username_admin)):
+    return brain.admissionMetrics()
+
+
+@app.get("/metrics/cascade")
+async def get_cascade_metrics(user: User = Depends(get_current_username_admin)):
+    return brain.cascadeStats.metrics()
+
+
 @app.get("/llms/{llmname}", response_model=LLMModel)
 async def get_llm(llmname: str, user: User = Depends(get_current_username), db: Session = Depends(get_db)):
     try:
@@ -240,7 +265,8 @@ async def create_llm(llmc: LLMModel,
                       user: User = Depends(get_current_username_admin),
                       db: Session = Depends(get_db)):
     try:
-        llm = dbc.create_llm(db, llmc.name, llmc.class_name, llmc.options, llmc.privacy, llmc.description, llmc.type)
+        llm = dbc.create_llm(db, llmc.name, llmc.class_name, llmc.options, llmc.privacy, llmc.description, llmc.type,
+                             llmc.max_concurrency, llmc.queue_depth, llmc.queue_timeout)
         return llm
     except Exception as e:
         logging.error(e)
@@ -278,6 +304,7 @@ async def delete_llm(llmname: str,
         if llm is None:
             raise Exception("LLM not found")
         dbc.delete_llm(db, llm)
+        brain.unloadLLM(llmname)
         return {"deleted": llmname}
     except Exception as e:
         logging.error(e)
@@ -377,7 +404,7 @@ async def get_projects(request: Request, user: User = Depends(get_current_userna
 
     for project in projects:
         try:
-            model = brain.getLLM(project.llm, db)
+            model = brain.getLLM(project.llm, db, check=False)
             project.llm_type = model.props.type
             project.llm_privacy = model.props.privacy
         except Exception as e:
@@ -400,7 +427,7 @@ async def get_project(projectName: str, user: User = Depends(get_current_usernam
         final_output = {}
         
         try:
-            llm_model = brain.getLLM(project.model.llm, db)
+            llm_model = brain.getLLM(project.model.llm, db, check=False)
         except Exception as e:
             llm_model = None
 
@@ -411,6 +438,7 @@ async def get_project(projectName: str, user: User = Depends(get_current_usernam
         final_output["human_description"] = output["human_description"]
         final_output["censorship"] = output["censorship"]
         final_output["guard"] = output["guard"]
+        final_output["guard_mode"] = output["guard_mode"]
         
         if project.model.type == "rag":
             if project.vector is not None:
@@ -428,9 +456,12 @@ async def get_project(projectName: str, user: User = Depends(get_current_usernam
             final_output["colbert_rerank"] = output["colbert_rerank"]
             final_output["cache"] = output["cache"]
             final_output["cache_threshold"] = output["cache_threshold"]
+            final_output["guard_label"] = output["guard_label"]
         
         if project.model.type == "inference":
             final_output["system"] = output["system"]
+            final_output["cascade_llm"] = output["cascade_llm"]
+            final_output["cascade_threshold"] = output["cascade_threshold"]
             
         if project.model.type == "agent":
             final_output["system"] = output["system"]
@@ -439,12 +470,22 @@ async def get_project(projectName: str, user: User = Depends(get_current_usernam
         if project.model.type == "ragsql":
             final_output["system"] = output["system"]
             final_output["tables"] = output["tables"]
+            final_output["k"] = output["k"]
+            final_output["embeddings"] = output["embeddings"]
             if output["connection"] is not None:
                 final_output["connection"] = re.sub(
                 r'(?<=://).+?(?=@)', "xxxx:xxxx", output["connection"])
             
+        if project.model.type == "federated":
+            final_output["system"] = output["system"]
+            final_output["k"] = output["k"]
+            final_output["score"] = output["score"]
+            final_output["members"] = output["members"]
+
         if project.model.type == "router":
             final_output["entrances"] = output["entrances"]
+            final_output["embeddings"] = output["embeddings"]
+            final_output["fanout"] = output["fanout"]
             
         if llm_model:
             final_output["llm_type"]=llm_model.props.type
@@ -465,7 +506,10 @@ async def delete_project(projectName: str, user: User = Depends(get_current_user
         
         if proj is not None:
             dbc.delete_project(db, dbc.get_project_by_name(db, projectName))
+            brain.schemaIndexes.pop(projectName, None)
             proj.delete()
+            if proj.model.connection:
+                brain.resetSQLDatabase(proj.model.connection, db)
         else:
             raise HTTPException(
                 status_code=404, detail='Project not found')
@@ -479,23 +523,70 @@ async def delete_project(projectName: str, user: User = Depends(get_current_user
             status_code=500, detail=str(e))
 
 
+def check_members(members, user: User):
+    for name in (members or "").split(","):
+        if name.strip() and not has_project_access(user, name.strip()):
+            raise HTTPException(
+                status_code=403,
+                detail='User not allowed to use project ' + name.strip())
+
+
 @app.patch("/projects/{projectName}")
 async def edit_project(projectName: str, projectModelUpdate: ProjectModelUpdate, user: User = Depends(get_current_username_project), db: Session = Depends(get_db)):
   
-    if projectModelUpdate.llm and brain.getLLM(projectModelUpdate.llm, db) is None:
+    if projectModelUpdate.llm and brain.getLLM(projectModelUpdate.llm, db, check=False) is None:
         raise HTTPException(
             status_code=404,
             detail='LLM not found')
 
     if user.is_private:
-        llm_model = brain.getLLM(projectModelUpdate.llm, db)
+        llm_model = brain.getLLM(projectModelUpdate.llm, db, check=False)
         if llm_model.props.privacy != "private":
             raise HTTPException(
                 status_code=403,
                 detail='User not allowed to use public models')
 
+    if projectModelUpdate.cascade_llm:
+        cascade_model = brain.getLLM(projectModelUpdate.cascade_llm, db, check=False)
+        if cascade_model is None:
+            raise HTTPException(
+                status_code=404,
+                detail='Cascade LLM not found')
+        if user.is_private and cascade_model.props.privacy != "private":
+            raise HTTPException(
+                status_code=403,
+                detail='User not allowed to use public models')
+
+    if projectModelUpdate.embeddings and projectModelUpdate.embeddings not in EMBEDDINGS:
+        raise HTTPException(
+            status_code=404,
+            detail='Embeddings not found')
+
+    if user.is_private and projectModelUpdate.embeddings:
+        _, _, embedding_privacy, _, _ = EMBEDDINGS[projectModelUpdate.embeddings]
+        if embedding_privacy != "private":
+            raise HTTPException(
+                status_code=403,
+                detail='User allowed to private models only')
+
+    check_members(projectModelUpdate.members, user)
+
+    proj_db = dbc.get_project_by_name(db, projectName)
+    connection = proj_db.connection if proj_db is not None else None
+
     try:
         if dbc.editProject(projectName, projectModelUpdate, db):
+            if connection and (projectModelUpdate.connection is not None or projectModelUpdate.tables is not None):
+                brain.resetSQLDatabase(connection, db)
+            if projectModelUpdate.connection is not None or projectModelUpdate.embeddings is not None:
+                project = brain.findProject(projectName, db)
+                if project.model.type == "ragsql" and project.model.connection and project.model.embeddings:
+                    index = brain.getSchemaIndex(project)
+                    if projectModelUpdate.embeddings is not None:
+                        index.reset()
+                    brain.executor.submit(index.refresh)
+            if projectModelUpdate.entrances is not None or projectModelUpdate.embeddings is not None:
+                brain.routerCache.pop(projectName, None)
             return {"project": projectName}
         else:
             raise HTTPException(
@@ -514,7 +605,7 @@ async def create_project(projectModel: ProjectModel, user: User = Depends(get_cu
         projectModel.name.strip().lower().replace(" ", "_"))
     projectModel.name = re.sub(r'[^\w\-.]+', '', projectModel.name)
     
-    if projectModel.type not in ["rag", "inference", "router", "ragsql", "vision", "agent"]:
+    if projectModel.type not in ["rag", "inference", "router", "ragsql", "vision", "agent", "federated"]:
         raise HTTPException(
             status_code=404,
             detail='Invalid project type')
@@ -534,7 +625,14 @@ async def create_project(projectModel: ProjectModel, user: User = Depends(get_cu
         raise HTTPException(
             status_code=404,
             detail='Embeddings not found')
-    if brain.getLLM(projectModel.llm, db) is None:
+
+    check_members(projectModel.members, user)
+
+    if projectModel.type in ["router", "ragsql"] and projectModel.embeddings and projectModel.embeddings not in EMBEDDINGS:
+        raise HTTPException(
+            status_code=404,
+            detail='Embeddings not found')
+    if brain.getLLM(projectModel.llm, db, check=False) is None:
         raise HTTPException(
             status_code=404,
             detail='LLM not found')
@@ -546,13 +644,13 @@ async def create_project(projectModel: ProjectModel, user: User = Depends(get_cu
             detail='Project already exists')
 
     if user.is_private:
-        llm_model = brain.getLLM(projectModel.llm, db)
+        llm_model = brain.getLLM(projectModel.llm, db, check=False)
         if llm_model.props.privacy != "private":
             raise HTTPException(
                 status_code=403,
                 detail='User allowed to private models only')
 
-        if projectModel.type == "rag":
+        if projectModel.type == "rag" or (projectModel.type == "ragsql" and projectModel.embeddings):
             _, _, embedding_privacy, _, _ = EMBEDDINGS[
                 projectModel.embeddings]
             if embedding_privacy != "private":
@@ -576,10 +674,15 @@ async def create_project(projectModel: ProjectModel, user: User = Depends(get_cu
             project.vector = tools.findVectorDB(project)(brain, project)
         
         projectdb = dbc.get_project_by_name(db, project.model.name)
+        if project.model.type == "ragsql" and project.model.connection:
+            projectdb.connection = project.model.connection
         
         userdb = dbc.get_user_by_id(db, user.id)
         userdb.projects.append(projectdb)
         db.commit()
+
+        if project.model.type == "ragsql" and project.model.connection and project.model.embeddings:
+            brain.executor.submit(brain.getSchemaIndex(project).refresh)
         return {"project": projectModel.name}
     except Exception as e:
         logging.error(e)
@@ -643,10 +746,16 @@ async def clone_project(projectName: str, newProjectName: str,
     newProject_db.cache = project.model.cache
     newProject_db.cache_threshold = project.model.cache_threshold
     newProject_db.guard = project.model.guard
+    newProject_db.guard_mode = project.model.guard_mode
     newProject_db.human_name = project.model.human_name
     newProject_db.human_description = project.model.human_description
     newProject_db.tables = project.model.tables
     newProject_db.connection = project.model.connection
+    newProject_db.fanout = project.model.fanout
+    newProject_db.members = project.model.members
+    newProject_db.cascade_llm = project.model.cascade_llm
+    newProject_db.cascade_threshold = project.model.cascade_threshold
+    newProject_db.guard_label = project.model.guard_label
     
     for user in project_db.users:
         newProject_db.users.append(user)
@@ -747,6 +856,8 @@ async def ingest_text(projectName: str, ingest: TextIngestModel,
                 status_code=400, detail='{"error": "Only available for RAG projects."}')
 
         metadata = {"source": ingest.source}
+        if ingest.label and project.model.guard_label:
+            metadata[project.model.guard_label] = ingest.label
         documents = [Document(text=ingest.text, metadata=metadata)]
 
         if ingest.keywords and len(ingest.keywords) > 0:
@@ -906,11 +1017,13 @@ async def chat_query(
             raise HTTPException(
                 status_code=400, detail='{"error": "Missing question"}')
       
-        project = brain.findProject(projectName, db)
+        project = await run_in_threadpool(brain.findProject, projectName, db)
         if project is None:
             raise Exception("Project not found")
 
         return await chat_main(request, brain, project, input, user, db)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
@@ -930,11 +1043,13 @@ async def question_query_endpoint(
             raise HTTPException(
                 status_code=400, detail='{"error": "Missing question"}')
             
-        project = brain.findProject(projectName, db)
+        project = await run_in_threadpool(brain.findProject, projectName, db)
         if project is None:
             raise Exception("Project not found")
             
         return await question_main(request, brain, project, input, user, db)
+    except HTTPException as e:
+        raise e
     except Exception as e:
         logging.error(e)
         traceback.print_tb(e.__traceback__)
@@ -21,7 +21,7 @@ class Memory:
         self.project = project
         self.chats = []
         
-    def loadChat(self, chatModel):
+    def loadChat(self, chatModel, llm=None, executor=None):
         one_day_ago = datetime.datetime.now() - datetime.timedelta(days=1)
 
         self.chats = [chat for chat in self.chats if hasattr(
@@ -31,7 +31,7 @@ class Memory:
             if chat.id == chatModel.id:
                 return chat
 
-        chat = Chat(chatModel)
+        chat = Chat(chatModel, llm, executor)
         self.chats.append(chat)
 
         return chat
\ No newline at end of file
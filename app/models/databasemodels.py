@@ -36,9 +36,15 @@ class ProjectDatabase(Base):
     cache = Column(Boolean, default=False)
     cache_threshold = Column(Float, default=0.9)
     guard = Column(String(255))
+    guard_mode = Column(String(255))
     human_name = Column(String(255))
     human_description = Column(Text)
     tools = Column(Text)
+    fanout = Column(Integer, default=1)
+    members = Column(Text)
+    cascade_llm = Column(String(255))
+    cascade_threshold = Column(Float, default=0.7)
+    guard_label = Column(String(255))
     users = relationship('UserDatabase', secondary=users_projects, back_populates='projects')
     entrances = relationship("RouterEntrancesDatabase", back_populates="project")
 
@@ -77,4 +83,7 @@ class LLMDatabase(Base):
     options = Column(Text)
     privacy = Column(String(255))
     description = Column(Text)
-    type = Column(String(255))
\ No newline at end of file
+    type = Column(String(255))
+    max_concurrency = Column(Integer)
+    queue_depth = Column(Integer)
+    queue_timeout = Column(Float)
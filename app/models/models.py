@@ -1,4 +1,5 @@
-from pydantic import BaseModel, ConfigDict, Field
+import time
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 from typing import Optional, Union
 
 
@@ -14,6 +15,7 @@ class TextIngestModel(BaseModel):
     splitter: str = "sentence"
     chunks: int = 512
     keywords: Union[list[str], None] = None
+    label: Union[str, None] = None
 
 
 class FindModel(BaseModel):
@@ -40,6 +42,8 @@ class QuestionModel(InteractionModel):
     boost: bool = False
     lite: bool = False
     eval: bool = False
+    budget: Union[float, None] = Field(None, gt=0)
+    _received: float = PrivateAttr(default_factory=time.monotonic)
 
 class ChatModel(InteractionModel):
     id: Union[str, None] = None
@@ -61,6 +65,9 @@ class LLMModel(BaseModel):
     privacy: str
     description: Union[str, None] = None
     type: str
+    max_concurrency: Union[int, None] = None
+    queue_depth: Union[int, None] = None
+    queue_timeout: Union[float, None] = None
     model_config = ConfigDict(from_attributes=True)
     
 class Tool(BaseModel):
@@ -72,6 +79,9 @@ class LLMUpdate(BaseModel):
     privacy: str = None
     description: str = None
     type: str = None
+    max_concurrency: int = None
+    queue_depth: int = None
+    queue_timeout: float = None
     
 class UserProject(BaseModel):
     name: str
@@ -98,9 +108,15 @@ class ProjectModel(BaseModel):
     cache: Union[bool, None] = None
     cache_threshold: Union[float, None] = None
     guard: Union[str, None] = None
+    guard_mode: Union[str, None] = None
     human_name: Union[str, None] = None
     human_description: Union[str, None] = None
     tools: Union[str, None] = None
+    fanout: Union[int, None] = None
+    members: Union[str, None] = None
+    cascade_llm: Union[str, None] = None
+    cascade_threshold: Union[float, None] = None
+    guard_label: Union[str, None] = None
     entrances: Union[list[EntranceModel], None] = None
     users: list[ProjectUser] = []
     model_config = ConfigDict(from_attributes=True)
@@ -156,10 +172,16 @@ class ProjectModelUpdate(BaseModel):
     tables: Union[str, None] = None
     llm_rerank: Union[bool, None] = None
     entrances: Union[list[EntranceModel], None] = None
+    fanout: Union[int, None] = None
+    members: Union[str, None] = None
+    cascade_llm: Union[str, None] = None
+    cascade_threshold: Union[float, None] = None
+    guard_label: Union[str, None] = None
     colbert_rerank: Union[bool, None] = None
     cache: Union[bool, None] = None
     cache_threshold: Union[float, None] = None
     guard: Union[str, None] = None
+    guard_mode: Union[str, None] = None
     human_name: Union[str, None] = None
     human_description: Union[str, None] = None
     tools: Union[str, None] = None
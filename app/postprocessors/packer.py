@@ -0,0 +1,61 @@
+from typing import List, Optional
+
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle
+
+from app.tools import tokens_from_string
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextPacker(BaseNodePostprocessor):
+
+    token_budget: int = Field(description="Tokens of context to fill.")
+    score_gap: float = Field(default=0, description="Drop nodes after a score drop between consecutive nodes larger than this share of the top score, 0 disables it.")
+    duplicate_threshold: float = Field(default=0.8, description="Word shingle overlap above which a node is a duplicate of a better one, 1 disables it.")
+    excluded_metadata_keys: List[str] = Field(default_factory=list, description="Metadata keys left out of the LLM text.")
+    min_nodes: int = Field(default=1, description="Nodes always kept, budget permitting or not.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPacker"
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        nodes = sorted(nodes, key=lambda node: node.score or 0.0, reverse=True)
+
+        # relative to the top score, rerankers don't score on the 0 to 1 similarity scale
+        top = (nodes[0].score or 0.0) if nodes else 0.0
+
+        packed = []
+        seen = []
+        used = 0
+        previous = None
+        for node in nodes:
+            if self.score_gap > 0 and top > 0 and previous is not None and len(packed) >= self.min_nodes and previous - (node.score or 0.0) > self.score_gap * top:
+                break
+            previous = node.score or 0.0
+
+            words = shingles(node.node.get_content())
+            if self.duplicate_threshold < 1 and any(len(words & other) / len(words | other) >= self.duplicate_threshold for other in seen):
+                continue
+
+            node.node.excluded_llm_metadata_keys = list(set(node.node.excluded_llm_metadata_keys) | set(self.excluded_metadata_keys))
+            tokens = tokens_from_string(node.node.get_content(metadata_mode=MetadataMode.LLM))
+            if used + tokens > self.token_budget and len(packed) >= self.min_nodes:
+                continue
+
+            packed.append(node)
+            seen.append(words)
+            used += tokens
+
+        return packed
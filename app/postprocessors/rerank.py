@@ -0,0 +1,86 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.llm_rerank import LLMRerank
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+from app.cache import TTLCache
+
+
+class ParallelLLMRerank(LLMRerank):
+
+    parallelism: int = Field(default=4, description="Batches sent to the LLM at the same time.")
+
+    _cache: Optional[TTLCache] = PrivateAttr()
+
+    def __init__(self, cache: Optional[TTLCache] = None, parallelism: int = 4, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.parallelism = max(1, parallelism)
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ParallelLLMRerank"
+
+    def key(self, query: str, node: NodeWithScore) -> str:
+        return TTLCache.key(self.llm.metadata.model_name, query, node.node.node_id, node.node.hash)
+
+    def rank(self, query: str, batch: List[NodeWithScore]):
+        nodes_batch = [node.node for node in batch]
+        raw_response = self.llm.predict(
+            self.choice_select_prompt,
+            context_str=self._format_node_batch_fn(nodes_batch),
+            query_str=query,
+        )
+
+        raw_choices, relevances = self._parse_choice_select_answer_fn(raw_response, len(nodes_batch))
+        relevances = relevances or [1.0 for _ in raw_choices]
+
+        scores = {node.node_id: 0.0 for node in nodes_batch}
+        for choice, relevance in zip(raw_choices, relevances):
+            if 0 < int(choice) <= len(nodes_batch):
+                scores[nodes_batch[int(choice) - 1].node_id] = relevance
+        return scores
+
+    def _postprocess_nodes(
+        self,
+        nodes: List[NodeWithScore],
+        query_bundle: Optional[QueryBundle] = None,
+    ) -> List[NodeWithScore]:
+        if query_bundle is None:
+            raise ValueError("Query bundle must be provided.")
+        if len(nodes) == 0:
+            return []
+
+        query = query_bundle.query_str
+        scores = {}
+        missing = []
+        for node in nodes:
+            score = self._cache.get(self.key(query, node)) if self._cache is not None else None
+            if score is None:
+                missing.append(node)
+            else:
+                scores[node.node.node_id] = score
+
+        batches = [missing[i:i + self.choice_batch_size] for i in range(0, len(missing), self.choice_batch_size)]
+        if len(batches) == 1:
+            ranked = [self.rank(query, batches[0])]
+        elif batches:
+            # batches share the caller's admission slot, so they run in its context
+            context = contextvars.copy_context()
+            with ThreadPoolExecutor(max_workers=min(self.parallelism, len(batches))) as executor:
+                ranked = list(executor.map(lambda batch: context.copy().run(self.rank, query, batch), batches))
+        else:
+            ranked = []
+
+        for batch, batch_scores in zip(batches, ranked):
+            for node in batch:
+                score = batch_scores.get(node.node.node_id, 0.0)
+                scores[node.node.node_id] = score
+                if self._cache is not None:
+                    self._cache.set(self.key(query, node), score)
+
+        results = [NodeWithScore(node=node.node, score=scores[node.node.node_id]) for node in nodes if scores[node.node.node_id] > 0]
+        return sorted(results, key=lambda node: node.score or 0.0, reverse=True)[: self.top_n]
@@ -1,5 +1,6 @@
 from app.cache import Cache
 from app.models.models import ProjectModel
+from app.schema import SchemaIndex
 from app.vectordb.tools import FindEmbeddingsPath
 
 
@@ -23,4 +24,6 @@ class Project:
             self.vector.delete()
         if self.cache:
             self.cache.delete()
+        if self.model.type == "ragsql":
+            SchemaIndex.delete(self)
         
@@ -1,11 +1,12 @@
+import json
 from fastapi import HTTPException
 from requests import Session
 from app import tools
-from app.guard import Guard
 from app.models.models import ChatModel, QuestionModel, User
 from app.project import Project
 from app.projects.base import ProjectBase
 from llama_index.core.agent import ReActAgent
+from llama_index.core.agent.react.types import ActionReasoningStep, ObservationReasoningStep
 
 class Agent(ProjectBase):
   
@@ -21,34 +22,36 @@ class Agent(ProjectBase):
           }
         }
               
-        if project.model.guard:
-            guard = Guard(project.model.guard, self.brain, db)
-            if guard.verify(chatModel.question):
-                output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                output["guard"] = True
-                output["tokens"] = {
-                  "input": tools.tokens_from_string(output["question"]),
-                  "output": tools.tokens_from_string(output["answer"])
-                }
-                yield output
-                
+        guard = self.startGuard(project, chatModel.question, db)
+        if self.isBlocked(guard):
+            yield from self.censored(project, output, chatModel.stream)
+            return
+
         model = self.brain.getLLM(project.model.llm, db)
-        chat = self.brain.memories.loadMemory(project.model.name).loadChat(chatModel)
+        chat = self.brain.memories.loadMemory(project.model.name).loadChat(chatModel, self.brain.summaryLLM(db), self.brain.executor)
         toolsu = []
 
         toolsu = self.brain.get_tools(project.model.tools.split(","))
 
         agent = ReActAgent.from_tools(toolsu, llm=model.llm, context=project.model.system, memory=chat.memory, max_iterations=20, verbose=True)
 
+        output["id"] = chat.id
+
+        if chatModel.stream:
+            yield from self.stream(project, guard, agent, chatModel.question, output)
+            return
+
         resp = ""
         try:
-            response = agent.chat(chatModel.question)
+            blocked, response = self.guarded(guard, agent.chat, chatModel.question)
+            if blocked:
+                yield from self.censored(project, output)
+                return
             resp = response.response
         except Exception as e:
             if str(e) == "Reached max iterations.":
                 resp = "I'm sorry, I tried my best..."
         
-        output["id"] = chat.id
         output["answer"] = resp
         output["tokens"] = {
           "input": tools.tokens_from_string(output["question"]),
@@ -69,27 +72,28 @@ class Agent(ProjectBase):
           }
         }
               
-        if project.model.guard:
-            guard = Guard(project.model.guard, self.brain, db)
-            if guard.verify(questionModel.question):
-                output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                output["guard"] = True
-                output["tokens"] = {
-                  "input": tools.tokens_from_string(output["question"]),
-                  "output": tools.tokens_from_string(output["answer"])
-                }
-                yield output
-                
+        guard = self.startGuard(project, questionModel.question, db)
+        if self.isBlocked(guard):
+            yield from self.censored(project, output, questionModel.stream)
+            return
+
         model = self.brain.getLLM(project.model.llm, db)
         toolsu = []
 
         toolsu = self.brain.get_tools(project.model.tools.split(","))
 
         agent = ReActAgent.from_tools(toolsu, llm=model.llm, context=questionModel.system or project.model.system, max_iterations=20, verbose=True)
+
+        if questionModel.stream:
+            yield from self.stream(project, guard, agent, questionModel.question, output)
+            return
         
         resp = ""
         try:
-            response = agent.query(questionModel.question)
+            blocked, response = self.guarded(guard, agent.query, questionModel.question)
+            if blocked:
+                yield from self.censored(project, output)
+                return
             resp = response.response
         except Exception as e:
             if str(e) == "Reached max iterations.":
@@ -101,4 +105,50 @@ class Agent(ProjectBase):
           "output": tools.tokens_from_string(output["answer"])
         }
 
-        yield output
\ No newline at end of file
+        yield output
+
+    def stream(self, project: Project, guard, agent, question: str, output: dict):
+        try:
+            for line in self.guardedStream(guard, self.steps(agent, question, output)):
+                yield line
+            if self.isBlocked(guard):
+                yield from self.censored(project, output, True)
+                return
+
+            output["tokens"] = {
+              "input": tools.tokens_from_string(output["question"]),
+              "output": tools.tokens_from_string(output["answer"])
+            }
+            yield "data: " + json.dumps(output) + "\n"
+            yield "event: close\n\n"
+        except Exception as e:
+            yield "data: Inference failed\n"
+            yield "event: error\n\n"
+            raise e
+
+    def steps(self, agent, question: str, output: dict):
+        task = agent.create_task(question)
+        reasoning = task.extra_state["current_reasoning"]
+        sent = 0
+
+        while True:
+            try:
+                step = agent.run_step(task.task_id)
+            except ValueError as e:
+                if str(e) != "Reached max iterations.":
+                    raise e
+                output["answer"] = "I'm sorry, I tried my best..."
+                yield "data: " + output["answer"] + "\n\n"
+                return
+
+            for item in reasoning[sent:]:
+                if isinstance(item, ActionReasoningStep):
+                    yield "event: action\ndata: " + json.dumps({"thought": item.thought, "tool": item.action, "input": item.action_input}, default=str) + "\n\n"
+                elif isinstance(item, ObservationReasoningStep):
+                    yield "event: observation\ndata: " + json.dumps({"observation": item.observation}) + "\n\n"
+            sent = len(reasoning)
+
+            if step.is_last:
+                output["answer"] = agent.finalize_response(task.task_id, step).response
+                yield "data: " + output["answer"] + "\n\n"
+                return
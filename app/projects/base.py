@@ -1,9 +1,17 @@
+import asyncio
+import json
+from concurrent.futures import Future
+
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
 from app.brain import Brain
+from app.guard import Guard
 
 from app.models.models import ChatModel, QuestionModel, User
 from sqlalchemy.orm import Session
 
 from app.project import Project
+from app.tools import tokens_from_string
 
 class ProjectBase:
     def __init__(self, brain: Brain):
@@ -13,4 +21,143 @@ class ProjectBase:
         pass
     
     def entryQuestion(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
-        pass
\ No newline at end of file
+        pass
+
+    async def achat(self, project: Project, chatModel: ChatModel, user: User, db: Session):
+        output = await run_in_threadpool(self.chat, project, chatModel, user, db)
+        if isinstance(output, dict):
+            yield output
+        else:
+            try:
+                async for line in iterate_in_threadpool(output):
+                    yield line
+            finally:
+                await run_in_threadpool(output.close)
+
+    async def aquestion(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+        output = await run_in_threadpool(self.question, project, questionModel, user, db)
+        if isinstance(output, dict):
+            yield output
+        else:
+            try:
+                async for line in iterate_in_threadpool(output):
+                    yield line
+            finally:
+                await run_in_threadpool(output.close)
+
+    def startGuard(self, project: Project, prompt: str, db: Session):
+        if not project.model.guard:
+            return None
+
+        guard = Guard(project.model.guard, self.brain, db)
+
+        if project.model.guard_mode == "parallel":
+            return guard.verifyAsync(prompt)
+
+        verdict = Future()
+        verdict.set_result(guard.verify(prompt))
+        return verdict
+
+    def isBlocked(self, guard):
+        return guard is not None and guard.done() and guard.result()
+
+    def censored(self, project: Project, output: dict, stream: bool = False):
+        output["answer"] = project.model.censorship or self.brain.defaultCensorship
+        output["guard"] = True
+        output["tokens"] = {
+          "input": tokens_from_string(output["question"]),
+          "output": tokens_from_string(output["answer"])
+        }
+
+        if stream:
+            yield "data: " + output["answer"] + "\n\n"
+            yield "data: " + json.dumps(output) + "\n"
+            yield "event: close\n\n"
+        else:
+            yield output
+
+    def guarded(self, guard, fn, *args, **kwargs):
+        # fn runs on the calling thread while the guard runs on the executor, a blocked result is dropped
+        if guard is not None and guard.done() and guard.result():
+            return True, None
+
+        result = fn(*args, **kwargs)
+
+        if guard is not None and guard.result():
+            return True, None
+
+        return False, result
+
+    def guardedStream(self, guard, gen):
+        # closing gen also aborts the LLM request behind it when the client goes away
+        try:
+            if guard is None:
+                yield from gen
+                return
+
+            held = []
+            for item in gen:
+                if not guard.done():
+                    held.append(item)
+                    continue
+                if guard.result():
+                    return
+                if held:
+                    yield from held
+                    held = []
+                yield item
+
+            if not guard.result():
+                yield from held
+        finally:
+            if hasattr(gen, "close"):
+                gen.close()
+
+    async def aguarded(self, guard, coroutine):
+        if guard is None or guard.done():
+            if guard is not None and guard.result():
+                coroutine.close()
+                return True, None
+            return False, await coroutine
+
+        task = asyncio.ensure_future(coroutine)
+        verdict = asyncio.wrap_future(guard)
+        answered = False
+        try:
+            await asyncio.wait([task, verdict], return_when=asyncio.FIRST_COMPLETED)
+
+            if await verdict:
+                return True, None
+
+            result = await task
+            answered = True
+            return False, result
+        finally:
+            if not answered:
+                task.cancel()
+
+    async def aguardedStream(self, guard, gen):
+        try:
+            if guard is None:
+                async for item in gen:
+                    yield item
+                return
+
+            held = []
+            async for item in gen:
+                if not guard.done():
+                    held.append(item)
+                    continue
+                if guard.result():
+                    return
+                for line in held:
+                    yield line
+                held = []
+                yield item
+
+            if not await asyncio.wrap_future(guard):
+                for line in held:
+                    yield line
+        finally:
+            if hasattr(gen, "aclose"):
+                await gen.aclose()
@@ -0,0 +1,175 @@
+import json
+import logging
+from contextlib import aclosing
+from fastapi import HTTPException
+from llama_index.core.postprocessor import SimilarityPostprocessor
+from llama_index.core.prompts import PromptTemplate
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.schema import QueryBundle
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.auth import has_project_access
+from app.config import RESTAI_FEDERATED_MERGE
+from app.models.models import ChatModel, QuestionModel, User
+from app.project import Project
+from app.projects.base import ProjectBase
+from app.tools import tokens_from_string
+
+
+class Federated(ProjectBase):
+
+    def chat(self, project: Project, chatModel: ChatModel, user: User, db: Session):
+        raise HTTPException(status_code=400, detail='{"error": "Chat mode not available for this project type."}')
+
+    async def aquestion(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+        output = {
+          "question": questionModel.question,
+          "type": "federated",
+          "sources": [],
+          "cached": False,
+          "guard": False,
+          "tokens": {
+              "input": 0,
+              "output": 0
+          }
+        }
+
+        guard = await run_in_threadpool(self.startGuard, project, questionModel.question, db)
+        if self.isBlocked(guard):
+            for line in self.censored(project, output, questionModel.stream):
+                yield line
+            return
+
+        model = await run_in_threadpool(self.brain.getLLM, project.model.llm, db)
+        nodes = await run_in_threadpool(self.gather, project, questionModel, user, db)
+
+        sysTemplate = questionModel.system or project.model.system or self.brain.defaultSystem
+        model.llm.system_prompt = sysTemplate
+
+        qa_prompt_tmpl = (
+            "Context information is below.\n"
+            "---------------------\n"
+            "{context_str}\n"
+            "---------------------\n"
+            "Given the context information and not prior knowledge, "
+            "answer the query.\n"
+            "Query: {query_str}\n"
+            "Answer: "
+        )
+
+        response_synthesizer = get_response_synthesizer(llm=model.llm, text_qa_template=PromptTemplate(qa_prompt_tmpl), streaming=questionModel.stream)
+
+        for member, node in nodes:
+            output["sources"].append(
+                {"project": member, "source": node.metadata["source"], "keywords": node.metadata["keywords"], "score": node.score, "id": node.node_id, "text": node.text})
+
+        try:
+            if len(nodes) == 0:
+                output["answer"] = project.model.censorship or self.brain.defaultCensorship
+                output["tokens"] = {
+                  "input": tokens_from_string(output["question"]),
+                  "output": tokens_from_string(output["answer"])
+                }
+                if questionModel.stream:
+                    yield "data: " + output["answer"] + "\n\n"
+                    yield "data: " + json.dumps(output) + "\n"
+                    yield "event: close\n\n"
+                else:
+                    yield output
+                return
+
+            if questionModel.stream:
+                response = await response_synthesizer.asynthesize(questionModel.question, [node for _, node in nodes])
+                async with aclosing(self.aguardedStream(guard, response.response_gen)) as stream:
+                    async for text in stream:
+                        yield "data: " + text + "\n\n"
+                if self.isBlocked(guard):
+                    for line in self.censored(project, output, True):
+                        yield line
+                    return
+                yield "data: " + json.dumps(output) + "\n"
+                yield "event: close\n\n"
+            else:
+                blocked, response = await self.aguarded(guard, response_synthesizer.asynthesize(questionModel.question, [node for _, node in nodes]))
+                if blocked:
+                    for line in self.censored(project, output, False):
+                        yield line
+                    return
+
+                output["answer"] = response.response
+                output["tokens"] = {
+                  "input": tokens_from_string(output["question"]),
+                  "output": tokens_from_string(output["answer"])
+                }
+                yield output
+        except Exception as e:
+            if questionModel.stream:
+                yield "data: Inference failed\n"
+                yield "event: error\n\n"
+            raise e
+
+    def gather(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+        k = questionModel.k or project.model.k or 2
+        threshold = questionModel.score or project.model.score or 0.2
+
+        members = self.members(project, user, db)
+
+        embeddings = {}
+        for member in members:
+            if member.model.embeddings not in embeddings:
+                embeddings[member.model.embeddings] = self.brain.executor.submit(
+                    self.brain.getEmbedding(member.model.embeddings).get_query_embedding, questionModel.question)
+        embeddings = {name: task.result() for name, task in embeddings.items()}
+
+        tasks = [self.brain.executor.submit(self.retrieve, member, questionModel.question, embeddings[member.model.embeddings], k, threshold) for member in members]
+        return self.merge([task.result() for task in tasks], k)
+
+    def members(self, project: Project, user: User, db: Session):
+        members = []
+        for name in (project.model.members or "").split(","):
+            name = name.strip()
+            if not name:
+                continue
+            if not has_project_access(user, name):
+                logging.warning("User " + user.username + " can't access federated member " + name)
+                continue
+            member = self.brain.findProject(name, db)
+            if member is not None and member.model.type == "rag" and member.vector is not None:
+                members.append(member)
+        return members
+
+    def retrieve(self, member: Project, question: str, embedding: list[float], k: int, threshold: float):
+        retriever = VectorIndexRetriever(
+            index=member.vector.index,
+            similarity_top_k=k,
+        )
+
+        query = QueryBundle(query_str=question, embedding=embedding)
+        nodes = retriever.retrieve(query)
+        nodes = SimilarityPostprocessor(similarity_cutoff=threshold).postprocess_nodes(nodes, query)
+        return member.model.name, nodes
+
+    def merge(self, results, k: int):
+        merged = {}
+
+        for name, nodes in results:
+            if len(nodes) == 0:
+                continue
+
+            if RESTAI_FEDERATED_MERGE == "rrf":
+                scores = [1.0 / (60 + rank) for rank in range(1, len(nodes) + 1)]
+            else:
+                raw = [node.score or 0.0 for node in nodes]
+                low, high = min(raw), max(raw)
+                scores = [1.0 if high == low else (score - low) / (high - low) for score in raw]
+
+            for node, score in zip(nodes, scores):
+                key = node.node.hash
+                if key in merged:
+                    merged[key][2] += score
+                else:
+                    merged[key] = [name, node, score]
+
+        ranked = sorted(merged.values(), key=lambda item: item[2], reverse=True)
+        return [(name, node) for name, node, _ in ranked[:k]]
@@ -1,12 +1,13 @@
+from contextlib import aclosing
 from fastapi import HTTPException
 from requests import Session
-from app import tools
-from app.guard import Guard
+from app.cascade import Cascade
 from app.models.models import ChatModel, QuestionModel, User
 from app.project import Project
 from app.projects.base import ProjectBase
 from app.tools import tokens_from_string
 from llama_index.core.base.llms.types import ChatMessage
+from starlette.concurrency import run_in_threadpool
 
 
 class Inference(ProjectBase):
@@ -14,7 +15,7 @@ class Inference(ProjectBase):
     def chat(self, project: Project, chatModel: ChatModel, user: User, db: Session):
         raise HTTPException(status_code=400, detail='{"error": "Chat mode not available for this project type."}')
   
-    def question(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+    async def aquestion(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
         output = {
           "question": questionModel.question,
           "type": "inference",
@@ -25,47 +26,66 @@ class Inference(ProjectBase):
               "output": 0
           }
         }
-              
-        if project.model.guard:
-            guard = Guard(project.model.guard, self.brain, db)
-            if guard.verify(questionModel.question):
-                output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                output["guard"] = True
-                output["tokens"] = {
-                  "input": tools.tokens_from_string(output["question"]),
-                  "output": tools.tokens_from_string(output["answer"])
-                }
-                yield output
-                
-        model = self.brain.getLLM(project.model.llm, db)
 
-        sysTemplate = questionModel.system or project.model.system or self.brain.defaultSystem
-        model.llm.system_prompt = sysTemplate
+        guard = await run_in_threadpool(self.startGuard, project, questionModel.question, db)
+        if self.isBlocked(guard):
+            for line in self.censored(project, output, questionModel.stream):
+                yield line
+            return
 
-        messages = [
-            ChatMessage(
-                role="system", content=sysTemplate
-            ),
-            ChatMessage(role="user", content=questionModel.question),
-        ]
+        model = await run_in_threadpool(self.brain.getLLM, project.model.llm, db)
+        messages = self.messages(project, questionModel, model)
 
         try:
+            cheap = None
+            if project.model.cascade_llm:
+                cascade = await run_in_threadpool(Cascade, project, self.brain, db)
+                blocked, cheap = await self.aguarded(guard, cascade.aanswer(questionModel.question, messages))
+                if blocked:
+                    for line in self.censored(project, output, questionModel.stream):
+                        yield line
+                    return
+                output["cascade"] = "cheap" if cheap is not None else "escalated"
+
             if(questionModel.stream):
-                respgen = model.llm.stream_chat(messages)
-                for text in respgen:
-                    yield "data: " + text.delta + "\n\n"
+                if cheap is not None:
+                    yield "data: " + cheap.message.content + "\n\n"
+                    yield "event: close\n\n"
+                    return
+                respgen = await model.llm.astream_chat(messages)
+                async with aclosing(self.aguardedStream(guard, respgen)) as stream:
+                    async for text in stream:
+                        yield "data: " + text.delta + "\n\n"
+                if self.isBlocked(guard):
+                    for line in self.censored(project, output, True):
+                        yield line
+                    return
                 yield "event: close\n\n"
             else:
-                resp = model.llm.chat(messages)
+                blocked, resp = (False, cheap) if cheap is not None else await self.aguarded(guard, model.llm.achat(messages))
+                if blocked:
+                    for line in self.censored(project, output, False):
+                        yield line
+                    return
                 output["answer"] = resp.message.content.strip()
                 output["tokens"] = {
                     "input": tokens_from_string(output["question"]),
                     "output": tokens_from_string(output["answer"])
                 }
                 yield output
-        except Exception as e:              
+        except Exception as e:
             if questionModel.stream:
                 yield "data: Inference failed\n"
                 yield "event: error\n\n"
             raise e
-      
\ No newline at end of file
+
+    def messages(self, project: Project, questionModel: QuestionModel, model):
+        sysTemplate = questionModel.system or project.model.system or self.brain.defaultSystem
+        model.llm.system_prompt = sysTemplate
+
+        return [
+            ChatMessage(
+                role="system", content=sysTemplate
+            ),
+            ChatMessage(role="user", content=questionModel.question),
+        ]
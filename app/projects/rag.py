@@ -1,26 +1,36 @@
+from contextlib import aclosing
 import json
+import time
 from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.postprocessor import SimilarityPostprocessor
 from llama_index.core.prompts import PromptTemplate
-from llama_index.core.chat_engine import ContextChatEngine
-from llama_index.core.postprocessor.llm_rerank import LLMRerank
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.chat_engine.context import DEFAULT_CONTEXT_TEMPLATE
+from llama_index.core.schema import MetadataMode, QueryBundle
 from llama_index.postprocessor.colbert_rerank import ColbertRerank
+from app.budget import Budget
+from app.config import RESTAI_CONTEXT_DUPLICATES, RESTAI_CONTEXT_EXCLUDED_METADATA, RESTAI_CONTEXT_RATIO, RESTAI_CONTEXT_SCORE_GAP, RESTAI_RERANK_CACHE_TTL, RESTAI_RERANK_PARALLELISM
 from app.eval import evalRAG
-from app.guard import Guard
 from app.models.models import QuestionModel, ChatModel, User
 from sqlalchemy.orm import Session
 from app.project import Project
+from app.postprocessors.packer import ContextPacker
+from app.postprocessors.rerank import ParallelLLMRerank
 from app.tools import tokens_from_string
 from app.projects.base import ProjectBase
+from starlette.concurrency import run_in_threadpool
+
+
+OPTIONAL_STAGES = {"ColbertRerank": "colbert_rerank", "ParallelLLMRerank": "llm_rerank"}
 
 
 class RAG(ProjectBase):
 
-    def chat(self, project: Project, chatModel: ChatModel, user: User, db: Session):
-        model = self.brain.getLLM(project.model.llm, db)
-        chat = self.brain.memories.loadMemory(project.model.name).loadChat(chatModel)
+    async def achat(self, project: Project, chatModel: ChatModel, user: User, db: Session):
+        model = await run_in_threadpool(self.brain.getLLM, project.model.llm, db)
+        summary = await run_in_threadpool(self.brain.summaryLLM, db)
+        chat = await run_in_threadpool(self.brain.memories.loadMemory(project.model.name).loadChat, chatModel, summary, self.brain.executor)
         
         output = {
             "id": chat.id,
@@ -31,22 +41,71 @@ class RAG(ProjectBase):
             "type": "chat"
         }
         
-        if project.model.guard:
-            guard = Guard(project.model.guard, self.brain, db)
-            if guard.verify(chatModel.question):
-                output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                output["guard"] = True
+        guard = await run_in_threadpool(self.startGuard, project, chatModel.question, db)
+        if self.isBlocked(guard):
+            for line in self.censored(project, output, chatModel.stream):
+                yield line
+            return
+
+        retriever, postprocessors = self.chatPipeline(project, chatModel, model, db)
+
+        try:
+            nodes = await run_in_threadpool(self.retrieve, project, retriever, postprocessors, QueryBundle(chatModel.question))
+
+            for node in nodes:
+                output["sources"].append(
+                    {"source": node.metadata["source"], "keywords": node.metadata["keywords"], "score": node.score, "id": node.node_id, "text": node.text})
+
+            sysTemplate = project.model.system or self.brain.defaultSystem
+            messages = await run_in_threadpool(self.chatMessages, chat, model, sysTemplate, chatModel.question, nodes)
+
+            if chatModel.stream:
+                # the LLM stream is consumed here, closing this generator aborts the request behind it
+                answer = ""
+                respgen = await model.llm.astream_chat(messages)
+                async with aclosing(self.aguardedStream(guard, respgen)) as stream:
+                    async for chunk in stream:
+                        answer += chunk.delta or ""
+                        yield "data: " + (chunk.delta or "") + "\n\n"
+                if self.isBlocked(guard):
+                    for line in self.censored(project, output, True):
+                        yield line
+                    return
+                await run_in_threadpool(chat.memory.put, ChatMessage(role=MessageRole.ASSISTANT, content=answer))
+                yield "data: " + json.dumps(output) + "\n"
+                yield "event: close\n\n"
+            else:
+                if len(nodes) == 0:
+                    output["answer"] = project.model.censorship or self.brain.defaultCensorship
+                else:
+                    blocked, response = await self.aguarded(guard, model.llm.achat(messages))
+                    if blocked:
+                        for line in self.censored(project, output, False):
+                            yield line
+                        return
+                    output["answer"] = response.message.content
+
+                    if project.cache:
+                        await run_in_threadpool(project.cache.add, chatModel.question, output["answer"])
+
+                await run_in_threadpool(chat.memory.put, ChatMessage(role=MessageRole.ASSISTANT, content=output["answer"]))
+
                 output["tokens"] = {
                   "input": tokens_from_string(output["question"]),
                   "output": tokens_from_string(output["answer"])
                 }
+
                 yield output
+        except Exception as e:              
+            if chatModel.stream:
+                yield "data: Inference failed\n"
+                yield "event: error\n\n"
+            raise e
 
+    def chatPipeline(self, project: Project, chatModel: ChatModel, model, db: Session):
         threshold = chatModel.score or project.model.score or 0.2
         k = chatModel.k or project.model.k or 1
 
-        sysTemplate = project.model.system or self.brain.defaultSystem
-        
         if project.model.colbert_rerank or project.model.llm_rerank:
             final_k = k * 2
         else:
@@ -68,65 +127,29 @@ class RAG(ProjectBase):
             ))
 
         if project.model.llm_rerank:
-            postprocessors.append(LLMRerank(
+            postprocessors.append(ParallelLLMRerank(
                 choice_batch_size=k,
                 top_n=k,
-                llm=model.llm,
+                llm=self.brain.getLLM(project.model.llm, db, check=False, admit=True).llm,
+                cache=self.brain.rerankCache if RESTAI_RERANK_CACHE_TTL > 0 else None,
+                parallelism=RESTAI_RERANK_PARALLELISM,
             ))
             
         postprocessors.append(SimilarityPostprocessor(similarity_cutoff=threshold))
+        postprocessors.append(self.packer(model, chatModel.question))
 
-        chat_engine = ContextChatEngine.from_defaults(
-            retriever=retriever,
-            system_prompt=sysTemplate,
-            memory=chat.memory,
-            node_postprocessors=postprocessors,
-            llm=model.llm
-        )
+        return retriever, postprocessors
 
-        try:
-            if chatModel.stream:
-                response = chat_engine.stream_chat(chatModel.question)
-            else:
-                response = chat_engine.chat(chatModel.question)
+    def chatMessages(self, chat, model, sysTemplate: str, question: str, nodes):
+        # same layout as llama_index's ContextChatEngine, the system prompt followed by the retrieved context
+        context = "\n\n".join(node.node.get_content(metadata_mode=MetadataMode.LLM).strip() for node in nodes)
+        system = ChatMessage(role=model.llm.metadata.system_role, content=sysTemplate.strip() + "\n" + DEFAULT_CONTEXT_TEMPLATE.format(context_str=context))
 
-            for node in response.source_nodes:
-                output["sources"].append(
-                    {"source": node.metadata["source"], "keywords": node.metadata["keywords"], "score": node.score, "id": node.node_id, "text": node.text})
-
-            if chatModel.stream:
-                if hasattr(response, "response_gen"): 
-                    for text in response.response_gen:
-                        yield "data: " + text + "\n\n"
-                    yield "data: " + json.dumps(output) + "\n"
-                    yield "event: close\n\n"
-                else:
-                    yield "data: " + self.brain.defaultCensorship + "\n\n"
-                    yield "data: " + json.dumps(output) + "\n"
-                    yield "event: close\n\n"
-            else:  
-                if len(response.source_nodes) == 0:
-                    output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                else:
-                    output["answer"] = response.response
-                    
-                    if project.cache:
-                        project.cache.add(chatModel.question, response.response)
-
-                output["tokens"] = {
-                  "input": tokens_from_string(output["question"]),
-                  "output": tokens_from_string(output["answer"])
-                }
-
-                yield output
-        except Exception as e:              
-            if chatModel.stream:
-                yield "data: Inference failed\n"
-                yield "event: error\n\n"
-            raise e
+        chat.memory.put(ChatMessage(role=MessageRole.USER, content=question))
+        return [system] + chat.memory.get(initial_token_count=tokens_from_string(system.content))
 
 
-    def question(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+    async def aquestion(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
 
         output = {
           "question": questionModel.question,
@@ -139,26 +162,97 @@ class RAG(ProjectBase):
               "output": 0
           }
         }
-        
-        if project.model.guard:
-            guard = Guard(project.model.guard, self.brain, db)
-            if guard.verify(questionModel.question):
-                output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                output["guard"] = True
+
+        guard = await run_in_threadpool(self.startGuard, project, questionModel.question, db)
+        if self.isBlocked(guard):
+            for line in self.censored(project, output, questionModel.stream):
+                yield line
+            return
+
+        model = await run_in_threadpool(self.brain.getLLM, project.model.llm, db)
+
+        budget = Budget(questionModel.budget, questionModel._received)
+        retriever, postprocessors, response_synthesizer = self.pipeline(project, questionModel, model, db, budget)
+        query_bundle = QueryBundle(questionModel.question)
+
+        if questionModel.budget:
+            output["skipped"] = budget.skipped
+
+        try:
+            nodes = await run_in_threadpool(self.retrieve, project, retriever, postprocessors, query_bundle, budget)
+
+            for node in nodes:
+                output["sources"].append(
+                    {"source": node.metadata["source"], "keywords": node.metadata["keywords"], "score": node.score, "id": node.node_id, "text": node.text})
+
+            if questionModel.stream:
+                # let clients render citations while the answer is generated
+                if guard is None or (guard.done() and not guard.result()):
+                    yield "event: sources\ndata: " + json.dumps(output["sources"]) + "\n\n"
+                response = await response_synthesizer.asynthesize(query=query_bundle, nodes=nodes)
+            else:
+                started = time.monotonic()
+                blocked, response = await self.aguarded(guard, response_synthesizer.asynthesize(query=query_bundle, nodes=nodes))
+                if blocked:
+                    for line in self.censored(project, output, False):
+                        yield line
+                    return
+                self.brain.stageTimes.observe(project.model.name, "generation", time.monotonic() - started)
+
+            if questionModel.eval and not questionModel.stream:
+                evaluator = await run_in_threadpool(self.brain.getLLM, "openai_gpt4", db)
+                metric = await run_in_threadpool(evalRAG, questionModel.question, response, evaluator.llm)
+                output["evaluation"] = {
+                    "reason": metric.reason,
+                    "score": metric.score
+                }
+
+            if questionModel.stream:
+                if hasattr(response, "response_gen"):
+                    async with aclosing(self.aguardedStream(guard, response.response_gen)) as stream:
+                        async for text in stream:
+                            yield "data: " + text + "\n\n"
+                    if self.isBlocked(guard):
+                        for line in self.censored(project, output, True):
+                            yield line
+                        return
+                else:
+                    yield "data: " + (response.response or self.brain.defaultCensorship) + "\n\n"
+                yield "data: " + json.dumps(output) + "\n"
+                yield "event: close\n\n"
+            else:
+                if len(nodes) == 0:
+                    output["answer"] = project.model.censorship or self.brain.defaultCensorship
+                else:
+                    output["answer"] = response.response
+
+                    if project.cache:
+                        await run_in_threadpool(project.cache.add, questionModel.question, response.response)
+
                 output["tokens"] = {
                   "input": tokens_from_string(output["question"]),
                   "output": tokens_from_string(output["answer"])
                 }
+
                 yield output
-            
-        model = self.brain.getLLM(project.model.llm, db)
+        except Exception as e:
+            if questionModel.stream:
+                yield "data: Inference failed\n"
+                yield "event: error\n\n"
+            raise e
 
+    def pipeline(self, project: Project, questionModel: QuestionModel, model, db: Session, budget: Budget = None):
         sysTemplate = questionModel.system or project.model.system or self.brain.defaultSystem
 
         k = questionModel.k or project.model.k or 2
         threshold = questionModel.score or project.model.score or 0.2
+        colbert_rerank = bool(questionModel.colbert_rerank or project.model.colbert_rerank)
+        llm_rerank = bool(questionModel.llm_rerank or project.model.llm_rerank)
 
-        if questionModel.colbert_rerank or questionModel.llm_rerank or project.model.colbert_rerank or project.model.llm_rerank:
+        if budget is not None:
+            k, colbert_rerank, llm_rerank = self.degrade(project, budget, k, colbert_rerank, llm_rerank)
+
+        if colbert_rerank or llm_rerank:
             final_k = k * 2
         else:
             final_k = k
@@ -187,7 +281,7 @@ class RAG(ProjectBase):
 
         postprocessors = []
 
-        if questionModel.colbert_rerank or project.model.colbert_rerank:
+        if colbert_rerank:
             postprocessors.append(ColbertRerank(
                 top_n=k,
                 model="colbert-ir/colbertv2.0",
@@ -195,67 +289,75 @@ class RAG(ProjectBase):
                 keep_retrieval_score=True,
             ))
 
-        if questionModel.llm_rerank or project.model.llm_rerank:
-            postprocessors.append(LLMRerank(
+        if llm_rerank:
+            postprocessors.append(ParallelLLMRerank(
                 choice_batch_size=k,
                 top_n=k,
-                llm=model.llm,
+                llm=self.brain.getLLM(project.model.llm, db, check=False, admit=True).llm,
+                cache=self.brain.rerankCache if RESTAI_RERANK_CACHE_TTL > 0 else None,
+                parallelism=RESTAI_RERANK_PARALLELISM,
             ))
             
         postprocessors.append(SimilarityPostprocessor(similarity_cutoff=threshold))
-        
-        query_engine = RetrieverQueryEngine(
-            retriever=retriever,
-            response_synthesizer=response_synthesizer,
-            node_postprocessors=postprocessors
-        )
+        postprocessors.append(self.packer(model, questionModel.question))
 
-        try:
-            response = query_engine.query(questionModel.question)
-
-            if hasattr(response, "source_nodes"): 
-                for node in response.source_nodes:
-                    output["sources"].append(
-                        {"source": node.metadata["source"], "keywords": node.metadata["keywords"], "score": node.score, "id": node.node_id, "text": node.text})
-            
-            if questionModel.eval and not questionModel.stream:
-                metric = evalRAG(questionModel.question, response, self.brain.getLLM("openai_gpt4", db).llm)
-                output["evaluation"] = {
-                    "reason": metric.reason,
-                    "score": metric.score
-                }
+        return retriever, postprocessors, response_synthesizer
 
-            if questionModel.stream:
-                if hasattr(response, "response_gen"): 
-                    failed = True
-                    for text in response.response_gen:
-                        failed = False
-                        yield "data: " + text + "\n\n"                        
-                    if failed:
-                        yield "data: " + response.response_txt + "\n\n"
-                    yield "data: " + json.dumps(output) + "\n"
-                    yield "event: close\n\n"
-                else :
-                    yield "data: " + self.brain.defaultCensorship + "\n\n"
-                    yield "data: " + json.dumps(output) + "\n"
-                    yield "event: close\n\n"
-            else:
-                if len(response.source_nodes) == 0:
-                    output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                else:
-                    output["answer"] = response.response
-                    
-                    if project.cache:
-                        project.cache.add(questionModel.question, response.response)
+    def packer(self, model, question: str):
+        metadata = model.llm.metadata
+        budget = int((metadata.context_window - max(metadata.num_output, 0)) * RESTAI_CONTEXT_RATIO) - tokens_from_string(question)
 
-                output["tokens"] = {
-                  "input": tokens_from_string(output["question"]),
-                  "output": tokens_from_string(output["answer"])
-                }
+        return ContextPacker(
+            token_budget=max(budget, 0),
+            score_gap=RESTAI_CONTEXT_SCORE_GAP,
+            duplicate_threshold=RESTAI_CONTEXT_DUPLICATES,
+            excluded_metadata_keys=RESTAI_CONTEXT_EXCLUDED_METADATA,
+        )
 
-                yield output
-        except Exception as e:
-            if questionModel.stream:
-                yield "data: Inference failed\n"
-                yield "event: error\n\n"
-            raise e
+    def degrade(self, project: Project, budget: Budget, k: int, colbert_rerank: bool, llm_rerank: bool):
+        times = self.brain.stageTimes
+        name = project.model.name
+
+        def needed(k):
+            nodes = k * 2 if colbert_rerank or llm_rerank else k
+            return (times.estimate(name, "retrieval", nodes) + times.estimate(name, "generation")
+                    + (times.estimate(name, "ColbertRerank", nodes) if colbert_rerank else 0)
+                    + (times.estimate(name, "ParallelLLMRerank", k if colbert_rerank else nodes) if llm_rerank else 0))
+
+        remaining = budget.remaining()
+        if llm_rerank and needed(k) > remaining:
+            llm_rerank = False
+            budget.skip("llm_rerank")
+        if colbert_rerank and needed(k) > remaining:
+            colbert_rerank = False
+            budget.skip("colbert_rerank")
+        if k > 1 and needed(k) > remaining:
+            while k > 1 and needed(k) > remaining:
+                k = max(1, k // 2)
+            budget.skip("k")
+
+        return k, colbert_rerank, llm_rerank
+
+    def retrieve(self, project: Project, retriever, postprocessors, query_bundle: QueryBundle, budget: Budget = None):
+        times = self.brain.stageTimes
+        name = project.model.name
+
+        started = time.monotonic()
+        nodes = retriever.retrieve(query_bundle)
+        times.observe(name, "retrieval", time.monotonic() - started, len(nodes))
+
+        for postprocessor in postprocessors:
+            stage = postprocessor.class_name()
+            # retrieval may have eaten the time degrade() planned for the rerankers
+            if budget is not None and stage in OPTIONAL_STAGES and (
+                    times.estimate(name, stage, len(nodes)) + times.estimate(name, "generation") > budget.remaining()):
+                budget.skip(OPTIONAL_STAGES[stage])
+                nodes = nodes[:postprocessor.top_n]
+                continue
+
+            started = time.monotonic()
+            count = len(nodes)
+            nodes = postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+            times.observe(name, stage, time.monotonic() - started, count)
+
+        return nodes
@@ -1,12 +1,18 @@
+import json
+import time
 from fastapi import HTTPException
+from sqlalchemy import text
 from sqlalchemy.orm import Session
+from app.cache import TTLCache
+from app.config import RESTAI_SQL_BATCH, RESTAI_SQL_CACHE_TTL, RESTAI_SQL_MAX_ROWS, RESTAI_SQL_RESULT_TTL, RESTAI_SQL_TIMEOUT
 from app.models.models import ChatModel, QuestionModel, User
 from app.project import Project
 from app.projects.base import ProjectBase
 from app.tools import tokens_from_string
-from llama_index.core.utilities.sql_wrapper import SQLDatabase
-from llama_index.core.indices.struct_store.sql_query import NLSQLTableQueryEngine
-from sqlalchemy import create_engine
+from llama_index.core.indices.struct_store.sql_query import DEFAULT_RESPONSE_SYNTHESIS_PROMPT_V2
+from llama_index.core.indices.struct_store.sql_retriever import NLSQLRetriever
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.schema import NodeWithScore, TextNode
 
 
 class RAGSql(ProjectBase):
@@ -15,11 +21,69 @@ class RAGSql(ProjectBase):
         raise HTTPException(status_code=400, detail='{"error": "Chat mode not available for this project type."}')
 
     def question(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
-        model = self.brain.getLLM(project.model.llm, db)
+        if questionModel.stream:
+            return self.questionStream(project, questionModel, db)
+
+        model, sql_database, tables, question = self.prepare(project, questionModel, db)
+
+        sql_query, key = self.generateSQL(project, model, sql_database, tables, question)
+        nodes, truncated, ok = self.runSQL(project, sql_database, sql_query)
+        self.cacheSQL(key, sql_query, ok)
+
+        response = self.synthesizer(model, sql_query).synthesize(query=question, nodes=nodes)
+
+        output = {
+            "question": questionModel.question,
+            "answer": response.response,
+            "sources": [sql_query],
+            "type": "questionsql",
+            "truncated": truncated
+        }
+        
+        output["tokens"] = {
+          "input": tokens_from_string(output["question"]),
+          "output": tokens_from_string(output["answer"])
+        }
 
-        engine = create_engine(project.model.connection)
+        return output
 
-        sql_database = SQLDatabase(engine)
+    def questionStream(self, project: Project, questionModel: QuestionModel, db: Session):
+        output = {
+            "question": questionModel.question,
+            "sources": [],
+            "type": "questionsql",
+            "truncated": False
+        }
+
+        try:
+            model, sql_database, tables, question = self.prepare(project, questionModel, db)
+
+            sql_query, key = self.generateSQL(project, model, sql_database, tables, question)
+            output["sources"] = [sql_query]
+            yield "event: sql\ndata: " + json.dumps(sql_query) + "\n\n"
+
+            nodes, output["truncated"], ok = self.runSQL(project, sql_database, sql_query)
+            self.cacheSQL(key, sql_query, ok)
+
+            response = self.synthesizer(model, sql_query, True).synthesize(query=question, nodes=nodes)
+            answer = ""
+            for text in response.response_gen:
+                answer += text
+                yield "data: " + text + "\n\n"
+
+            output["tokens"] = {
+              "input": tokens_from_string(output["question"]),
+              "output": tokens_from_string(answer)
+            }
+            yield "data: " + json.dumps(output) + "\n"
+            yield "event: close\n\n"
+        except Exception as e:
+            yield "data: Inference failed\n"
+            yield "event: error\n\n"
+            raise e
+
+    def prepare(self, project: Project, questionModel: QuestionModel, db: Session):
+        model = self.brain.getLLM(project.model.llm, db)
 
         tables = None
         if hasattr(questionModel, 'tables') and questionModel.tables is not None:
@@ -27,29 +91,110 @@ class RAGSql(ProjectBase):
         elif project.model.tables:
             tables = [table.strip() for table in project.model.tables.split(',')]
 
-        query_engine = NLSQLTableQueryEngine(
+        sql_database = self.brain.getSQLDatabase(project.model.connection)
+        if tables:
+            missing = set(tables) - set(sql_database.get_usable_table_names())
+            if missing:
+                raise ValueError(f"tables {missing} not found in database")
+        elif project.model.embeddings:
+            tables = self.brain.getSchemaIndex(project).retrieve(questionModel.question, project.model.k or 4)
+
+        question = (project.model.system or self.brain.defaultSystem) + "\n Question: " + questionModel.question
+
+        return model, sql_database, tables, question
+
+    def synthesizer(self, model, sql_query: str, streaming: bool = False):
+        return get_response_synthesizer(
             llm=model.llm,
-            sql_database=sql_database,
+            text_qa_template=DEFAULT_RESPONSE_SYNTHESIS_PROMPT_V2.partial_format(sql_query=sql_query),
+            streaming=streaming,
+        )
+
+    def schemaVersion(self, sql_database, tables):
+        parts = []
+        for table in sorted(tables or sql_database.get_usable_table_names()):
+            reflected = sql_database.metadata_obj.tables.get(table)
+            if reflected is not None:
+                parts.append(table + ":" + ",".join(f"{column.name} {column.type}" for column in reflected.columns))
+        return TTLCache.key(*parts)
+
+    def generateSQL(self, project: Project, model, sql_database, tables, question: str):
+        key = None
+        if RESTAI_SQL_CACHE_TTL > 0:
+            key = TTLCache.key(project.model.name, project.model.llm, self.schemaVersion(sql_database, tables), question)
+            sql_query = self.brain.sqlCache.get(key)
+            if sql_query is not None:
+                return sql_query, None
+
+        retriever = NLSQLRetriever(
+            sql_database,
             tables=tables,
+            llm=model.llm,
+            sql_only=True,
         )
+        _, metadata = retriever.retrieve_with_metadata(question)
+        return metadata["sql_query"], key
 
-        question = (project.model.system or self.brain.defaultSystem) + "\n Question: " + questionModel.question
+    def cacheSQL(self, key, sql_query: str, ok: bool):
+        # only SQL that ran and returned rows is reused, a failing statement is generated again
+        if key is not None and ok:
+            self.brain.sqlCache.set(key, sql_query)
+
+    def runSQL(self, project: Project, sql_database, sql_query: str):
+        key = TTLCache.key(project.model.connection, sql_query)
+        cached = self.brain.sqlResultCache.get(key) if RESTAI_SQL_RESULT_TTL > 0 else None
+        if cached is not None:
+            return cached + (True,)
 
         try:
-            response = query_engine.query(question)
+            rows, columns, truncated = self.execute(sql_database, sql_query)
         except Exception as e:
-            raise e
+            return [NodeWithScore(node=TextNode(text=f"Error: {e!s}"))], False, False
 
-        output = {
-            "question": questionModel.question,
-            "answer": response.response,
-            "sources": [response.metadata['sql_query']],
-            "type": "questionsql"
-        }
-        
-        output["tokens"] = {
-          "input": tokens_from_string(output["question"]),
-          "output": tokens_from_string(output["answer"])
-        }
+        nodes = []
+        for row in rows:
+            values = [sql_database.truncate_word(column, length=300) for column in row]
+            nodes.append(NodeWithScore(node=TextNode(text=str(dict(zip(columns, values))))))
+
+        if columns and RESTAI_SQL_RESULT_TTL > 0:
+            self.brain.sqlResultCache.set(key, (nodes, truncated))
+        return nodes, truncated, bool(columns)
+
+    def execute(self, sql_database, sql_query: str):
+        started = time.monotonic()
+        dialect = sql_database.engine.dialect.name
+
+        with sql_database.engine.connect() as connection:
+            previous = None
+            if dialect == "postgresql":
+                # SET LOCAL ends with the transaction rolled back below
+                connection.execute(text(f"SET LOCAL statement_timeout = {int(RESTAI_SQL_TIMEOUT * 1000)}"))
+            elif dialect == "mysql":
+                previous = connection.execute(text("SELECT @@SESSION.MAX_EXECUTION_TIME")).scalar()
+                connection.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {int(RESTAI_SQL_TIMEOUT * 1000)}"))
+
+            try:
+                result = connection.execution_options(stream_results=True, max_row_buffer=RESTAI_SQL_BATCH).execute(text(sql_query))
+                if not result.returns_rows:
+                    return [], [], False
+
+                columns = list(result.keys())
+                rows = []
+                truncated = False
+                for batch in result.partitions(RESTAI_SQL_BATCH):
+                    rows.extend(batch)
+                    if len(rows) >= RESTAI_SQL_MAX_ROWS:
+                        truncated = len(rows) > RESTAI_SQL_MAX_ROWS or result.fetchone() is not None
+                        rows = rows[:RESTAI_SQL_MAX_ROWS]
+                        break
+                    if time.monotonic() - started > RESTAI_SQL_TIMEOUT:
+                        truncated = True
+                        break
+                result.close()
+            finally:
+                connection.rollback()
+                if previous is not None:
+                    # the connection goes back to the pool, don't leave our timeout on its session
+                    connection.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {int(previous)}"))
 
-        return output
\ No newline at end of file
+        return rows, columns, truncated
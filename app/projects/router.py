@@ -1,10 +1,13 @@
 from fastapi import HTTPException
+import numpy as np
+from app.cache import TTLCache
+from app.config import RESTAI_ROUTER_CACHE_TTL, RESTAI_ROUTER_MARGIN
 from app.models.models import ChatModel, QuestionModel, User
 from app.project import Project
 from app.projects.base import ProjectBase
 
 from llama_index.core.tools import ToolMetadata
-from llama_index.core.selectors import LLMSingleSelector
+from llama_index.core.selectors import LLMMultiSelector, LLMSingleSelector
 from sqlalchemy.orm import Session
 
 class Router(ProjectBase):
@@ -13,16 +16,60 @@ class Router(ProjectBase):
         raise HTTPException(status_code=400, detail='{"error": "Chat mode not available for this project type."}')
   
     def question(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+        if RESTAI_ROUTER_CACHE_TTL > 0:
+            key = TTLCache.key(project.model.name, project.model.fanout, *[entrance.destination + "\x00" + entrance.description for entrance in project.model.entrances], questionModel.question)
+            destinations = self.brain.routeCache.get(key)
+            if destinations is None:
+                destinations = self.route(project, questionModel, db)
+                self.brain.routeCache.set(key, destinations)
+            return destinations
+
+        return self.route(project, questionModel, db)
+
+    def route(self, project: Project, questionModel: QuestionModel, db: Session):
+        fanout = project.model.fanout or 1
+
+        if project.model.embeddings:
+            indexes = self.embeddingsSelect(project, questionModel.question, fanout)
+            if indexes is not None:
+                return [project.model.entrances[index].destination for index in indexes]
+
         choices = []
           
         for entrance in project.model.entrances:
             choices.append(ToolMetadata(description=entrance.description, name=entrance.name))
         
-
-        selector = LLMSingleSelector.from_defaults(llm=self.brain.getLLM(project.model.llm, db).llm)
+        llm = self.brain.getLLM(project.model.llm, db, admit=True).llm
+        if fanout > 1:
+            selector = LLMMultiSelector.from_defaults(llm=llm, max_outputs=fanout)
+        else:
+            selector = LLMSingleSelector.from_defaults(llm=llm)
         selector_result = selector.select(
             choices, query=questionModel.question
         )
         
-        projectNameDest = project.model.entrances[selector_result.selections[0].index].destination
-        return projectNameDest
\ No newline at end of file
+        destinations = []
+        for selection in selector_result.selections:
+            destination = project.model.entrances[selection.index].destination
+            if destination not in destinations:
+                destinations.append(destination)
+        return destinations[:fanout]
+
+    def embeddingsSelect(self, project: Project, question: str, fanout: int = 1):
+        vectors = self.brain.getRouterEmbeddings(project)
+        if len(vectors) == 0:
+            return None
+        if len(vectors) == 1:
+            return [0]
+
+        query = np.array(self.brain.getEmbedding(project.model.embeddings).get_query_embedding(question))
+        scores = vectors @ (query / np.linalg.norm(query))
+
+        order = np.argsort(scores)[::-1]
+        close = [int(index) for index in order if scores[order[0]] - scores[index] < RESTAI_ROUTER_MARGIN]
+        if len(close) == 1:
+            return close
+        if fanout > 1:
+            return close[:fanout]
+
+        return None
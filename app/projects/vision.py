@@ -1,7 +1,7 @@
+import json
 from fastapi import HTTPException
 from llama_index.core.schema import ImageDocument
 from langchain.agents import initialize_agent
-from app.guard import Guard
 from app.llms.workers.dalle import DalleImage
 from app.models.models import ChatModel, QuestionModel, User
 from app.project import Project
@@ -17,6 +17,9 @@ class Vision(ProjectBase):
         raise HTTPException(status_code=400, detail='{"error": "Chat mode not available for this project type."}')
   
     def question(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+        if questionModel.stream:
+            return self.questionStream(project, questionModel, user, db)
+
         output = {
           "question": questionModel.question,
           "type": "vision",
@@ -28,43 +31,17 @@ class Vision(ProjectBase):
           }
         }
         
-        if project.model.guard:
-            guard = Guard(project.model.guard, self.brain, db)
-            if guard.verify(questionModel.question):
-                output["answer"] = project.model.censorship or self.brain.defaultCensorship
-                output["guard"] = True
-                output["tokens"] = {
-                  "input": tools.tokens_from_string(output["question"]),
-                  "output": tools.tokens_from_string(output["answer"])
-                }
-                yield output
-                
+        guard = self.startGuard(project, questionModel.question, db)
+        if self.isBlocked(guard):
+            return next(self.censored(project, output))
+
         image = None
         output_temp = ""
-        isprivate = user.is_private
-
-        tools = [
-            DalleImage()
-        ]
-        
-        if RESTAI_GPU:
-            from app.llms.workers.stablediffusion import StableDiffusionImage
-            from app.llms.workers.describeimage import DescribeImage
-            from app.llms.workers.instantid import InstantID
-            tools.append(StableDiffusionImage())
-            tools.append(DescribeImage())
-            tools.append(InstantID())
 
-        if isprivate:
-            tools.pop(0)
-
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+        blocked, outputAgent = self.runAgent(guard, questionModel, user)
+        if blocked:
+            return next(self.censored(project, output))
 
-        agent = initialize_agent(
-            tools, llm, agent="zero-shot-react-description", verbose=False)
-        
-        outputAgent = agent.run(questionModel.question, tags=[questionModel])
-        
 
         if isinstance(outputAgent, str):
             output_temp = outputAgent
@@ -86,4 +63,76 @@ class Vision(ProjectBase):
         output["answer"] = output_temp
         output["image"] = image
 
-        return output
\ No newline at end of file
+        return output
+
+    def questionStream(self, project: Project, questionModel: QuestionModel, user: User, db: Session):
+        output = {
+          "question": questionModel.question,
+          "type": "vision",
+          "sources": [],
+          "guard": False,
+          "image": None,
+          "tokens": {
+              "input": 0,
+              "output": 0
+          }
+        }
+
+        try:
+            guard = self.startGuard(project, questionModel.question, db)
+            if self.isBlocked(guard):
+                yield from self.censored(project, output, True)
+                return
+
+            blocked, outputAgent = self.runAgent(guard, questionModel, user)
+            if blocked:
+                yield from self.censored(project, output, True)
+                return
+
+            if isinstance(outputAgent, str):
+                output["answer"] = outputAgent
+                yield "data: " + output["answer"] + "\n\n"
+            elif outputAgent["type"] == "describeimage":
+                model = self.brain.getLLM(project.model.llm, db)
+                output["answer"] = ""
+                for response in model.llm.stream_complete(prompt=questionModel.question, image_documents=[ImageDocument(image=questionModel.image)]):
+                    output["answer"] += response.delta or ""
+                    yield "data: " + (response.delta or "") + "\n\n"
+                output["image"] = questionModel.image
+            else:
+                output["answer"] = outputAgent["prompt"]
+                output["image"] = outputAgent["image"]
+                yield "data: " + output["answer"] + "\n\n"
+
+            if questionModel.lite:
+                del output["image"]
+
+            yield "data: " + json.dumps(output) + "\n"
+            yield "event: close\n\n"
+        except Exception as e:
+            yield "data: Inference failed\n"
+            yield "event: error\n\n"
+            raise e
+
+    def runAgent(self, guard, questionModel: QuestionModel, user: User):
+        tools = [
+            DalleImage()
+        ]
+        
+        if RESTAI_GPU:
+            from app.llms.workers.stablediffusion import StableDiffusionImage
+            from app.llms.workers.describeimage import DescribeImage
+            from app.llms.workers.instantid import InstantID
+            tools.append(StableDiffusionImage())
+            tools.append(DescribeImage())
+            tools.append(InstantID())
+
+        if user.is_private:
+            tools.pop(0)
+
+        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+
+        agent = initialize_agent(
+            tools, llm, agent="zero-shot-react-description", verbose=False)
+        
+        return self.guarded(guard, agent.run, questionModel.question, tags=[questionModel])
@@ -0,0 +1,101 @@
+import shutil
+import time
+import chromadb
+from sqlalchemy import select
+
+from app.cache import TTLCache
+from app.config import RESTAI_SQL_SCHEMA_TTL
+from app.vectordb.tools import FindEmbeddingsPath
+
+
+class SchemaIndex:
+
+    def __init__(self, project, brain):
+        self.project = project
+        self.brain = brain
+        self.client = chromadb.PersistentClient(path=FindEmbeddingsPath(self.project.model.name + "_schema"))
+        self.collection = self.client.get_or_create_collection(name=self.project.model.name + "_schema")
+        self.refreshed = 0
+
+    def fingerprint(self, sql_database, table):
+        reflected = sql_database.metadata_obj.tables.get(table)
+        if reflected is None:
+            return TTLCache.key(table)
+
+        parts = [table, reflected.comment or ""]
+        parts += [f"{column.name} {column.type} {column.comment or ''}" for column in reflected.columns]
+        parts += sorted(f"{key.parent.name} {key.target_fullname}" for key in reflected.foreign_keys)
+        return TTLCache.key(*parts)
+
+    def describe(self, sql_database, table):
+        info = sql_database.get_single_table_info(table)
+
+        samples = ""
+        try:
+            with sql_database.engine.connect() as connection:
+                rows = connection.execute(select(sql_database.metadata_obj.tables[table]).limit(3)).fetchall()
+            samples = " Sample rows: " + "; ".join(str(tuple(sql_database.truncate_word(column, length=50) for column in row)) for row in rows)
+        except Exception:
+            pass
+
+        return info + samples
+
+    def embed(self, texts, query=False):
+        embedding = self.brain.getEmbedding(self.project.model.embeddings)
+        if query:
+            return [embedding.get_query_embedding(text) for text in texts]
+        return embedding.get_text_embedding_batch(texts)
+
+    def refresh(self):
+        sql_database = self.brain.getSQLDatabase(self.project.model.connection)
+
+        existing = self.collection.get(include=["metadatas"])
+        known = {id: metadata.get("fingerprint") for id, metadata in zip(existing["ids"], existing["metadatas"])}
+
+        tables = sorted(sql_database.get_usable_table_names())
+
+        ids = []
+        documents = []
+        metadatas = []
+        for table in tables:
+            fingerprint = self.fingerprint(sql_database, table)
+            if known.get(table) != fingerprint:
+                ids.append(table)
+                documents.append(self.describe(sql_database, table))
+                metadatas.append({"table": table, "fingerprint": fingerprint})
+
+        removed = [id for id in known if id not in tables]
+        if removed:
+            self.collection.delete(ids=removed)
+
+        if ids:
+            self.collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=self.embed(documents))
+
+        self.refreshed = time.monotonic()
+        return len(ids)
+
+    def retrieve(self, question, k):
+        if self.collection.count() == 0:
+            self.refresh()
+        elif time.monotonic() - self.refreshed > RESTAI_SQL_SCHEMA_TTL:
+            self.refreshed = time.monotonic()
+            self.brain.executor.submit(self.refresh)
+
+        count = self.collection.count()
+        if count == 0:
+            return None
+
+        results = self.collection.query(query_embeddings=self.embed([question], query=True), n_results=min(k, count))
+
+        return results["ids"][0]
+
+    def reset(self):
+        self.client.delete_collection(self.project.model.name + "_schema")
+        self.collection = self.client.get_or_create_collection(name=self.project.model.name + "_schema")
+
+    @staticmethod
+    def delete(project):
+        try:
+            shutil.rmtree(FindEmbeddingsPath(project.model.name + "_schema"), ignore_errors=True)
+        except BaseException:
+            pass
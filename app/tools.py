@@ -26,6 +26,12 @@ def getLLMClass(llm_classname):
     elif llm_classname == "OllamaMultiModal2":
         from app.llms.ollamamultimodal import OllamaMultiModal2
         return OllamaMultiModal2
+    elif llm_classname == "LlamaCPP":
+        from app.llms.llamacpp import LlamaCPP
+        return LlamaCPP
+    elif llm_classname == "LLMGroup":
+        from app.llms.group import LLMGroup
+        return LLMGroup
     elif llm_classname == "OpenAI":
         from llama_index.llms.openai import OpenAI
         return OpenAI
@@ -7,7 +7,7 @@ import yake
 import re
 import time
 
-from app.config import EMBEDDINGS_PATH
+from app.config import EMBEDDINGS_PATH, RESTAI_CONTEXT_EXCLUDED_METADATA
 
 def findVectorDB(project):
     if project.model.vectorstore == "redis":
@@ -31,10 +31,16 @@ def IndexDocuments(project, documents, splitter="sentence", chunks=256):
         splitter_o = SentenceSplitter(
             separator=" ", paragraph_separator="\n", chunk_size=chunks, chunk_overlap=30)
 
+    excluded = RESTAI_CONTEXT_EXCLUDED_METADATA
+    if project.model.guard_label:
+        excluded = excluded + [project.model.guard_label]
+
     for document in documents:
         text_chunks = splitter_o.split_text(document.text)
 
-        doc_chunks = [Document(text=t, metadata=document.metadata)
+        doc_chunks = [Document(text=t, metadata=document.metadata,
+                               excluded_embed_metadata_keys=excluded,
+                               excluded_llm_metadata_keys=excluded)
                       for t in text_chunks]
 
         for doc_chunk in doc_chunks:
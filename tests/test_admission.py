@@ -0,0 +1,123 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+from starlette.responses import StreamingResponse
+
+from app.helper import release_after
+from app.llms.admission import Admission, AdmissionRejected, AdmittedLLM, hold
+from tests.test_llmgroup import StubLLM
+
+
+def admitted(max_concurrency=1, queue_depth=0, queue_timeout=1.0):
+    admission = Admission("stub")
+    admission.configure(max_concurrency, queue_depth, queue_timeout)
+    return admission, AdmittedLLM(StubLLM(name="stub"), admission)
+
+
+def test_rejectedWhenQueueFull():
+    admission, llm = admitted()
+    release = admission.tryAcquire()
+
+    try:
+        llm.complete("hi")
+        assert False
+    except AdmissionRejected as e:
+        assert e.retry_after >= 1
+    assert admission.rejected == 1
+
+    release()
+    assert llm.complete("hi").text == "stub"
+    assert admission.running == 0
+
+
+def test_queueTimeout():
+    admission, llm = admitted(queue_depth=1, queue_timeout=0.1)
+    release = admission.tryAcquire()
+
+    started = time.monotonic()
+    try:
+        llm.complete("hi")
+        assert False
+    except AdmissionRejected:
+        assert time.monotonic() - started >= 0.1
+
+    try:
+        asyncio.run(llm.acomplete("hi"))
+        assert False
+    except AdmissionRejected:
+        pass
+
+    assert admission.timeouts == 2
+    assert admission.waiting == 0
+    release()
+
+
+def test_queuedCallIsGranted():
+    admission, llm = admitted(queue_depth=1, queue_timeout=5)
+    release = admission.tryAcquire()
+    threading.Timer(0.05, release).start()
+
+    assert llm.complete("hi").text == "stub"
+    assert admission.running == 0
+    assert admission.admitted == 2
+
+
+def test_streamReleasedOnClose():
+    admission, llm = admitted()
+
+    gen = llm.stream_complete("hi")
+    assert next(gen).delta == "stub"
+    assert admission.running == 1
+    gen.close()
+    assert admission.running == 0
+
+    async def run():
+        gen = await llm.astream_complete("hi")
+        chunk = await gen.__anext__()
+        running = admission.running
+        await gen.aclose()
+        return chunk.delta, running
+
+    assert asyncio.run(run()) == ("stub", 1)
+    assert admission.running == 0
+
+
+def test_requestSlotIsShared():
+    admission, llm = admitted()
+    release = admission.tryAcquire()
+
+    def call():
+        hold("stub")
+        return llm.complete("hi").text
+
+    assert contextvars.copy_context().run(call) == "stub"
+    assert admission.running == 1
+    assert admission.rejected == 0
+    release()
+
+
+def test_unlimitedPassesThrough():
+    admission, llm = admitted(max_concurrency=None)
+
+    assert llm.complete("hi").text == "stub"
+    assert admission.admitted == 0
+
+
+def test_responseReleasedOnStreamClose():
+    released = []
+
+    async def lines():
+        yield "data: a\n\n"
+        yield "data: b\n\n"
+
+    async def run():
+        response = release_after(StreamingResponse(lines()), lambda: released.append(True))
+        body = response.body_iterator
+        first = await body.__anext__()
+        await body.aclose()
+        return first
+
+    assert asyncio.run(run()) == "data: a\n\n"
+    assert released == [True]
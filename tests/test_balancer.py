@@ -0,0 +1,135 @@
+import asyncio
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from llama_index.core.base.llms.types import ChatMessage
+
+from app.llms.balancer import OllamaBalancer
+from app.llms.ollama import Ollama
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write((json.dumps(chunk) + "\n").encode())
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self.reply([{"models": [{"name": model} for model in self.server.resident]}])
+        else:
+            self.reply([{"models": []}])
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        if body["stream"]:
+            self.reply([
+                {"message": {"role": "assistant", "content": "hello"}, "done": False},
+                {"message": {"role": "assistant", "content": ""}, "done": True},
+            ])
+        else:
+            self.reply([{"message": {"role": "assistant", "content": "hello"}, "done": True}])
+
+
+def stub(resident=()):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    server.requests = []
+    server.resident = list(resident)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d" % server.server_port
+
+
+def dead():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return "http://127.0.0.1:%d" % port
+
+
+def test_leastOutstanding():
+    balancer = OllamaBalancer(["http://a", "http://b", "http://c"], interval=0)
+    hosts = [balancer.acquire("llama3") for _ in range(3)]
+    assert len(set(host.url for host in hosts)) == 3
+
+    balancer.release(hosts[1])
+    assert balancer.acquire("llama3").url == hosts[1].url
+
+
+def test_prefersResident():
+    balancer = OllamaBalancer(["http://a", "http://b"], interval=0)
+    host = balancer.acquire("llama3")
+    balancer.release(host, "llama3", 300)
+
+    for _ in range(3):
+        chosen = balancer.acquire("llama3")
+        assert chosen.url == host.url
+        balancer.release(chosen)
+
+
+def test_keepAliveZeroIsNotResident():
+    balancer = OllamaBalancer(["http://a", "http://b"], interval=0)
+    host = balancer.acquire("llama3")
+    balancer.release(host, "llama3", 0)
+    assert balancer.status()[0]["models"] == [] and balancer.status()[1]["models"] == []
+
+
+def test_failoverEjectsDeadHost():
+    server, url = stub()
+    down = dead()
+    llm = Ollama(model="llama3", hosts=[down, url])
+    messages = [ChatMessage(role="user", content="hi")]
+
+    for _ in range(2):
+        assert llm.chat(messages).message.content == "hello"
+
+    status = {host["host"]: host for host in llm.balancer.status()}
+    assert status[down]["healthy"] is False
+    assert status[url]["healthy"] is True
+    assert status[url]["inflight"] == 0
+    assert len(server.requests) == 2
+    server.shutdown()
+
+
+def test_asyncStreamFailover():
+    server, url = stub()
+    down = dead()
+    llm = Ollama(model="llama3", hosts=[down, url], keep_alive=60)
+    messages = [ChatMessage(role="user", content="hi")]
+
+    async def run():
+        return [chunk.delta async for chunk in await llm.astream_chat(messages)]
+
+    assert asyncio.run(run()) == ["hello"]
+    status = {host["host"]: host for host in llm.balancer.status()}
+    assert status[url]["models"] == ["llama3"]
+    assert status[url]["inflight"] == 0
+    server.shutdown()
+
+
+def test_healthCheck():
+    server, url = stub(resident=["llava:13b"])
+    down = dead()
+    balancer = OllamaBalancer([url, down], interval=0)
+
+    with httpx.Client(timeout=5) as client:
+        for host in balancer.hosts:
+            host.healthy = False
+            balancer.check(host, client)
+
+    status = {host["host"]: host for host in balancer.status()}
+    assert status[url]["healthy"] is True
+    assert status[url]["models"] == ["llava:13b"]
+    assert status[down]["healthy"] is False
+    assert balancer.acquire("llava:13b").url == url
+    server.shutdown()
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from fastapi import HTTPException
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app import helper
+from app.budget import Budget, StageTimes
+from app.models.models import QuestionModel
+from app.projects.rag import RAG
+
+
+def rag(times=None):
+    brain = SimpleNamespace(stageTimes=times or StageTimes())
+    project = SimpleNamespace(model=SimpleNamespace(name="docs"))
+    return RAG(brain), project, brain.stageTimes
+
+
+def nodes(count):
+    return [NodeWithScore(node=TextNode(text=str(i)), score=1 - i / 10) for i in range(count)]
+
+
+def test_budget():
+    assert Budget(None, time.monotonic()).remaining() == float("inf")
+
+    budget = Budget(2, time.monotonic() - 0.5)
+    assert 1.4 < budget.remaining() <= 1.5
+
+    budget.skip("k")
+    assert budget.skipped == ["k"]
+
+
+def test_stageTimes():
+    times = StageTimes()
+
+    assert times.estimate("docs", "generation") == 5.0
+    assert times.estimate("docs", "ColbertRerank", 4) == 0.4
+    assert times.estimate("docs", "SimilarityPostprocessor") == 0.0
+
+    times.observe("docs", "ColbertRerank", 2.0, 4)
+    assert times.estimate("docs", "ColbertRerank", 2) == 1.0
+    times.observe("docs", "ColbertRerank", 1.5, 1)
+    assert times.estimate("docs", "ColbertRerank") == 0.8 * 0.5 + 0.2 * 1.5
+
+
+def test_degradeKeepsStagesThatFit():
+    logic, project, _ = rag()
+    budget = Budget(60, time.monotonic())
+
+    assert logic.degrade(project, budget, 4, True, True) == (4, True, True)
+    assert budget.skipped == []
+
+
+def test_degradeDropsInOrder():
+    times = StageTimes()
+    for stage, seconds in [("retrieval", 0.01), ("generation", 1.0), ("ColbertRerank", 0.1), ("ParallelLLMRerank", 0.5)]:
+        times.observe("docs", stage, seconds)
+    logic, project, _ = rag(times)
+
+    budget = Budget(3, time.monotonic())
+    assert logic.degrade(project, budget, 4, True, True) == (4, True, False)
+    assert budget.skipped == ["llm_rerank"]
+
+    budget = Budget(1.5, time.monotonic())
+    assert logic.degrade(project, budget, 4, True, True) == (4, False, False)
+    assert budget.skipped == ["llm_rerank", "colbert_rerank"]
+
+
+def test_degradeHalvesUntilFit():
+    times = StageTimes()
+    times.observe("docs", "retrieval", 0.1)
+    times.observe("docs", "generation", 1.0)
+    logic, project, _ = rag(times)
+
+    budget = Budget(1.25, time.monotonic())
+    assert logic.degrade(project, budget, 8, False, False) == (2, False, False)
+    assert budget.skipped == ["k"]
+
+    budget = Budget(0.5, time.monotonic())
+    assert logic.degrade(project, budget, 8, False, False) == (1, False, False)
+    assert budget.skipped == ["k"]
+
+
+def test_coldProjectShedsRerank():
+    logic, project, _ = rag()
+    budget = Budget(6, time.monotonic())
+
+    assert logic.degrade(project, budget, 2, True, True) == (2, True, False)
+    assert budget.skipped == ["llm_rerank"]
+
+
+class SlowRerank:
+    top_n = 2
+    called = False
+
+    def class_name(self):
+        return "ColbertRerank"
+
+    def postprocess_nodes(self, nodes, query_bundle=None):
+        self.called = True
+        return nodes[:self.top_n]
+
+
+def test_retrieveRechecksBudget():
+    times = StageTimes()
+    times.observe("docs", "generation", 1.0)
+    times.observe("docs", "ColbertRerank", 0.1)
+    logic, project, _ = rag(times)
+    retriever = SimpleNamespace(retrieve=lambda query: nodes(4))
+
+    rerank = SlowRerank()
+    budget = Budget(10, time.monotonic())
+    assert len(logic.retrieve(project, retriever, [rerank], QueryBundle("q"), budget)) == 2
+    assert rerank.called and budget.skipped == []
+
+    rerank = SlowRerank()
+    budget = Budget(1.2, time.monotonic())
+    result = logic.retrieve(project, retriever, [rerank], QueryBundle("q"), budget)
+    assert [node.node.text for node in result] == ["0", "1"]
+    assert not rerank.called
+    assert budget.skipped == ["colbert_rerank"]
+
+
+def question(headers, body=None):
+    request = SimpleNamespace(headers=headers)
+    return asyncio.run(helper.question_main(request, None, None, body or QuestionModel(question="hi"), None, None))
+
+
+def test_budgetHeader(monkeypatch):
+    async def nothing(*args):
+        return lambda: None
+
+    async def answer(request, brain, project, input, user, db):
+        return input.budget
+
+    monkeypatch.setattr(helper, "check_llm", nothing)
+    monkeypatch.setattr(helper, "admit_llm", nothing)
+    monkeypatch.setattr(helper, "question_project", answer)
+    monkeypatch.setattr(helper, "release_after", lambda response, release: response)
+
+    assert question({"X-Latency-Budget": "1.5"}) == 1.5
+    assert question({"X-Latency-Budget": "1.5"}, QuestionModel(question="hi", budget=3)) == 3
+    assert question({}) is None
+
+    for value in ["fast", "0", "-1"]:
+        try:
+            question({"X-Latency-Budget": value})
+            assert False
+        except HTTPException as e:
+            assert e.status_code == 400
@@ -0,0 +1,102 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any
+
+from fastapi.testclient import TestClient
+from llama_index.core.base.llms.types import ChatMessage, CompletionResponse, LLMMetadata
+from llama_index.core.llms.custom import CustomLLM
+
+from app.cascade import Cascade, CascadeStats
+
+
+class ScriptedLLM(CustomLLM):
+    replies: list
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="scripted")
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.replies.pop(0))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError()
+
+
+def cascade(replies, threshold=0.7):
+    brain = SimpleNamespace(
+        cascadeStats=CascadeStats(),
+        getLLM=lambda name, db, admit=False: SimpleNamespace(llm=ScriptedLLM(replies=list(replies))),
+    )
+    project = SimpleNamespace(model=SimpleNamespace(name="project", cascade_llm="cheap", cascade_threshold=threshold))
+    return Cascade(project, brain, None), brain.cascadeStats
+
+
+def answer(logic):
+    return asyncio.run(logic.aanswer("What is the capital of France?", [ChatMessage(role="user", content="What is the capital of France?")]))
+
+
+def test_cheapAnswerKept():
+    logic, stats = cascade(["The capital of France is Paris.", "9"])
+
+    assert answer(logic).message.content == "The capital of France is Paris."
+    assert stats.metrics()[0]["cheap"] == 1
+
+
+def test_escalation():
+    for replies, reason in [
+        (["Paris."], "length"),
+        (["I'm not sure, maybe it is Paris or Lyon."], "unsure"),
+        (["The capital of France is Marseille.", "3"], "rating"),
+        (["The capital of France is Marseille.", "no idea"], "rating"),
+    ]:
+        logic, stats = cascade(replies)
+        assert answer(logic) is None
+        assert stats.metrics()[0]["reasons"] == {reason: 1}
+
+
+def test_ratingSkippedWithoutThreshold():
+    logic, _ = cascade(["The capital of France is Paris."], threshold=0)
+
+    assert answer(logic) is not None
+
+
+def test_verdict():
+    logic, _ = cascade([])
+
+    assert logic.verdict("8/10") is None
+    assert logic.verdict("Rating: 7") is None
+    assert logic.verdict("6.5") == "rating"
+    assert logic.verdict("12") is None
+    assert logic.verdict("") == "rating"
+
+
+def test_metrics():
+    stats = CascadeStats()
+    stats.record("a", None, 1.0)
+    stats.record("a", "rating", 3.0)
+    stats.record("a", "rating", 2.0)
+
+    assert stats.metrics() == [{
+        "project": "a",
+        "cheap": 1,
+        "escalated": 2,
+        "reasons": {"rating": 2},
+        "cheap_rate": 1 / 3,
+        "cheap_latency_avg": 2.0,
+    }]
+
+
+def test_metricsEndpoint():
+    from app import main
+    from app.auth import get_current_username_admin
+
+    main.brain.cascadeStats.record("endpoint", "length", 0.5)
+    main.app.dependency_overrides[get_current_username_admin] = lambda: SimpleNamespace(username="admin", is_admin=True)
+    try:
+        response = TestClient(main.app).get("/metrics/cascade")
+    finally:
+        main.app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert {"project": "endpoint", "cheap": 0, "escalated": 1, "reasons": {"length": 1}, "cheap_rate": 0, "cheap_latency_avg": 0.5} in response.json()
@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from llama_index.core.base.llms.types import ChatMessage, CompletionResponse, LLMMetadata, MessageRole
+from llama_index.core.llms.custom import CustomLLM
+
+from app.chat import SummaryMemoryBuffer
+
+
+class SummaryLLM(CustomLLM):
+    prompts: list = []
+    fail: bool = False
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="summary")
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        if self.fail:
+            raise Exception("summary failed")
+        self.prompts.append(prompt)
+        return CompletionResponse(text="summary " + str(len(self.prompts)))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError()
+
+
+def buffer(**kwargs):
+    return SummaryMemoryBuffer(token_limit=kwargs.pop("token_limit", 1000), tokenizer_fn=str.split, **kwargs)
+
+
+def talk(memory, turns):
+    for i in range(1, turns + 1):
+        memory.put(ChatMessage(role=MessageRole.USER, content=f"question {i} about something"))
+        memory.put(ChatMessage(role=MessageRole.ASSISTANT, content=f"answer {i} about something"))
+
+
+def contents(messages):
+    return [message.content for message in messages]
+
+
+def test_olderTurnsSummarized():
+    llm = SummaryLLM(prompts=[])
+    memory = buffer(llm=llm, keep=2)
+
+    talk(memory, 3)
+
+    assert len(llm.prompts) == 2
+    assert "question 1" in llm.prompts[0] and "question 2" not in llm.prompts[0]
+    assert "summary 1" in llm.prompts[1] and "answer 2" in llm.prompts[1] and "question 3" not in llm.prompts[1]
+
+    messages = memory.get()
+    assert messages[0].role == MessageRole.SYSTEM
+    assert messages[0].content.endswith("summary 2")
+    assert contents(messages[1:]) == ["question 3 about something", "answer 3 about something"]
+    assert len(memory.get_all()) == 6
+
+
+def test_summarizedOnExecutor():
+    llm = SummaryLLM(prompts=[])
+    executor = ThreadPoolExecutor(max_workers=1)
+    memory = buffer(llm=llm, keep=2, executor=executor)
+
+    talk(memory, 2)
+    memory._pending.result()
+
+    assert contents(memory.get())[0].endswith("summary 1")
+    executor.shutdown(wait=True)
+
+
+def test_failedSummaryKeepsHistory():
+    memory = buffer(llm=SummaryLLM(prompts=[], fail=True), keep=2)
+
+    talk(memory, 3)
+
+    assert len(memory.get()) == 6
+
+
+def test_setResetsSummary():
+    memory = buffer(llm=SummaryLLM(prompts=[]), keep=2)
+    talk(memory, 3)
+
+    memory.set(memory.get_all()[:2])
+
+    assert contents(memory.get()) == ["question 1 about something", "answer 1 about something"]
+
+
+def test_truncatedToTokenLimit():
+    memory = buffer(token_limit=8)
+    talk(memory, 3)
+
+    assert contents(memory.get()) == ["question 3 about something", "answer 3 about something"]
+    assert contents(memory.get(initial_token_count=4)) == []
+
+    # an answer can't open the history
+    memory = buffer(token_limit=12)
+    talk(memory, 3)
+    assert contents(memory.get()) == ["question 3 about something", "answer 3 about something"]
+
+    memory = buffer(token_limit=16)
+    talk(memory, 3)
+    assert len(memory.get()) == 4
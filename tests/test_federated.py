@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app.projects import federated
+from app.projects.federated import Federated
+
+
+def nodes(*pairs):
+    return [NodeWithScore(node=TextNode(text=text), score=score) for text, score in pairs]
+
+
+def texts(merged):
+    return [(name, node.node.text) for name, node in merged]
+
+
+def test_mergeNormalized(monkeypatch):
+    monkeypatch.setattr(federated, "RESTAI_FEDERATED_MERGE", "normalized")
+    results = [
+        ("a", nodes(("a1", 0.9), ("a2", 0.5), ("a3", 0.1))),
+        ("b", nodes(("b1", 0.3), ("b2", 0.2))),
+        ("c", []),
+    ]
+
+    assert texts(Federated(None).merge(results, 3)) == [("a", "a1"), ("b", "b1"), ("a", "a2")]
+
+
+def test_mergeRRF(monkeypatch):
+    monkeypatch.setattr(federated, "RESTAI_FEDERATED_MERGE", "rrf")
+    results = [
+        ("a", nodes(("a1", 0.9), ("shared", 0.8))),
+        ("b", nodes(("b1", 0.3), ("shared", 0.2))),
+    ]
+
+    merged = texts(Federated(None).merge(results, 2))
+
+    assert merged[0] == ("a", "shared")
+    assert merged[1] in [("a", "a1"), ("b", "b1")]
+
+
+def test_membersSkipsInaccessible():
+    projects = {
+        "mine": SimpleNamespace(model=SimpleNamespace(name="mine", type="rag"), vector=object()),
+        "theirs": SimpleNamespace(model=SimpleNamespace(name="theirs", type="rag"), vector=object()),
+        "sql": SimpleNamespace(model=SimpleNamespace(name="sql", type="ragsql"), vector=None),
+    }
+    brain = SimpleNamespace(findProject=lambda name, db: projects.get(name))
+    project = SimpleNamespace(model=SimpleNamespace(members="mine, theirs, sql, missing"))
+
+    user = SimpleNamespace(username="user", is_admin=False, projects=[SimpleNamespace(name="mine"), SimpleNamespace(name="sql")])
+    assert [member.model.name for member in Federated(brain).members(project, user, None)] == ["mine"]
+
+    admin = SimpleNamespace(username="admin", is_admin=True, projects=[])
+    assert [member.model.name for member in Federated(brain).members(project, admin, None)] == ["mine", "theirs"]
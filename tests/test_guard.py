@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from app.projects.base import ProjectBase
+
+
+def verdict(blocked=None):
+    guard = Future()
+    if blocked is not None:
+        guard.set_result(blocked)
+    return guard
+
+
+def resolving(guard, blocked, items):
+    for i, item in enumerate(items):
+        if i == 1:
+            guard.set_result(blocked)
+        yield item
+
+
+class Closing:
+    def __init__(self, items):
+        self.items = iter(items)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.items)
+
+    def close(self):
+        self.closed = True
+
+
+def test_guardedBlockedSkipsGeneration():
+    calls = []
+    base = ProjectBase(None)
+
+    assert base.guarded(verdict(True), calls.append, "hi") == (True, None)
+    assert calls == []
+
+
+def test_guardedDropsLateBlock():
+    base = ProjectBase(None)
+    guard = verdict()
+
+    def generate():
+        threading.Timer(0.05, guard.set_result, [True]).start()
+        return "answer"
+
+    assert base.guarded(guard, generate) == (True, None)
+    assert base.guarded(verdict(False), lambda: "answer") == (False, "answer")
+
+
+def test_guardedStreamHoldsUntilVerdict():
+    base = ProjectBase(None)
+
+    guard = verdict()
+    assert list(base.guardedStream(guard, resolving(guard, False, ["a", "b", "c"]))) == ["a", "b", "c"]
+
+    guard = verdict()
+    assert list(base.guardedStream(guard, resolving(guard, True, ["a", "b", "c"]))) == []
+
+
+def test_guardedStreamClosesGenerator():
+    base = ProjectBase(None)
+    gen = Closing(["a", "b", "c"])
+
+    assert list(base.guardedStream(verdict(True), gen)) == []
+    assert gen.closed
+
+
+def test_aguardedStreamHoldsUntilVerdict():
+    base = ProjectBase(None)
+
+    async def items(guard, blocked):
+        for i, item in enumerate(["a", "b", "c"]):
+            if i == 1:
+                guard.set_result(blocked)
+            yield item
+
+    async def run(blocked):
+        guard = verdict()
+        return [item async for item in base.aguardedStream(guard, items(guard, blocked))]
+
+    assert asyncio.run(run(False)) == ["a", "b", "c"]
+    assert asyncio.run(run(True)) == []
+
+
+def test_aguardedStreamReleasesHeldItems():
+    base = ProjectBase(None)
+
+    async def items():
+        yield "a"
+        yield "b"
+
+    async def run():
+        guard = verdict()
+        asyncio.get_running_loop().call_later(0.05, guard.set_result, False)
+        return [item async for item in base.aguardedStream(guard, items())]
+
+    assert asyncio.run(run()) == ["a", "b"]
+
+
+def test_aguardedCancelsGeneration():
+    base = ProjectBase(None)
+    cancelled = []
+
+    async def generate():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "answer"
+
+    async def blocked():
+        guard = verdict()
+        asyncio.get_running_loop().call_later(0.05, guard.set_result, True)
+        result = await base.aguarded(guard, generate())
+        await asyncio.sleep(0)
+        return result if cancelled else None
+
+    async def abandoned():
+        task = asyncio.ensure_future(base.aguarded(verdict(), generate()))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+        return len(cancelled)
+
+    assert asyncio.run(blocked()) == (True, None)
+    assert cancelled == [True]
+    assert asyncio.run(abandoned()) == 2
+
+
+def test_aguardedAnswers():
+    base = ProjectBase(None)
+
+    async def generate():
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run(delay):
+        guard = verdict()
+        asyncio.get_running_loop().call_later(delay, guard.set_result, False)
+        return await base.aguarded(guard, generate())
+
+    assert asyncio.run(run(0)) == (False, "answer")
+    assert asyncio.run(run(0.05)) == (False, "answer")
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from llama_index.core.base.llms.types import CompletionResponse, LLMMetadata
+from llama_index.core.llms.custom import CustomLLM
+
+from app.llms.group import LLMGroup
+
+
+class StubLLM(CustomLLM):
+    name: str
+    delay: float = 0
+    fail: bool = False
+    calls: int = 0
+    cancelled: int = 0
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.name)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise Exception(self.name + " failed")
+        return CompletionResponse(text=self.name)
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise Exception(self.name + " failed")
+        for token in [self.name, "!"]:
+            yield CompletionResponse(text=token, delta=token)
+
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise Exception(self.name + " failed")
+        return CompletionResponse(text=self.name)
+
+    async def astream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        self.calls += 1
+
+        async def gen():
+            try:
+                await asyncio.sleep(self.delay)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            if self.fail:
+                raise Exception(self.name + " failed")
+            for token in [self.name, "!"]:
+                yield CompletionResponse(text=token, delta=token)
+
+        return gen()
+
+
+def test_primaryAnswers():
+    primary, secondary = StubLLM(name="primary"), StubLLM(name="secondary")
+    group = LLMGroup(members=[primary, secondary], hedge_delay=1)
+
+    assert group.complete("hi").text == "primary"
+    assert secondary.calls == 0
+
+
+def test_failover():
+    group = LLMGroup(members=[StubLLM(name="primary", fail=True), StubLLM(name="secondary")], hedge_delay=1)
+
+    assert group.complete("hi").text == "secondary"
+    assert asyncio.run(group.acomplete("hi")).text == "secondary"
+
+
+def test_allFail():
+    group = LLMGroup(members=[StubLLM(name="primary", fail=True), StubLLM(name="secondary", fail=True)], hedge_delay=1)
+
+    try:
+        group.complete("hi")
+        assert False
+    except Exception as e:
+        assert "failed" in str(e)
+
+
+def test_hedge():
+    slow, fast = StubLLM(name="slow", delay=2), StubLLM(name="fast")
+    group = LLMGroup(members=[slow, fast], hedge_delay=0.1)
+
+    started = time.monotonic()
+    assert group.complete("hi").text == "fast"
+    assert time.monotonic() - started < 1
+
+
+def test_asyncHedgeCancelsLoser():
+    slow, fast = StubLLM(name="slow", delay=2), StubLLM(name="fast")
+    group = LLMGroup(members=[slow, fast], hedge_delay=0.1)
+
+    async def run():
+        response = await group.acomplete("hi")
+        await asyncio.sleep(0)
+        return response
+
+    started = time.monotonic()
+    assert asyncio.run(run()).text == "fast"
+    assert time.monotonic() - started < 1
+    assert slow.cancelled == 1
+    assert len(group._latencies[0]) == 1
+
+
+def test_streamHedge():
+    slow, fast = StubLLM(name="slow", delay=2), StubLLM(name="fast")
+    group = LLMGroup(members=[slow, fast], hedge_delay=0.1)
+
+    assert [chunk.delta for chunk in group.stream_complete("hi")] == ["fast", "!"]
+
+    async def run():
+        return [chunk.delta async for chunk in await group.astream_complete("hi")]
+
+    assert asyncio.run(run()) == ["fast", "!"]
+
+
+def test_p95Delay():
+    group = LLMGroup(members=[StubLLM(name="primary", delay=0.01), StubLLM(name="secondary")], hedge_delay=5, hedge_samples=5)
+
+    for _ in range(5):
+        group.complete("hi")
+
+    assert group.hedgeDelay(0) < 1
+    assert group.hedgeDelay(1) == 5
+
+
+def test_sharedExecutor():
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="shared")
+    names = []
+
+    class NamedLLM(StubLLM):
+        def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+            names.append(threading.current_thread().name)
+            return super().complete(prompt, formatted=formatted, **kwargs)
+
+    group = LLMGroup(members=[NamedLLM(name="primary")], executor=executor)
+
+    assert group.complete("hi").text == "primary"
+    assert names[0].startswith("shared")
+    executor.shutdown(wait=True)
@@ -0,0 +1,68 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from app.postprocessors.packer import ContextPacker, shingles
+from app.tools import tokens_from_string
+
+
+def node(text, score, **metadata):
+    return NodeWithScore(node=TextNode(text=text, metadata=metadata), score=score)
+
+
+def texts(nodes):
+    return [node.node.text for node in nodes]
+
+
+PARIS = "Paris is the capital and largest city of France, on the river Seine."
+ROME = "Rome is the capital city of Italy and of the Lazio region."
+BERLIN = "Berlin is the capital and largest city of Germany by population."
+
+
+def test_shingles():
+    assert shingles("a b") == {"a b"}
+    assert shingles("A b c d") == {"a b c", "b c d"}
+
+
+def test_duplicatesDropped():
+    nodes = [node(PARIS, 0.9), node(PARIS + " It is", 0.8), node(ROME, 0.7)]
+
+    assert texts(ContextPacker(token_budget=1000).postprocess_nodes(nodes)) == [PARIS, ROME]
+    assert len(ContextPacker(token_budget=1000, duplicate_threshold=1).postprocess_nodes(nodes)) == 3
+    assert len(ContextPacker(token_budget=1000, duplicate_threshold=0.95).postprocess_nodes(nodes)) == 3
+
+
+def test_scoreGap():
+    nodes = [node(ROME, 0.5), node(PARIS, 0.9), node(BERLIN, 0.85)]
+
+    assert texts(ContextPacker(token_budget=1000, score_gap=0.3).postprocess_nodes(nodes)) == [PARIS, BERLIN]
+    assert texts(ContextPacker(token_budget=1000).postprocess_nodes(nodes)) == [PARIS, BERLIN, ROME]
+
+    # relative to the top score, so it works for reranker scales too
+    scaled = [node(ROME, 5), node(PARIS, 9), node(BERLIN, 8.5)]
+    assert texts(ContextPacker(token_budget=1000, score_gap=0.3).postprocess_nodes(scaled)) == [PARIS, BERLIN]
+
+
+def test_tokenBudget():
+    nodes = [node(PARIS, 0.9), node("word " * 200, 0.8), node(ROME, 0.7)]
+    budget = tokens_from_string(PARIS) + tokens_from_string(ROME)
+
+    assert texts(ContextPacker(token_budget=budget).postprocess_nodes(nodes)) == [PARIS, ROME]
+
+
+def test_minNodesOverBudget():
+    nodes = [node(PARIS, 0.9), node(ROME, 0.8)]
+
+    assert texts(ContextPacker(token_budget=0).postprocess_nodes(nodes)) == [PARIS]
+    assert texts(ContextPacker(token_budget=0, min_nodes=2).postprocess_nodes(nodes)) == [PARIS, ROME]
+
+
+def test_excludedMetadataCounted():
+    source = "https://example.com/" + "x" * 400
+    budget = 2 * (tokens_from_string(PARIS) + 10)
+
+    nodes = [node(ROME, 1.0), node(PARIS, 0.9, source=source)]
+    assert texts(ContextPacker(token_budget=budget).postprocess_nodes(nodes)) == [ROME]
+
+    nodes = [node(ROME, 1.0), node(PARIS, 0.9, source=source)]
+    result = ContextPacker(token_budget=budget, excluded_metadata_keys=["source"]).postprocess_nodes(nodes)
+    assert texts(result) == [ROME, PARIS]
+    assert "source" in result[1].node.excluded_llm_metadata_keys
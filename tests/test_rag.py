@@ -0,0 +1,114 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Sequence
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.llms.types import ChatMessage, ChatResponse, CompletionResponse, LLMMetadata, MessageRole
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms.custom import CustomLLM
+from llama_index.core.schema import TextNode
+
+from app.budget import StageTimes
+from app.helper import disconnectable
+from app.memory import Recollection
+from app.models.models import ChatModel
+from app.projects.rag import RAG
+
+
+class CountingLLM(CustomLLM):
+    chunks: int = 50
+    produced: int = 0
+    closed: bool = False
+    seen: list = []
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="counting", context_window=4096, num_output=256)
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text="answer")
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError()
+
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        self.seen = list(messages)
+        return ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content="answer"))
+
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any):
+        self.seen = list(messages)
+
+        async def gen():
+            try:
+                for i in range(self.chunks):
+                    await asyncio.sleep(0.01)
+                    self.produced += 1
+                    yield ChatResponse(message=ChatMessage(role=MessageRole.ASSISTANT, content=""), delta=str(i))
+            finally:
+                self.closed = True
+
+        return gen()
+
+
+def rag(llm):
+    nodes = [TextNode(text=text, metadata={"source": "doc", "keywords": ""}) for text in ["Paris is in France.", "Rome is in Italy."]]
+    index = VectorStoreIndex(nodes, embed_model=MockEmbedding(embed_dim=8))
+
+    model = SimpleNamespace(llm=llm)
+    brain = SimpleNamespace(
+        getLLM=lambda name, db, check=True, admit=False: model,
+        summaryLLM=lambda db: None,
+        memories=Recollection(),
+        stageTimes=StageTimes(),
+        defaultSystem="",
+        defaultCensorship="I don't know.",
+        executor=None,
+    )
+    project = SimpleNamespace(
+        model=SimpleNamespace(name="docs", llm="counting", guard=None, system="Be brief.", score=None, k=2, colbert_rerank=False, llm_rerank=False, censorship=None),
+        vector=SimpleNamespace(index=index),
+        cache=None,
+    )
+    return RAG(brain), project
+
+
+def test_chatRemembersAnswer():
+    llm = CountingLLM()
+    logic, project = rag(llm)
+
+    async def run():
+        return [line async for line in logic.achat(project, ChatModel(question="Where is Paris?", id="chat"), None, None)]
+
+    output = asyncio.run(run())[0]
+
+    assert output["answer"] == "answer"
+    assert len(output["sources"]) == 2
+    assert llm.seen[0].content.startswith("Be brief.\nContext information is below.")
+    assert "Paris is in France." in llm.seen[0].content
+
+    asyncio.run(run())
+    assert [message.content for message in llm.seen[1:]] == ["Where is Paris?", "answer", "Where is Paris?"]
+
+
+def test_chatDisconnectStopsGeneration():
+    llm = CountingLLM()
+    logic, project = rag(llm)
+    disconnected = []
+
+    async def is_disconnected():
+        return len(disconnected) >= 2
+
+    request = SimpleNamespace(is_disconnected=is_disconnected)
+    user = SimpleNamespace(username="user")
+
+    async def run():
+        output = logic.achat(project, ChatModel(question="Where is Paris?", stream=True), user, None)
+        async for line in disconnectable(request, output, user, project):
+            disconnected.append(line)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+
+    assert disconnected == ["data: 0\n\n", "data: 1\n\n"]
+    assert llm.closed
+    assert llm.produced == 3
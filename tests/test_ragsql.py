@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+from llama_index.core.utilities.sql_wrapper import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from app.projects import ragsql
+from app.projects.ragsql import RAGSql
+
+
+def database(tmp_path, rows=25):
+    engine = create_engine("sqlite:///" + str(tmp_path / "test.db"))
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)"))
+        for i in range(rows):
+            connection.execute(text("INSERT INTO items (id, name) VALUES (:id, :name)"), {"id": i, "name": "item" + str(i)})
+    return SQLDatabase(engine)
+
+
+def logic():
+    return RAGSql(SimpleNamespace(sqlResultCache=None)), SimpleNamespace(model=SimpleNamespace(connection="sqlite://"))
+
+
+def test_executeRowLimit(tmp_path, monkeypatch):
+    monkeypatch.setattr(ragsql, "RESTAI_SQL_MAX_ROWS", 10)
+    monkeypatch.setattr(ragsql, "RESTAI_SQL_BATCH", 3)
+    sql_database = database(tmp_path)
+    projLogic, _ = logic()
+
+    rows, columns, truncated = projLogic.execute(sql_database, "SELECT id, name FROM items ORDER BY id")
+    assert columns == ["id", "name"]
+    assert [row[0] for row in rows] == list(range(10))
+    assert truncated
+
+    rows, _, truncated = projLogic.execute(sql_database, "SELECT id FROM items WHERE id < 10")
+    assert len(rows) == 10
+    assert not truncated
+
+
+def test_executeTimeout(tmp_path, monkeypatch):
+    monkeypatch.setattr(ragsql, "RESTAI_SQL_TIMEOUT", 0)
+    monkeypatch.setattr(ragsql, "RESTAI_SQL_BATCH", 5)
+    sql_database = database(tmp_path)
+    projLogic, _ = logic()
+
+    rows, _, truncated = projLogic.execute(sql_database, "SELECT id FROM items")
+    assert len(rows) == 5
+    assert truncated
+
+
+def test_runSQL(tmp_path, monkeypatch):
+    monkeypatch.setattr(ragsql, "RESTAI_SQL_MAX_ROWS", 2)
+    monkeypatch.setattr(ragsql, "RESTAI_SQL_RESULT_TTL", 0)
+    sql_database = database(tmp_path)
+    projLogic, project = logic()
+
+    nodes, truncated, ok = projLogic.runSQL(project, sql_database, "SELECT id, name FROM items ORDER BY id")
+    assert [node.node.text for node in nodes] == ["{'id': 0, 'name': 'item0'}", "{'id': 1, 'name': 'item1'}"]
+    assert truncated and ok
+
+    nodes, truncated, ok = projLogic.runSQL(project, sql_database, "SELECT * FROM missing")
+    assert nodes[0].node.text.startswith("Error:")
+    assert not truncated and not ok
+
+    nodes, _, ok = projLogic.runSQL(project, sql_database, "DELETE FROM items")
+    assert nodes == [] and not ok
+    assert len(projLogic.execute(sql_database, "SELECT id FROM items")[0]) == 2
@@ -0,0 +1,52 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.llms import registry
+from app.llms.registry import ModelPulling, ModelRegistry
+
+
+class SlowClient:
+    def __init__(self, listed):
+        self.listed = listed
+
+    def list(self):
+        self.listed.wait(5)
+        return {"models": [{"name": "llama3:latest", "size": 10}]}
+
+    def pull(self, model, stream=True):
+        return iter([])
+
+
+def test_firstListingInBackground(monkeypatch):
+    listed = threading.Event()
+    monkeypatch.setattr(registry, "getClient", lambda host: SlowClient(listed))
+    executor = ThreadPoolExecutor(max_workers=2)
+    models = ModelRegistry(executor, interval=0)
+
+    started = time.monotonic()
+    assert models.isAvailable("http://a", "mistral")
+    assert time.monotonic() - started < 1
+
+    listed.set()
+    executor.shutdown(wait=True)
+
+    assert models.isAvailable("http://a", "llama3")
+    assert not models.isAvailable("http://a", "mistral")
+    assert models.size("llama3") == 10
+
+
+def test_ensurePullsMissing(monkeypatch):
+    listed = threading.Event()
+    listed.set()
+    monkeypatch.setattr(registry, "getClient", lambda host: SlowClient(listed))
+    executor = ThreadPoolExecutor(max_workers=1)
+    models = ModelRegistry(executor, interval=0)
+    models.refresh("http://a")
+
+    try:
+        models.ensure(["http://a"], "mistral")
+        assert False
+    except ModelPulling as e:
+        assert e.model == "mistral"
+    executor.shutdown(wait=True)
@@ -0,0 +1,96 @@
+import re
+import threading
+import time
+from typing import Any
+
+from llama_index.core.base.llms.types import CompletionResponse, LLMMetadata
+from llama_index.core.llms.custom import CustomLLM
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from app.cache import TTLCache
+from app.postprocessors.rerank import ParallelLLMRerank
+
+
+class RatingLLM(CustomLLM):
+    calls: list = []
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="rating")
+
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        # rates each document with the number in its text, the first batch answers last
+        documents = re.findall(r"Document (\d+):\n(\w+) (\d+)", prompt)
+        self.calls.append([name for _, name, _ in documents])
+        time.sleep(0.1 if len(self.calls) == 1 else 0)
+        return CompletionResponse(text="\n".join(
+            f"Doc: {number}, Relevance: {rating}" for number, _, rating in documents if rating != "0"))
+
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any):
+        raise NotImplementedError()
+
+
+def nodes(*ratings):
+    return [NodeWithScore(node=TextNode(text=f"n{i} {rating}", id_=f"n{i}"), score=0.5) for i, rating in enumerate(ratings)]
+
+
+def names(nodes):
+    return [node.node.node_id for node in nodes]
+
+
+def test_batchesKeepTheirScores():
+    llm = RatingLLM(calls=[])
+    rerank = ParallelLLMRerank(llm=llm, choice_batch_size=2, top_n=4, parallelism=3)
+
+    result = rerank.postprocess_nodes(nodes(2, 9, 5, 0, 7), QueryBundle("q"))
+
+    assert names(result) == ["n1", "n4", "n2", "n0"]
+    assert [node.score for node in result] == [9, 7, 5, 2]
+    assert sorted(llm.calls) == [["n0", "n1"], ["n2", "n3"], ["n4"]]
+
+
+threads = set()
+
+
+class ThreadedRerank(ParallelLLMRerank):
+
+    def rank(self, query, batch):
+        threads.add(threading.get_ident())
+        return super().rank(query, batch)
+
+
+def test_batchesRunInParallel():
+    rerank = ThreadedRerank(llm=RatingLLM(calls=[]), choice_batch_size=1, top_n=3, parallelism=3)
+    threads.clear()
+
+    rerank.postprocess_nodes(nodes(1, 2, 3), QueryBundle("q"))
+
+    assert len(threads) > 1
+
+
+def test_cachedScoresSkipTheLLM():
+    cache = TTLCache()
+    llm = RatingLLM(calls=[])
+    rerank = ParallelLLMRerank(llm=llm, choice_batch_size=2, top_n=3, cache=cache)
+
+    first = rerank.postprocess_nodes(nodes(3, 8), QueryBundle("q"))
+    assert len(llm.calls) == 1
+
+    second = rerank.postprocess_nodes(nodes(3, 8, 6), QueryBundle("q"))
+    assert llm.calls[1:] == [["n2"]]
+    assert names(first) == ["n1", "n0"]
+    assert names(second) == ["n1", "n2", "n0"]
+
+    rerank.postprocess_nodes(nodes(3, 8), QueryBundle("another"))
+    assert llm.calls[2:] == [["n0", "n1"]]
+
+
+def test_uncachedWithoutCache():
+    llm = RatingLLM(calls=[])
+    rerank = ParallelLLMRerank(llm=llm, choice_batch_size=2, top_n=2)
+
+    rerank.postprocess_nodes(nodes(3, 8), QueryBundle("q"))
+    rerank.postprocess_nodes(nodes(3, 8), QueryBundle("q"))
+
+    assert len(llm.calls) == 2
+    assert rerank.postprocess_nodes([], QueryBundle("q")) == []
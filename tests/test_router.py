@@ -0,0 +1,96 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+from starlette.responses import StreamingResponse
+
+from app import helper
+from app.brain import Brain
+from app.models.models import QuestionModel
+from app.projects.router import Router
+
+
+TOPICS = {"cats": [1, 0, 0], "dogs": [0, 1, 0], "cars": [0, 0, 1]}
+
+
+class StubEmbedding:
+    def vector(self, text):
+        return [sum(weights) for weights in zip(*[TOPICS[word] for word in text.split() if word in TOPICS])] or [1, 1, 1]
+
+    def get_text_embedding_batch(self, texts):
+        return [self.vector(text) for text in texts]
+
+    def get_query_embedding(self, text):
+        return self.vector(text)
+
+
+def router(fanout=1):
+    brain = Brain()
+    brain.embeddingCache["stub"] = StubEmbedding()
+    entrances = [SimpleNamespace(name=topic, description="questions about " + topic, destination=topic + "_project") for topic in TOPICS]
+    project = SimpleNamespace(model=SimpleNamespace(name="router", type="router", embeddings="stub", entrances=entrances, fanout=fanout))
+    return Router(brain), project
+
+
+def test_embeddingsSelect():
+    logic, project = router()
+
+    assert logic.embeddingsSelect(project, "dogs") == [1]
+    assert logic.route(project, QuestionModel(question="cars"), None) == ["cars_project"]
+    assert logic.embeddingsSelect(project, "cats dogs") is None
+
+
+def test_embeddingsSelectFanout():
+    logic, project = router(fanout=2)
+
+    assert sorted(logic.embeddingsSelect(project, "cats dogs", 2)) == [0, 1]
+    assert logic.embeddingsSelect(project, "cars", 2) == [2]
+
+
+def fanout(monkeypatch, answers):
+    async def destination(request, brain, name, input, user):
+        assert not input.stream
+        if isinstance(answers[name], Exception):
+            raise answers[name]
+        return dict(answers[name])
+
+    monkeypatch.setattr(helper, "question_destination", destination)
+    monkeypatch.setattr(Router, "question", lambda self, project, input, user, db: list(answers))
+
+    logic, project = router(fanout=len(answers))
+    return logic.brain, project
+
+
+ANSWERS = {
+    "cats_project": {"answer": "meow", "sources": [{"score": 0.4}], "tokens": {"input": 1, "output": 2}},
+    "dogs_project": {"answer": "woof", "sources": [{"score": 0.9}], "tokens": {"input": 3, "output": 4}},
+    "cars_project": Exception("down"),
+}
+
+
+def test_routerFanout(monkeypatch):
+    brain, project = fanout(monkeypatch, ANSWERS)
+    user = SimpleNamespace(username="admin")
+
+    output = asyncio.run(helper.question_router(None, brain, project, QuestionModel(question="pets"), user, None))
+
+    assert output["answer"] == "woof"
+    assert output["destinations"] == ["cats_project", "dogs_project"]
+    assert output["tokens"] == {"input": 4, "output": 6}
+
+
+def test_routerFanoutStream(monkeypatch):
+    brain, project = fanout(monkeypatch, ANSWERS)
+    user = SimpleNamespace(username="admin")
+
+    async def run():
+        response = await helper.question_router(None, brain, project, QuestionModel(question="pets", stream=True), user, None)
+        assert isinstance(response, StreamingResponse)
+        return [line async for line in response.body_iterator]
+
+    lines = asyncio.run(run())
+
+    assert lines[0] == "data: woof\n\n"
+    assert json.loads(lines[1][6:])["destinations"] == ["cats_project", "dogs_project"]
+    assert lines[2] == "event: close\n\n"
@@ -0,0 +1,61 @@
+import re
+from types import SimpleNamespace
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+from app.brain import Brain
+from app.vectordb import tools as vector_tools
+
+
+TOPICS = ["cats", "dogs", "cars"]
+
+
+class StubEmbedding:
+    def vector(self, text):
+        words = re.findall(r"[a-z]+", text.lower())
+        vector = np.array([words.count(topic) for topic in TOPICS], dtype=float) + 0.01
+        return list(vector / np.linalg.norm(vector))
+
+    def get_text_embedding_batch(self, texts):
+        return [self.vector(text) for text in texts]
+
+    def get_query_embedding(self, text):
+        return self.vector(text)
+
+
+def project(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_tools, "EMBEDDINGS_PATH", str(tmp_path / "embeddings"))
+
+    connection = "sqlite:///" + str(tmp_path / "test.db")
+    with create_engine(connection).begin() as db:
+        for topic in TOPICS:
+            db.execute(text(f"CREATE TABLE {topic} (id INTEGER PRIMARY KEY, name TEXT)"))
+            db.execute(text(f"INSERT INTO {topic} (name) VALUES ('{topic}')"))
+
+    brain = Brain()
+    brain.embeddingCache["stub"] = StubEmbedding()
+    return brain, SimpleNamespace(model=SimpleNamespace(name="sales", connection=connection, embeddings="stub"))
+
+
+def test_schemaRetrieve(tmp_path, monkeypatch):
+    brain, proj = project(tmp_path, monkeypatch)
+    index = brain.getSchemaIndex(proj)
+
+    assert index.retrieve("how many dogs are there?", 1) == ["dogs"]
+    assert sorted(index.retrieve("cars or cats?", 2)) == ["cars", "cats"]
+    assert index.refresh() == 0
+
+
+def test_schemaIndexCached(tmp_path, monkeypatch):
+    brain, proj = project(tmp_path, monkeypatch)
+    index = brain.getSchemaIndex(proj)
+    assert index.refresh() == 3
+
+    again = SimpleNamespace(model=proj.model)
+    assert brain.getSchemaIndex(again) is index
+    assert index.project is again
+
+    index.reset()
+    assert index.collection.count() == 0
+    assert index.retrieve("cats", 1) == ["cats"]